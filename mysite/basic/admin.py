@@ -1,7 +1,15 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth import get_permission_codename
 from django.db import models
+from django.db.models import F
+from . import masterdata
+from .bom import BomCycle, BomGraph
 from .models import Bom, Currency, Period, Supplier, Customer, Category, Part, Size, Material, Product
+from .importer import ImportMixin
+from .numbering import NumberedInlineFormSet
+from .search import SearchIndexMixin
+from .whereused import products_using, where_used
 
 admin.site.site_header = '进销存系统'
 
@@ -17,13 +25,15 @@ class CurencyAdmin(admin.ModelAdmin):
     view_on_site = False
 
 
-class SupplierAdmin(admin.ModelAdmin):
+class SupplierAdmin(SearchIndexMixin, masterdata.MasterDataChoicesMixin, admin.ModelAdmin):
     list_display = ['id', 'title', 'contacter', 'period', 'status']
+    list_select_related = ['period']
     fields = ['title', 'contacter', 'period', 'landline', 'mobile', 'wechat_account', 'email', 'address',
               'description']
     actions = ['make_audited', 'make_stopped']
     view_on_site = False
     list_filter = ['status']
+    search_kind = 'supplier'
     list_per_page = 10
     list_max_show_all = 100
 
@@ -55,13 +65,15 @@ class SupplierAdmin(admin.ModelAdmin):
 admin.site.register(Supplier, SupplierAdmin)
 
 
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(SearchIndexMixin, masterdata.MasterDataChoicesMixin, admin.ModelAdmin):
     list_display = ['id', 'title', 'contacter', 'period', 'status']
+    list_select_related = ['period']
     fields = ['title', 'contacter', 'period', 'landline', 'mobile', 'wechat_account', 'email', 'address',
               'description']
     actions = ['make_audited']
     view_on_site = False
     list_filter = ['status']
+    search_kind = 'customer'
     list_per_page = 10
     list_max_show_all = 100
 
@@ -104,6 +116,8 @@ class CategoryAdmin(admin.ModelAdmin):
 
     def make_audited(self, request, queryset):
         rows = queryset.update(status='A')
+        #update不会触发post_save，需自行失效基本资料快取
+        masterdata.invalidate(Category)
         if rows > 0:
             self.message_user(request, u'已完成审核动作')
     make_audited.allowed_permissions = ('audit',)
@@ -116,6 +130,8 @@ class CategoryAdmin(admin.ModelAdmin):
 
     def make_stopped(self, request, queryset):
         rows = queryset.update(status='S')
+        #update不会触发post_save，需自行失效基本资料快取
+        masterdata.invalidate(Category)
         if rows > 0:
             self.message_user(request, u'已完成终止动作')
     make_stopped.allowed_permissions = ('stop',)
@@ -141,6 +157,8 @@ class PartAdmin(admin.ModelAdmin):
 
     def make_audited(self, request, queryset):
         rows = queryset.update(status='A')
+        #update不会触发post_save，需自行失效基本资料快取
+        masterdata.invalidate(Part)
         if rows > 0:
             self.message_user(request, u'已完成审核动作')
     make_audited.allowed_permissions = ('audit',)
@@ -153,6 +171,8 @@ class PartAdmin(admin.ModelAdmin):
 
     def make_stopped(self, request, queryset):
         rows = queryset.update(status='S')
+        #update不会触发post_save，需自行失效基本资料快取
+        masterdata.invalidate(Part)
         if rows > 0:
             self.message_user(request, u'已完成终止动作')
     make_stopped.allowed_permissions = ('stop',)
@@ -178,6 +198,8 @@ class SizeAdmin(admin.ModelAdmin):
 
     def make_audited(self, request, queryset):
         rows = queryset.update(status='A')
+        #update不会触发post_save，需自行失效基本资料快取
+        masterdata.invalidate(Size)
         if rows > 0:
             self.message_user(request, u'已完成审核动作')
     make_audited.allowed_permissions = ('audit',)
@@ -190,6 +212,8 @@ class SizeAdmin(admin.ModelAdmin):
 
     def make_stopped(self, request, queryset):
         rows = queryset.update(status='S')
+        #update不会触发post_save，需自行失效基本资料快取
+        masterdata.invalidate(Size)
         if rows > 0:
             self.message_user(request, u'已完成终止动作')
     make_stopped.allowed_permissions = ('stop',)
@@ -204,16 +228,28 @@ class SizeAdmin(admin.ModelAdmin):
 admin.site.register(Size, SizeAdmin)
 
 
-class MaterialAdmin(admin.ModelAdmin):
+"""
+原料修改画面下方列出使用情况(where-used)：使用该原料的商品、未全部出货订单与尚未入库的制程单
+"""
+class MaterialAdmin(ImportMixin, SearchIndexMixin, masterdata.MasterDataChoicesMixin, admin.ModelAdmin):
     list_display = ['id', 'title', 'image_sub', 'supplier', 'category', 'tax_price', 'currency', 'stock', 'status']
+    list_select_related = ['supplier', 'category', 'currency']
     fields = ['title', 'image_sub', 'supplier', 'category', 'price', 'tax', 'tax_price',
               'description', 'currency']
     actions = ['make_audited', 'make_stopped']
     view_on_site = False
     list_filter = ['status']
+    search_kind = 'material'
+    import_kinds = ['material']
     list_per_page = 10
     list_max_show_all = 100
 
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        extra_context = extra_context or {}
+        if object_id and object_id.isdigit():
+            extra_context['where_used'] = where_used(request.user, int(object_id))
+        return super().change_view(request, object_id, form_url, extra_context)
+
     def make_audited(self, request, queryset):
         rows = queryset.update(status='A')
         if rows > 0:
@@ -230,6 +266,11 @@ class MaterialAdmin(admin.ModelAdmin):
         rows = queryset.update(status='S')
         if rows > 0:
             self.message_user(request, u'已完成终止动作')
+            #提醒仍在BOM表中使用的原料
+            product_count = len(products_using(queryset.values_list('id', flat=True)))
+            if product_count > 0:
+                self.message_user(request, u'已终止的原料仍被 {} 个商品的BOM表使用，'
+                                           u'请检视原料的使用情况'.format(product_count), messages.WARNING)
     make_stopped.allowed_permissions = ('stop',)
     make_stopped.short_description = u'终止使用'
 
@@ -242,24 +283,72 @@ class MaterialAdmin(admin.ModelAdmin):
 admin.site.register(Material, MaterialAdmin)
 
 
+"""
+BOM表单身检查
+1.原料与半成品只能填写一个(Bom.clean)
+2.以存盘后的单身展开多阶BOM表，半成品不得直接或间接使用到本商品(循环)
+"""
+class BomInlineFormSet(NumberedInlineFormSet):
+    def clean(self):
+        super().clean()
+        if any(self.errors) or self.instance.pk is None:
+            return
+
+        lines = []
+        for form in self.forms:
+            if form.cleaned_data and not form.cleaned_data.get('DELETE'):
+                material = form.cleaned_data.get('material')
+                component = form.cleaned_data.get('component')
+                lines.append((material.id if material else None, component.id if component else None,
+                              form.cleaned_data.get('quantity')))
+        try:
+            BomGraph.load().replace(self.instance.pk, lines)
+        except BomCycle as e:
+            raise forms.ValidationError(str(e))
+
+
 class BomInline(admin.TabularInline):
+    formset = BomInlineFormSet
     model = Bom
-    fields = ['material', 'quantity']
-    raw_id_fields = ['material']
+    fields = ['material', 'component', 'quantity']
+    raw_id_fields = ['material', 'component']
+    fk_name = 'product'
     extra = 0
 
 
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ['id', 'title', 'part', 'size', 'image_sub', 'tax_price', 'currency', 'stock', 'status']
+"""
+商品列表的标准原料成本与毛利读取商品标准成本表(ProductCost)，以join取得，不逐笔计算
+毛利 = 含税价依汇率换算为本位币 - 标准原料成本
+"""
+class ProductAdmin(ImportMixin, SearchIndexMixin, masterdata.MasterDataChoicesMixin, admin.ModelAdmin):
+    list_display = ['id', 'title', 'part', 'size', 'image_sub', 'tax_price', 'currency', 'material_cost', 'margin',
+                    'stock', 'status']
+    list_select_related = ['part', 'size', 'currency']
     fields = ['title', 'part', 'size', 'image_sub', 'price', 'tax', 'tax_price',
               'currency', 'description']
     actions = ['make_audited', 'make_stopped']
     inlines = [BomInline]
     view_on_site = False
     list_filter = ['status']
+    search_kind = 'product'
+    import_kinds = ['product', 'bom']
     list_per_page = 10
     list_max_show_all = 100
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(material_cost=F('cost__material_cost'))
+
+    def material_cost(self, obj):
+        return obj.material_cost
+    material_cost.short_description = u'标准原料成本'
+    material_cost.admin_order_field = 'material_cost'
+
+    def margin(self, obj):
+        if obj.material_cost is None:
+            return None
+        return obj.tax_price * masterdata.get(Currency, obj.currency_id).rate - obj.material_cost
+    margin.short_description = u'毛利'
+
     def make_audited(self, request, queryset):
         rows = queryset.update(status='A')
         if rows > 0:
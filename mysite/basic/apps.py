@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class BasicConfig(AppConfig):
     name = 'basic'
-    verbose_name = u'基本设定'
\ No newline at end of file
+    verbose_name = u'基本设定'
+
+    def ready(self):
+        from . import signals
+        signals.connect()
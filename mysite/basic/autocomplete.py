@@ -0,0 +1,184 @@
+import hashlib
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.translation import gettext_lazy as _
+from finance.models import Due, Receivable
+from purchase.models import Procurement
+from sale.models import Order
+from .models import Product
+
+AUTOCOMPLETE_PAGE_SIZE = 20
+
+#同一个使用者相同的搜寻条件在快取期间内不再查询
+AUTOCOMPLETE_TIMEOUT = 30
+AUTOCOMPLETE_KEY = 'autocomplete:{}:{}:{}:{}'
+
+
+"""
+自动完成的资料来源：
+1.queryset为可选择的资料(例如有效且尚未完成的单据)，与存盘验证使用相同的条件
+2.search将输入的文字转为查询条件，只使用id与有索引的栏位前缀比对
+3.label为选项显示的文字，选单中已选择的选项也使用相同的文字
+"""
+class AutocompleteSource:
+    def __init__(self, queryset, search, label=str, select_related=()):
+        self._queryset = queryset
+        self.search = search
+        self.label = label
+        self.select_related = select_related
+
+    @property
+    def model(self):
+        return self.queryset().model
+
+    def queryset(self):
+        return self._queryset().select_related(*self.select_related)
+
+    def permission(self):
+        opts = self.model._meta
+        return '{}.view_{}'.format(opts.app_label, opts.model_name)
+
+    """
+    依id由新到旧分页，每页多读一笔判断是否还有下一页，回传([(id, 文字)], 是否还有下一页)
+    """
+    def page(self, term, page):
+        queryset = self.queryset()
+        term = term.strip()
+        if term:
+            queryset = queryset.filter(self.search(term))
+        offset = (page - 1) * AUTOCOMPLETE_PAGE_SIZE
+        rows = list(queryset.order_by('-id')[offset:offset + AUTOCOMPLETE_PAGE_SIZE + 1])
+        return [(row.pk, self.label(row)) for row in rows[:AUTOCOMPLETE_PAGE_SIZE]], \
+            len(rows) > AUTOCOMPLETE_PAGE_SIZE
+
+
+def _id(term):
+    return Q(id=int(term)) if term.isdigit() else Q(pk__in=[])
+
+
+def _order_search(term):
+    return _id(term) | Q(pi_no__startswith=term) | Q(po_no__startswith=term)
+
+
+def _order_label(order):
+    return '{} {} {}'.format(order.pi_no, order.po_no, order.customer.title)
+
+
+def _open(model):
+    return lambda: model.objects.filter(is_active=True).exclude(status='A')
+
+
+SOURCES = {
+    #出货单：有效且尚未全部出货的订单
+    'open_order': AutocompleteSource(_open(Order), _order_search, _order_label, ['customer']),
+    #制程单：尚未出货的订单
+    'unshipped_order': AutocompleteSource(lambda: Order.objects.filter(status='N'), _order_search, _order_label,
+                                          ['customer']),
+    'order': AutocompleteSource(lambda: Order.objects.all(), _order_search, _order_label, ['customer']),
+    'product': AutocompleteSource(lambda: Product.objects.all(), lambda term: _id(term) | Q(title__startswith=term),
+                                  lambda product: product.title),
+    #到货单：有效且尚未全部到货的采购单
+    'open_procurement': AutocompleteSource(
+        _open(Procurement), lambda term: _id(term) | Q(supplier__title__startswith=term),
+        lambda procurement: '{} {}'.format(procurement.id, procurement.supplier.title), ['supplier']),
+    #收款单：有效且尚未全部收款的应收帐款
+    'open_receivable': AutocompleteSource(
+        _open(Receivable), lambda term: _id(term) | Q(customer__title__startswith=term),
+        lambda receivable: '{} {}'.format(receivable.id, receivable.customer.title), ['customer']),
+    #付款单：有效且尚未全部付款的应付帐款
+    'open_due': AutocompleteSource(
+        _open(Due), lambda term: _id(term) | Q(supplier__title__startswith=term),
+        lambda due: '{} {}'.format(due.id, due.supplier.title), ['supplier']),
+}
+
+
+"""
+自动完成的查询结果，依使用者、资料来源、输入文字与页码快取AUTOCOMPLETE_TIMEOUT秒
+回传select2的格式{'results': [{'id', 'text'}], 'pagination': {'more'}}
+"""
+def search(user, name, term, page=1):
+    key = AUTOCOMPLETE_KEY.format(name, user.pk, hashlib.md5(term.encode('utf-8')).hexdigest(), page)
+    result = cache.get(key)
+    if result is None:
+        rows, more = SOURCES[name].page(term, page)
+        result = {
+            'results': [{'id': str(pk), 'text': text} for pk, text in rows],
+            'pagination': {'more': more},
+        }
+        cache.set(key, result, AUTOCOMPLETE_TIMEOUT)
+    return result
+
+
+"""
+以自动完成资料来源取代下拉选单，只输出已选择的选项，其余选项输入时才向伺服器查询
+"""
+class SourceAutocompleteSelect(AutocompleteSelect):
+    def __init__(self, rel, admin_site, source, attrs=None, choices=(), using=None):
+        self.source = source
+        super().__init__(rel, admin_site, attrs, choices, using)
+
+    def get_url(self):
+        return reverse('basic:autocomplete', args=[self.source])
+
+
+"""
+autocomplete_sources指定的ForeignKey栏位改用自动完成，例如{'order': 'open_order'}
+可选择的资料与存盘验证都使用资料来源的queryset
+"""
+class AutocompleteSourcesMixin:
+    autocomplete_sources = {}
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        source = self.autocomplete_sources.get(db_field.name)
+        if source is None:
+            return super().formfield_for_foreignkey(db_field, request, **kwargs)
+        kwargs['queryset'] = SOURCES[source].queryset()
+        kwargs['widget'] = SourceAutocompleteSelect(db_field.remote_field, self.admin_site, source)
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        formfield.label_from_instance = SOURCES[source].label
+        return formfield
+
+
+"""
+以自动完成选择筛选条件的list_filter，不列出所有关联资料，只查询目前选择的一笔
+使用方式：list_filter = [('order', AutocompleteListFilter.using('order'))]
+"""
+class AutocompleteListFilter(admin.RelatedFieldListFilter):
+    template = 'admin/autocomplete_filter.html'
+    source = None
+
+    @classmethod
+    def using(cls, source):
+        return type('{}ListFilter'.format(source.title().replace('_', '')), (cls,), {'source': source})
+
+    def field_choices(self, field, request, model_admin):
+        if not self.lookup_val or not str(self.lookup_val).isdigit():
+            return []
+        return [(row.pk, SOURCES[self.source].label(row))
+                for row in SOURCES[self.source].queryset().filter(pk=self.lookup_val)]
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': changelist.get_query_string({}, [self.lookup_kwarg, self.lookup_kwarg_isnull]),
+            'display': _('All'),
+            'url': reverse('basic:autocomplete', args=[self.source]),
+            'lookup_kwarg': self.lookup_kwarg,
+        }
+        for pk, label in self.lookup_choices:
+            yield {'selected': True, 'value': pk, 'display': label}
+
+
+"""
+使用AutocompleteListFilter的管理界面加入select2的js与css
+"""
+class AutocompleteFilterMixin:
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, None).media
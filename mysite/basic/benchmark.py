@@ -0,0 +1,255 @@
+import datetime
+import statistics
+from importlib import import_module
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client
+from django.urls import reverse
+from basic.bom import BomCycle, BomGraph
+from basic.bulk import BulkLine
+from basic.datagen import generate
+from basic.metrics import QueryMetrics
+from basic.models import Material, Product
+from finance.models import Due, DueDetail, Receivable, ReceivableDetail
+from inventory.bulk import material_shortages
+from inventory.models import Process
+from purchase.models import Procurement, ProcurementMaterial
+from sale.bulk import add_order_lines
+from sale.models import Order, OrderProduct
+
+BENCHMARK_APPS = ['basic', 'sale', 'purchase', 'inventory', 'finance']
+
+#会异动资料的视图不在视图测试中执行，改由过账流程测试
+POSTING_VIEWS = ['inventory:process_ajax_claim_material', 'inventory:process_ajax_receipt_product',
+                 'inventory:process_ajax_generate']
+
+#网址中带有参数的视图
+URL_ARGS = {
+    'basic:autocomplete': ['open_order'],
+}
+
+
+"""
+由产生的资料中挑选各视图使用的单据，尽量挑选有部分出货/到货/收付款的单据
+"""
+def _pick(queryset, *preferred):
+    for condition in preferred:
+        found = queryset.filter(**condition).order_by('id').values_list('id', flat=True).first()
+        if found is not None:
+            return found
+    return queryset.order_by('id').values_list('id', flat=True).first()
+
+
+def pick_documents():
+    order_id = _pick(Order.objects.filter(is_active=True), {'status': 'P'}, {'status': 'N'})
+    procurement_id = _pick(Procurement.objects.filter(is_active=True), {'status': 'P'}, {'status': 'N'})
+    return {
+        'order': order_id,
+        'product': OrderProduct.objects.filter(order_id=order_id).values_list('product_id', flat=True).first(),
+        'open_order': _pick(Order.objects.filter(is_active=True), {'status': 'N'}, {'status': 'P'}),
+        'procurement': procurement_id,
+        'supplier': Procurement.objects.filter(id=procurement_id).values_list('supplier_id', flat=True).first(),
+        'material': Material.objects.order_by('id').values_list('id', flat=True).first(),
+        'process': _pick(Process.objects.all(), {'status': 'C'}),
+        'open_process': _pick(Process.objects.filter(status='A')),
+        'receivable': _pick(Receivable.objects.filter(is_active=True), {'status': 'P'}, {'status': 'N'}),
+        'due': _pick(Due.objects.filter(is_active=True), {'status': 'P'}, {'status': 'N'}),
+        'customer': Order.objects.filter(id=order_id).values_list('customer_id', flat=True).first(),
+    }
+
+
+def url_params(docs):
+    today = datetime.date.today()
+    return {
+        'basic:material_ajax_where_used': {'id': docs['material']},
+        'basic:autocomplete': {'term': 'GEN'},
+        'basic:find_document': {'q': 'M00001'},
+        'sale:order_ajax_product_list': {'id': docs['order']},
+        'sale:order_export': {'date_from': (today - datetime.timedelta(days=365)).strftime('%Y-%m-%d')},
+        'sale:order_margin_export': {'date_from': (today - datetime.timedelta(days=365)).strftime('%Y-%m-%d')},
+        'purchase:procurement_ajax_supplier_list': {'id': docs['order']},
+        'purchase:procurement_ajax_material_list': {'order_id': docs['order'], 'supplier_id': docs['supplier']},
+        'purchase:procurement_ajax_list': {'id': docs['procurement']},
+        'inventory:process_ajax_order_product_list': {'id': docs['order']},
+        'inventory:process_ajax_bom_list': {'order_id': docs['order'], 'product_id': docs['product']},
+        'inventory:process_ajax_status': {'id': docs['process']},
+        'inventory:stock_ajax_at_date': {'kind': 'material', 'id': docs['material'],
+                                         'date': today.strftime('%Y-%m-%d')},
+        'finance:receivable_ajax_detail_list': {'id': docs['receivable']},
+        'finance:due_ajax_detail_list': {'id': docs['due']},
+        'finance:receivable_ajax_outstanding': {'customer': docs['customer']},
+        'finance:due_ajax_outstanding': {'supplier': docs['supplier']},
+    }
+
+
+def _request(client, method, path, data):
+    with QueryMetrics() as metrics:
+        response = getattr(client, method)(path, data)
+        if response.streaming:
+            b''.join(response.streaming_content)
+    return response, metrics
+
+
+def _result(name, method, path, response, metrics, wall_times=None):
+    return {
+        'name': name,
+        'method': method,
+        'path': path,
+        'status': response.status_code,
+        'queries': metrics.count,
+        'db_time': round(metrics.db_time, 3),
+        'wall_time': round(statistics.median(wall_times) if wall_times else metrics.wall_time, 3),
+        'duplicates': sum(count - 1 for sql, count in metrics.duplicates(None)),
+    }
+
+
+"""
+依序请求basic/sale/purchase/inventory/finance各urls.py中的所有视图，每个视图执行repeat次取耗时中位数
+没有设定参数的视图(新增的视图)以无参数请求，结果中仍会列出
+"""
+def bench_urls(client, docs, repeat=3):
+    params = url_params(docs)
+    results = []
+    for app in BENCHMARK_APPS:
+        urls = import_module('{}.urls'.format(app))
+        for pattern in urls.urlpatterns:
+            name = '{}:{}'.format(urls.app_name, pattern.name)
+            if name in POSTING_VIEWS:
+                continue
+            path = reverse(name, args=URL_ARGS.get(name))
+            wall_times = []
+            for i in range(repeat):
+                response, metrics = _request(client, 'get', path, params.get(name, {}))
+                wall_times.append(metrics.wall_time)
+            results.append(_result(name, 'get', path, response, metrics, wall_times))
+    return results
+
+
+def _formset(prefix, rows):
+    data = {prefix + '-TOTAL_FORMS': str(len(rows)), prefix + '-INITIAL_FORMS': '0',
+            prefix + '-MIN_NUM_FORMS': '0', prefix + '-MAX_NUM_FORMS': '1000'}
+    for i, row in enumerate(rows):
+        for key, value in row.items():
+            data['{}-{}-{}'.format(prefix, i, key)] = value
+    return data
+
+
+"""
+产生制程单需要尚未出货且没有制程单的订单，另建一张数量为1的订单：
+商品数与挑选的订单相同，只挑选有BOM表且原料可用量足够的商品，测试完整的产生流程而不是缺料的错误
+"""
+def new_open_order(docs, user):
+    count = OrderProduct.objects.filter(order_id=docs['order']).count()
+    graph = BomGraph.load()
+    product_ids = []
+    for product_id in Product.objects.order_by('id').values_list('id', flat=True):
+        if len(product_ids) >= count:
+            break
+        try:
+            materials = graph.unit_materials(product_id)
+        except BomCycle:
+            continue
+        if materials and not material_shortages(materials):
+            product_ids.append(product_id)
+    if not product_ids:
+        return None
+    order = Order.objects.create(cat_id='1', pi_no='BENCH', customer_id=docs['customer'], create_user=user,
+                                 etd=datetime.date.today())
+    add_order_lines(order, [BulkLine(row, product_id, 1) for row, product_id in enumerate(product_ids, 1)])
+    return order.id
+
+
+"""
+以管理界面相同的POST执行各过账流程，每个流程执行一次：
+出货、到货、原料库存异动申请、依订单产生制程单、制程领料、制程入库、收款、付款
+"""
+def bench_postings(client, docs, user):
+    flows = []
+    if docs['open_order']:
+        lines = OrderProduct.objects.filter(order_id=docs['open_order']).values_list('product_id', flat=True)
+        flows.append(('admin:sale_ship_add', 'post', dict(order=docs['open_order'], **_formset(
+            'shipdetail_set', [{'product': product_id, 'quantity': 1, 'description': ''} for product_id in lines]))))
+    if docs['procurement']:
+        lines = ProcurementMaterial.objects.filter(procurement_id=docs['procurement'])\
+            .values_list('material_id', flat=True)
+        flows.append(('admin:purchase_arrive_add', 'post', dict(procurement=docs['procurement'], **_formset(
+            'arrivedetail_set', [{'material': material_id, 'quantity': 1, 'description': ''}
+                                 for material_id in lines]))))
+    materials = Material.objects.order_by('id').values_list('id', flat=True)[:20]
+    flows.append(('admin:inventory_mcheck_add', 'post', dict(description='benchmark', **_formset(
+        'mcheckdetail_set', [{'material': material_id, 'quantity': 1} for material_id in materials]))))
+    order_id = new_open_order(docs, user)
+    if order_id:
+        flows.append(('inventory:process_ajax_generate', 'get', {'order_id': order_id}))
+    if docs['open_process']:
+        flows.append(('inventory:process_ajax_claim_material', 'get', {'id': docs['open_process']}))
+        flows.append(('inventory:process_ajax_receipt_product', 'get', {'id': docs['open_process']}))
+    if docs['receivable']:
+        receivable = Receivable.objects.get(id=docs['receivable'])
+        lines = ReceivableDetail.objects.filter(receivable=receivable).values_list('product_id', 'currency_id')
+        flows.append(('admin:finance_receive_add', 'post', dict(receivable=receivable.id, invoice_no='BENCH', **_formset(
+            'receivedetail_set', [{'product': product_id, 'amount': 1, 'discount': 0, 'currency': currency_id,
+                                   'rate': 1, 'description': ''} for product_id, currency_id in lines]))))
+    if docs['due']:
+        due = Due.objects.get(id=docs['due'])
+        lines = DueDetail.objects.filter(due=due).values_list('material_id', 'currency_id')
+        flows.append(('admin:finance_pay_add', 'post', dict(due=due.id, invoice_no='BENCH', **_formset(
+            'paydetail_set', [{'material': material_id, 'amount': 1, 'discount': 0, 'currency': currency_id,
+                               'rate': 1, 'description': ''} for material_id, currency_id in lines]))))
+
+    results = []
+    for name, method, data in flows:
+        path = reverse(name)
+        response, metrics = _request(client, method, path, data)
+        results.append(_result(name, method, path, response, metrics))
+    return results
+
+
+"""
+依序以各资料量倍数(scales)执行效能测试，每个倍数都先清空资料库再产生资料
+必须在测试资料库中执行，会清空资料库
+"""
+def run_benchmark(scales, seed=0, repeat=3):
+    runs = []
+    for scale in scales:
+        call_command('flush', interactive=False, verbosity=0)
+        user = User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+        started = datetime.datetime.now()
+        counts = generate(user, scale=scale, seed=seed)
+        generate_time = (datetime.datetime.now() - started).total_seconds() * 1000
+
+        client = Client()
+        client.force_login(user)
+        docs = pick_documents()
+        runs.append({
+            'scale': scale,
+            'volumes': counts,
+            'generate_time': round(generate_time, 3),
+            'urls': bench_urls(client, docs, repeat),
+            'postings': bench_postings(client, docs, user),
+        })
+    return runs
+
+
+"""
+与基准结果比较，依(scale, name)对应，查询次数增加或耗时超过基准(1 + tolerance)倍加min_delta毫秒时列为退步
+"""
+def compare(baseline, runs, tolerance=0.5, min_delta=5):
+    expected = {}
+    for run in baseline.get('runs', []):
+        for result in run['urls'] + run['postings']:
+            expected[(run['scale'], result['name'])] = result
+
+    regressions = []
+    for run in runs:
+        for result in run['urls'] + run['postings']:
+            base = expected.get((run['scale'], result['name']))
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                regressions.append(u'[scale {}] {} 查询次数 {} -> {}'.format(
+                    run['scale'], result['name'], base['queries'], result['queries']))
+            if result['wall_time'] > base['wall_time'] * (1 + tolerance) + min_delta:
+                regressions.append(u'[scale {}] {} 耗时 {}ms -> {}ms'.format(
+                    run['scale'], result['name'], base['wall_time'], result['wall_time']))
+    return regressions
@@ -0,0 +1,122 @@
+import time
+from django.core.cache import cache
+from django.db import transaction
+from .models import Bom, Material
+
+#BOM表最多层数，超过时视为循环
+MAX_BOM_DEPTH = 20
+
+BOM_VERSION_KEY = 'bom:version'
+BOM_PAYLOAD_KEY = 'bom:payload:{}:{}'
+BOM_PAYLOAD_TIMEOUT = 24 * 3600
+
+
+class BomCycle(Exception):
+    def __init__(self, path):
+        self.path = path
+        super().__init__(u'BOM表有循环：{}'.format(' -> '.join(str(product_id) for product_id in path)))
+
+
+"""
+多阶BOM表，组成可以是原料(material)或半成品商品(component)：
+1.load()以一个查询读入整个BOM表，之后的展开都在内存中进行，不会逐阶查询
+2.unit_materials()将商品展开为每单位所需的末阶原料数量，半成品的展开结果会记住，同一个半成品只展开一次
+3.展开时发现商品出现在自己的组成路径中即为循环，抛出BomCycle
+原料顺序依BOM表单身id排序，半成品的原料接在该半成品单身的位置
+"""
+class BomGraph:
+    def __init__(self, rows):
+        self.children = {}
+        for product_id, material_id, component_id, quantity in rows:
+            self.children.setdefault(product_id, []).append((material_id, component_id, quantity))
+        self._memo = {}
+
+    @classmethod
+    def load(cls):
+        return cls(Bom.objects.order_by('id').values_list('product_id', 'material_id', 'component_id', 'quantity'))
+
+    def unit_materials(self, product_id):
+        return self._explode(product_id, ())
+
+    def _explode(self, product_id, path):
+        if product_id in self._memo:
+            return self._memo[product_id]
+        path = path + (product_id,)
+        if len(path) > MAX_BOM_DEPTH:
+            raise BomCycle(path)
+        materials = {}
+        for material_id, component_id, quantity in self.children.get(product_id, ()):
+            if component_id is None:
+                materials[material_id] = materials.get(material_id, 0) + quantity
+                continue
+            if component_id in path:
+                raise BomCycle(path + (component_id,))
+            for sub_material_id, sub_quantity in self._explode(component_id, path).items():
+                materials[sub_material_id] = materials.get(sub_material_id, 0) + sub_quantity * quantity
+        self._memo[product_id] = materials
+        return materials
+
+    """
+    多个商品需求量展开后合计，demands为{商品id: 数量}，回传{原料id: 数量}
+    """
+    def explode(self, demands):
+        materials = {}
+        for product_id, quantity in demands.items():
+            if not quantity:
+                continue
+            for material_id, unit_quantity in self.unit_materials(product_id).items():
+                materials[material_id] = materials.get(material_id, 0) + unit_quantity * quantity
+        return materials
+
+    """
+    以lines取代商品的BOM表单身后检查是否有循环，BOM表存盘前使用
+    lines为[(原料id, 半成品商品id, 组成数量)]
+    """
+    def replace(self, product_id, lines):
+        graph = BomGraph(())
+        graph.children = dict(self.children)
+        graph.children[product_id] = list(lines)
+        graph.unit_materials(product_id)
+        return graph
+
+
+def bom_version():
+    cache.add(BOM_VERSION_KEY, 1, None)
+    return cache.get(BOM_VERSION_KEY) or 1
+
+
+"""
+BOM表或原料异动后呼叫(post_save/post_delete)，递增共用快取中的BOM版本号，旧版本的快取不再使用：
+1.立即递增，本线程在交易提交前读取时不会拿到异动前的快取
+2.交易提交后再递增一次，其他进程在提交前以旧资料产生的快取也一并失效
+"""
+def invalidate_bom():
+    _bump_bom_version()
+    transaction.on_commit(_bump_bom_version)
+
+
+def _bump_bom_version():
+    try:
+        cache.incr(BOM_VERSION_KEY)
+    except ValueError:
+        cache.add(BOM_VERSION_KEY, 2, None)
+
+
+"""
+商品每单位的末阶原料用量与原料名称，依商品id与BOM版本快取，快取不存在时读入BOM表展开并一次查询原料名称
+回传{'version': BOM版本, 'built': 产生时间, 'materials': [(原料id, 原料名称, 每单位用量)]}
+"""
+def unit_material_payload(product_id):
+    version = bom_version()
+    key = BOM_PAYLOAD_KEY.format(version, product_id)
+    payload = cache.get(key)
+    if payload is None:
+        materials = BomGraph.load().unit_materials(product_id)
+        titles = dict(Material.objects.filter(id__in=list(materials)).values_list('id', 'title'))
+        payload = {
+            'version': version,
+            'built': int(time.time()),
+            'materials': [(material_id, titles[material_id], quantity) for material_id, quantity in materials.items()],
+        }
+        cache.set(key, payload, BOM_PAYLOAD_TIMEOUT)
+    return payload
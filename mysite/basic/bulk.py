@@ -0,0 +1,151 @@
+import csv
+from django.core.exceptions import ValidationError
+from django.db import connection
+from .numbering import format_num
+
+PREFETCH_CHUNK_SIZE = 1000
+BULK_BATCH_SIZE = 500
+MAX_LINES = 99999
+
+
+class BulkLine:
+    def __init__(self, row, item, quantity, description=''):
+        self.row = row
+        self.item = item
+        self.quantity = quantity
+        self.description = description
+
+
+"""
+读取单身档案(CSV)，第一行为栏位名称：
+item: 原料/商品id或名称(全数字视为id)
+quantity: 数量
+description: 描述(可省略)
+"""
+def read_lines(path):
+    lines = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row, record in enumerate(csv.DictReader(f), 2):
+            lines.append(BulkLine(row, (record.get('item') or '').strip(), (record.get('quantity') or '').strip(),
+                                  (record.get('description') or '').strip()))
+    return lines
+
+
+"""
+一次取得所有单身引用的原料/商品，依id或名称分批查询，每批最多PREFETCH_CHUNK_SIZE笔
+回传 {id或名称: 原料/商品}
+"""
+def prefetch_items(model, keys, fields):
+    keys = set(str(key) for key in keys)
+    ids = sorted(int(key) for key in keys if key.isdigit())
+    titles = sorted(key for key in keys if not key.isdigit())
+
+    items = {}
+    for i in range(0, len(ids), PREFETCH_CHUNK_SIZE):
+        for item in model.objects.filter(id__in=ids[i:i + PREFETCH_CHUNK_SIZE]).only(*fields):
+            items[str(item.id)] = item
+    for i in range(0, len(titles), PREFETCH_CHUNK_SIZE):
+        for item in model.objects.filter(title__in=titles[i:i + PREFETCH_CHUNK_SIZE]).only(*fields):
+            items[item.title] = item
+    return items
+
+
+"""
+在内存中检查单身，所有错误一次以ValidationError抛出，讯息标示档案行号：
+1.最少要有一个单身，且不超过MAX_LINES笔
+2.原料/商品必须存在，active_only时状态必须为核准(A)
+3.数量必须是整数且不得是负数，至少一笔大于0
+4.原料/商品不可重复，也不可与单据已有的单身重复(existing_ids)
+5.check_stock时数量不得大于库存量
+回传 [(BulkLine, 原料/商品)]
+"""
+def check_lines(lines, items, label, existing_ids=(), active_only=False, check_stock=False):
+    errors = []
+    if len(lines) < 1:
+        raise ValidationError(u'您最少必须输入一笔单身。')
+
+    checked = []
+    used_ids = set(existing_ids)
+    detail_amount = 0
+    for line in lines:
+        item = items.get(str(line.item))
+        if item is None:
+            errors.append(u'第{}行：{}[{}]不存在。'.format(line.row, label, line.item))
+            continue
+        if active_only and item.status != 'A':
+            errors.append(u'第{}行：{}[{}-{}]尚未核准。'.format(line.row, label, item.id, item.title))
+
+        try:
+            line.quantity = int(line.quantity)
+        except (TypeError, ValueError):
+            errors.append(u'第{}行：数量[{}]不是整数。'.format(line.row, line.quantity))
+            continue
+        if line.quantity < 0:
+            errors.append(u'第{}行：{}数量不得是负数。'.format(line.row, label))
+        elif line.quantity > 0:
+            detail_amount += 1
+
+        if item.id in used_ids:
+            errors.append(u'第{}行：{}[{}-{}]已重复。'.format(line.row, label, item.id, item.title))
+        used_ids.add(item.id)
+
+        if check_stock and item.stock < line.quantity:
+            errors.append(u'第{}行：{}[{}-{}]库存 {}，无法满足数量 {}。'.format(
+                line.row, label, item.id, item.title, item.stock, line.quantity))
+        checked.append((line, item))
+
+    if detail_amount < 1 and not errors:
+        errors.append(u'您必须最少一笔单身数量大于0。')
+    if len(used_ids) > MAX_LINES:
+        errors.append(u'单身最多{}笔。'.format(MAX_LINES))
+    if errors:
+        raise ValidationError(errors)
+    return checked
+
+
+"""
+在内存中为新单身编号，接续单据已有单身的最大项次
+"""
+def number_lines(details, existing_nums):
+    nums = [int(num) for num in existing_nums if num.isdigit()]
+    for i, detail in enumerate(details, max(nums) + 1 if nums else 1):
+        detail.num = format_num(i)
+    return details
+
+
+"""
+整批更新每笔栏位值都不同的资料，以同一个UPDATE语句executemany，每BULK_BATCH_SIZE笔执行一次
+bulk_update会为每笔每个栏位产生CASE WHEN，资料多时组SQL的时间远超过执行时间
+fields为栏位名称，值以Field.get_db_prep_save转换
+"""
+def update_rows(model, objs, fields):
+    opts = model._meta
+    fields = [opts.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(quote(opts.db_table),
+                                                  ', '.join('{} = %s'.format(quote(field.column)) for field in fields),
+                                                  quote(opts.pk.column))
+    params = [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+              for obj in objs]
+    with connection.cursor() as cursor:
+        for i in range(0, len(params), BULK_BATCH_SIZE):
+            cursor.executemany(sql, params[i:i + BULK_BATCH_SIZE])
+    return len(params)
+
+
+"""
+整批新增资料，以同一个INSERT语句executemany，每BULK_BATCH_SIZE笔执行一次
+bulk_create会为每笔建立model物件并逐栏转换，只有几个简单栏位的大量资料(例如搜寻索引)时组SQL的时间远超过执行时间
+fields为栏位名称，rows为各栏位的值(已是资料库格式)，不回传id
+"""
+def insert_rows(model, fields, rows):
+    opts = model._meta
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(quote(opts.db_table),
+                                                   ', '.join(quote(opts.get_field(name).column) for name in fields),
+                                                   ', '.join(['%s'] * len(fields)))
+    rows = list(rows)
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), BULK_BATCH_SIZE):
+            cursor.executemany(sql, rows[i:i + BULK_BATCH_SIZE])
+    return len(rows)
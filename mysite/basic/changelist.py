@@ -0,0 +1,172 @@
+import hashlib
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ALL_VAR, ORDER_VAR, ChangeList
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.utils.dateparse import parse_datetime
+
+CURSOR_VAR = 'cursor'
+
+#笔数快取秒数，期间内新增的资料不会反映在笔数上
+COUNT_TIMEOUT = 60
+COUNT_KEY = 'changelist:count:{}'
+
+#没有筛选条件且资料库估计的笔数超过此数时，直接使用估计值
+ESTIMATE_THRESHOLD = 10000
+
+
+"""
+资料库统计信息中的估计笔数，不扫描资料表，不支援的资料库回传None
+"""
+def estimated_rows(model):
+    table = model._meta.db_table
+    if connection.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+"""
+管理界面列表的笔数，回传(笔数, 是否为估计值)：
+1.没有筛选条件且估计笔数超过ESTIMATE_THRESHOLD时使用资料库的估计笔数
+2.否则执行COUNT(*)，结果依查询语句快取COUNT_TIMEOUT秒，翻页时不再重新计算
+"""
+def changelist_count(queryset):
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    key = COUNT_KEY.format(hashlib.md5(repr((sql, params)).encode('utf-8')).hexdigest())
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = None
+    if not queryset.query.where:
+        estimate = estimated_rows(queryset.model)
+        if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+            result = (estimate, True)
+    if result is None:
+        result = (queryset.count(), False)
+    cache.set(key, result, COUNT_TIMEOUT)
+    return result
+
+
+"""
+单身合计的相关子查询，作为管理界面列表的计算栏位，与列表在同一个查询中取得，不逐笔查询单身
+header_field为单身指向单头的栏位，expression为单身每笔的计算式
+"""
+def detail_sum(detail_model, header_field, expression, output_field):
+    details = detail_model.objects.filter(**{header_field: OuterRef('pk')}).order_by().values(header_field)
+    return Subquery(details.annotate(total=Sum(expression)).values('total'), output_field=output_field)
+
+
+"""
+单身未完成数量 = 应完成数量 - 已完成数量，超额完成的单身视为0，不抵其他单身
+"""
+def remaining_quantity(quantity_field, done_field):
+    return Case(When(**{quantity_field + '__gt': F(done_field), 'then': F(quantity_field) - F(done_field)}),
+                default=Value(0), output_field=IntegerField())
+
+
+"""
+以(时间栏位, id)游标翻页的列表，适用资料量持续增加的单据与库存异动：
+1.依时间栏位、id由新到旧排序，下一页以上一页最后一笔为游标查询，不使用OFFSET，翻到越后面也不会越慢
+2.每页多读一笔判断是否还有下一页，笔数由changelist_count取得(估计值或快取)，不在每次翻页时COUNT(*)
+3.list_filter、date_hierarchy与搜寻条件照常套用；点选栏位排序时改回原本的页码翻页
+游标格式为"方向_时间_id"，方向n为下一页(比游标旧)，p为上一页(比游标新)
+"""
+class KeysetChangeList(ChangeList):
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR, '')
+        self.keyset = ORDER_VAR not in request.GET and ALL_VAR not in request.GET
+        super().__init__(request, *args, **kwargs)
+
+    @property
+    def keyset_field(self):
+        return self.model_admin.keyset_field
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        #筛选、排序与日期连结都回到第一页
+        if not new_params or CURSOR_VAR not in new_params:
+            remove = list(remove or []) + [CURSOR_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def get_ordering(self, request, queryset):
+        if self.keyset:
+            return ['-' + self.keyset_field, '-pk']
+        return super().get_ordering(request, queryset)
+
+    def _parse_cursor(self):
+        try:
+            direction, value, pk = self.cursor.split('_')
+            value = parse_datetime(value)
+            pk = int(pk)
+        except ValueError:
+            raise IncorrectLookupParameters
+        if direction not in ('n', 'p') or value is None:
+            raise IncorrectLookupParameters
+        return direction, value, pk
+
+    def _cursor_url(self, direction, obj):
+        cursor = '{}_{}_{}'.format(direction, getattr(obj, self.keyset_field).isoformat(), obj.pk)
+        return self.get_query_string({CURSOR_VAR: cursor})
+
+    def get_results(self, request):
+        if not self.keyset:
+            super().get_results(request)
+            self.count_estimated = False
+            return
+
+        queryset = self.queryset
+        direction = None
+        if self.cursor:
+            direction, value, pk = self._parse_cursor()
+            field = self.keyset_field
+            if direction == 'n':
+                queryset = queryset.filter(Q(**{field + '__lte': value}),
+                                           Q(**{field + '__lt': value}) | Q(pk__lt=pk))
+            else:
+                queryset = queryset.filter(Q(**{field + '__gte': value}),
+                                           Q(**{field + '__gt': value}) | Q(pk__gt=pk)).reverse()
+        rows = list(queryset[:self.list_per_page + 1])
+        more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if direction == 'p':
+            rows.reverse()
+        has_next = more if direction != 'p' else True
+        has_previous = more if direction == 'p' else direction == 'n'
+
+        self.result_count, self.count_estimated = changelist_count(self.queryset)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = self.queryset.filter(pk__in=[row.pk for row in rows]) if self.list_editable else rows
+        self.can_show_all = False
+        self.multi_page = has_next or has_previous
+        self.paginator = None
+        self.first_url = self.get_query_string() if has_previous else None
+        self.previous_url = self._cursor_url('p', rows[0]) if has_previous and rows else None
+        self.next_url = self._cursor_url('n', rows[-1]) if has_next and rows else None
+
+
+"""
+资料量大的管理界面改用游标翻页(KeysetChangeList)，keyset_field为排序的时间栏位
+"""
+class KeysetPaginationMixin:
+    change_list_template = 'admin/keyset_change_list.html'
+    show_full_result_count = False
+    keyset_field = 'created'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -0,0 +1,124 @@
+import threading
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import DecimalField
+from . import masterdata
+from .bom import BomGraph
+from .bulk import BULK_BATCH_SIZE
+from .models import Currency, Material, Product, ProductCost
+from .status import in_chunks, set_lines
+from .whereused import products_containing, products_using
+
+COST_PLACES = Decimal('0.0001')
+
+_dirty = threading.local()
+
+
+"""
+原料单位成本(本位币) = 含税价 * 币别汇率，汇率由基本资料快取取得，回传{原料id: 成本}
+"""
+def material_unit_costs(material_ids):
+    costs = {}
+    for ids in in_chunks(material_ids):
+        for material_id, tax_price, currency_id in Material.objects.filter(id__in=ids)\
+                .values_list('id', 'tax_price', 'currency_id'):
+            costs[material_id] = tax_price * masterdata.get(Currency, currency_id).rate
+    return costs
+
+
+"""
+商品标准原料成本 = sum(展开后末阶原料每单位用量 * 原料单位成本)，没有BOM表的商品成本为0
+BOM表由graph展开(未指定时读入整个BOM表)，每批商品一个原料查询，回传{商品id: 成本}
+"""
+def product_costs(product_ids, graph=None):
+    if graph is None:
+        graph = BomGraph.load()
+    costs = {}
+    for ids in in_chunks(product_ids):
+        exploded = dict((product_id, graph.unit_materials(product_id)) for product_id in ids)
+        unit_costs = material_unit_costs(set(material_id for materials in exploded.values() for material_id in materials))
+        for product_id, materials in exploded.items():
+            cost = sum((unit_costs[material_id] * quantity for material_id, quantity in materials.items()), Decimal(0))
+            costs[product_id] = cost.quantize(COST_PLACES)
+    return costs
+
+
+"""
+计算商品标准成本并写入商品标准成本表(ProductCost)：
+1.product_ids为None时依id分批计算所有商品
+2.整个BOM表只读入一次，半成品的展开结果在所有批次共用
+3.已有成本的商品以一个UPDATE写回，没有成本的商品以bulk_create新增
+回传计算的商品数
+"""
+def rollup(product_ids=None):
+    if product_ids is None:
+        chunks = _iter_product_ids()
+    else:
+        #已删除的商品不计算
+        chunks = (list(Product.objects.filter(id__in=ids).values_list('id', flat=True))
+                  for ids in in_chunks(sorted(set(product_ids))))
+    graph = BomGraph.load()
+    count = 0
+    for ids in chunks:
+        costs = product_costs(ids, graph)
+        existing = set(ProductCost.objects.filter(product_id__in=ids).values_list('product_id', flat=True))
+        ProductCost.objects.bulk_create([ProductCost(product_id=product_id, material_cost=cost)
+                                         for product_id, cost in costs.items() if product_id not in existing],
+                                        batch_size=BULK_BATCH_SIZE)
+        set_lines(ProductCost, 'material_cost',
+                  dict((product_id, cost) for product_id, cost in costs.items() if product_id in existing),
+                  DecimalField(max_digits=16, decimal_places=4), key='product_id')
+        count += len(ids)
+    return count
+
+
+def _iter_product_ids():
+    last_id = 0
+    while True:
+        ids = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:1000])
+        if not ids:
+            break
+        yield ids
+        last_id = ids[-1]
+
+
+def products_using_currencies(currency_ids):
+    return products_using(Material.objects.filter(currency_id__in=list(currency_ids)).values_list('id', flat=True))
+
+
+def _pending():
+    if not hasattr(_dirty, 'products'):
+        _dirty.products = set()
+        _dirty.materials = set()
+        _dirty.currencies = set()
+    return _dirty
+
+
+"""
+记录需要重算成本的商品、原料与币别，交易提交后一次重算
+同一个交易中多次异动(例如BOM表单身逐笔存盘)只会重算一次
+"""
+def mark_dirty(products=(), materials=(), currencies=()):
+    pending = _pending()
+    pending.products.update(products)
+    pending.materials.update(materials)
+    pending.currencies.update(currencies)
+    transaction.on_commit(flush)
+
+
+"""
+重算记录的商品，原料与币别先以where-used反查受影响的商品，商品再往上找出使用它作为半成品的商品，只重算这些商品
+"""
+def flush():
+    pending = _pending()
+    product_ids = products_containing(pending.products) if pending.products else set()
+    if pending.materials:
+        product_ids |= products_using(pending.materials)
+    if pending.currencies:
+        product_ids |= products_using_currencies(pending.currencies)
+    pending.products.clear()
+    pending.materials.clear()
+    pending.currencies.clear()
+    if product_ids:
+        return rollup(product_ids)
+    return 0
@@ -0,0 +1,211 @@
+import datetime
+import random
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from basic.bom import BomGraph, invalidate_bom
+from basic.bulk import BULK_BATCH_SIZE, BulkLine
+from basic.costing import rollup
+from basic.models import Bom, Category, Currency, Customer, Material, Period, Product, Size, Supplier
+from basic.numbering import format_num
+from basic.search import index_objects
+from finance.models import Due, DueDetail, Pay, PayDetail, Receivable, ReceivableDetail, Receive, ReceiveDetail
+from finance.posting import post_pay, post_receive
+from inventory.models import Mcheck, McheckDetail, Pcheck, PcheckDetail, Process, ProcessDetail
+from inventory.stock import StockShortage, post_material_stock, post_product_stock
+from purchase.bulk import add_arrive_lines, add_procurement_lines
+from purchase.models import Procurement, ProcurementMaterial
+from sale.bulk import add_order_lines, add_ship_lines
+from sale.models import Order, OrderProduct
+
+#scale为1时的数量，其他scale依比例放大
+VOLUMES = {
+    'suppliers': 5,
+    'customers': 5,
+    'materials': 100,
+    'products': 40,
+    'orders': 20,
+    'procurements': 20,
+}
+
+
+def volumes(scale):
+    return dict((key, max(int(count * scale), 1)) for key, count in VOLUMES.items())
+
+
+def _price(rnd):
+    price = Decimal(rnd.randint(100, 10000)) / 100
+    tax = (price * Decimal('0.13')).quantize(Decimal('0.0001'))
+    return price, tax, price + tax
+
+
+"""
+产生测试资料，同样的seed与scale会产生同样的资料：
+1.币别、帐期、种类、size、供货商、客户、原料、商品与BOM表(部分商品有半成品)，以bulk_create写入，并计算商品标准成本
+2.以原料/商品库存异动申请单建立期初库存
+3.订单与部分出货、采购单与部分到货，使用与管理界面相同的过账程序，库存异动、应收/应付帐款与状态都会一致
+4.部分应收/应付帐款的收款与付款，与尚未出库/已出库的制程单
+名称以prefix开头，同一个资料库重复产生资料时必须使用不同的prefix
+"""
+def generate(user, scale=1, seed=0, prefix='GEN'):
+    rnd = random.Random(seed)
+    counts = volumes(scale)
+    today = datetime.date.today()
+
+    with transaction.atomic():
+        currency, created = Currency.objects.get_or_create(id='RMB', defaults={'title': u'人民币', 'rate': 1})
+        period, created = Period.objects.get_or_create(title=u'月结30天', defaults={'period': 30})
+        category = Category.objects.create(title='{}-C'.format(prefix), status='A')
+        size = Size.objects.create(title='{}-Z'.format(prefix), status='A')
+
+        Supplier.objects.bulk_create([
+            Supplier(title='{}-S{:05d}'.format(prefix, i), period=period, status='A')
+            for i in range(counts['suppliers'])], batch_size=BULK_BATCH_SIZE)
+        Customer.objects.bulk_create([
+            Customer(title='{}-C{:05d}'.format(prefix, i), period=period, status='A')
+            for i in range(counts['customers'])], batch_size=BULK_BATCH_SIZE)
+        supplier_ids = list(Supplier.objects.filter(title__startswith=prefix + '-S').order_by('id')
+                            .values_list('id', flat=True))
+        customer_ids = list(Customer.objects.filter(title__startswith=prefix + '-C').order_by('id')
+                            .values_list('id', flat=True))
+
+        materials = []
+        for i in range(counts['materials']):
+            price, tax, tax_price = _price(rnd)
+            materials.append(Material(title='{}-M{:06d}'.format(prefix, i), image_sub='-', category=category,
+                                      supplier_id=supplier_ids[i % len(supplier_ids)], price=price, tax=tax,
+                                      tax_price=tax_price, currency=currency, status='A'))
+        Material.objects.bulk_create(materials, batch_size=BULK_BATCH_SIZE)
+        products = []
+        for i in range(counts['products']):
+            price, tax, tax_price = _price(rnd)
+            products.append(Product(title='{}-P{:06d}'.format(prefix, i), image_sub='-', size=size, price=price,
+                                    tax=tax, tax_price=tax_price, currency=currency, status='A'))
+        Product.objects.bulk_create(products, batch_size=BULK_BATCH_SIZE)
+        material_ids = list(Material.objects.filter(title__startswith=prefix + '-M').order_by('id')
+                            .values_list('id', flat=True))
+        product_ids = list(Product.objects.filter(title__startswith=prefix + '-P').order_by('id')
+                           .values_list('id', flat=True))
+        #bulk_create不会触发signal，自行建立搜寻索引
+        for kind, ids in [('supplier', supplier_ids), ('customer', customer_ids), ('material', material_ids),
+                          ('product', product_ids)]:
+            index_objects(kind, ids, created=True)
+
+        boms = []
+        for j, product_id in enumerate(product_ids):
+            for i, material_id in enumerate(rnd.sample(material_ids, min(rnd.randint(3, 6), len(material_ids))), 1):
+                boms.append(Bom(num=format_num(i), product_id=product_id, material_id=material_id,
+                                quantity=rnd.randint(1, 4)))
+            #每5个商品有1个以前一个商品作为半成品
+            if j % 5 == 4:
+                boms.append(Bom(num=format_num(i + 1), product_id=product_id, component_id=product_ids[j - 1],
+                                quantity=1))
+        Bom.objects.bulk_create(boms, batch_size=BULK_BATCH_SIZE)
+        #bulk_create不会触发signal，自行失效BOM快取并计算商品标准成本
+        invalidate_bom()
+        rollup(product_ids)
+
+        #期初库存
+        mcheck = Mcheck.objects.create(description=u'期初库存', create_user=user, is_active=True)
+        lines = [(material_id, rnd.randint(1000, 5000)) for material_id in material_ids]
+        McheckDetail.objects.bulk_create([
+            McheckDetail(num=format_num(i), mcheck=mcheck, material_id=material_id, quantity=quantity)
+            for i, (material_id, quantity) in enumerate(lines, 1)], batch_size=BULK_BATCH_SIZE)
+        post_material_stock('MCHECK', mcheck.id, lines, user)
+        pcheck = Pcheck.objects.create(description=u'期初库存', create_user=user, is_active=True)
+        lines = [(product_id, rnd.randint(1000, 5000)) for product_id in product_ids]
+        PcheckDetail.objects.bulk_create([
+            PcheckDetail(num=format_num(i), pcheck=pcheck, product_id=product_id, quantity=quantity)
+            for i, (product_id, quantity) in enumerate(lines, 1)], batch_size=BULK_BATCH_SIZE)
+        post_product_stock('PCHECK', pcheck.id, lines, user)
+
+    #订单与部分出货，三分之一尚未出货、三分之一部分出货、三分之一全部出货
+    for i in range(counts['orders']):
+        with transaction.atomic():
+            order = Order.objects.create(cat_id='1', pi_no='{}{:06d}'.format(prefix, i), po_no='PO{:06d}'.format(i),
+                                         customer_id=customer_ids[i % len(customer_ids)], create_user=user,
+                                         etd=today + datetime.timedelta(days=rnd.randint(-30, 60)))
+            chosen = rnd.sample(product_ids, min(rnd.randint(5, 15), len(product_ids)))
+            add_order_lines(order, [BulkLine(row, product_id, rnd.randint(10, 200))
+                                    for row, product_id in enumerate(chosen, 1)])
+            if i % 3 > 0:
+                ordered = OrderProduct.objects.filter(order=order).values_list('product_id', 'quantity')
+                try:
+                    add_ship_lines(order, [BulkLine(row, product_id, quantity if i % 3 == 2 else quantity // 2)
+                                           for row, (product_id, quantity) in enumerate(ordered, 1)], user)
+                except ValidationError:
+                    #商品库存不足时该订单维持尚未出货
+                    pass
+
+    #采购单与部分到货
+    supplier_materials = {}
+    for material_id, supplier_id in Material.objects.filter(id__in=material_ids).values_list('id', 'supplier_id'):
+        supplier_materials.setdefault(supplier_id, []).append(material_id)
+    for i in range(counts['procurements']):
+        with transaction.atomic():
+            supplier_id = supplier_ids[i % len(supplier_ids)]
+            procurement = Procurement.objects.create(is_correspond='0', supplier_id=supplier_id, create_user=user,
+                                                     etd=today + datetime.timedelta(days=rnd.randint(-30, 60)))
+            candidates = supplier_materials[supplier_id]
+            chosen = rnd.sample(candidates, min(rnd.randint(5, 15), len(candidates)))
+            add_procurement_lines(procurement, [BulkLine(row, material_id, rnd.randint(100, 2000))
+                                                for row, material_id in enumerate(chosen, 1)])
+            if i % 3 > 0:
+                procured = ProcurementMaterial.objects.filter(procurement=procurement)\
+                    .values_list('material_id', 'quantity')
+                add_arrive_lines(procurement, [BulkLine(row, material_id, quantity if i % 3 == 2 else quantity // 2)
+                                               for row, (material_id, quantity) in enumerate(procured, 1)], user)
+
+    #部分应收帐款收款，部分应付帐款付款
+    for i, receivable in enumerate(Receivable.objects.filter(ship__order__pi_no__startswith=prefix).order_by('id')):
+        if i % 2:
+            continue
+        with transaction.atomic():
+            receive = Receive.objects.create(invoice_no='R{:06d}'.format(i), receivable=receivable,
+                                             customer_id=receivable.customer_id, create_user=user)
+            details = ReceivableDetail.objects.filter(receivable=receivable).values_list('product_id', 'amount')
+            ReceiveDetail.objects.bulk_create([
+                ReceiveDetail(num=format_num(row), receive=receive, product_id=product_id, amount=amount / 2,
+                              discount=0, currency=currency, rate=1)
+                for row, (product_id, amount) in enumerate(details, 1)], batch_size=BULK_BATCH_SIZE)
+            post_receive(receive)
+    for i, due in enumerate(Due.objects.filter(supplier__title__startswith=prefix + '-S').order_by('id')):
+        if i % 2:
+            continue
+        with transaction.atomic():
+            pay = Pay.objects.create(invoice_no='P{:06d}'.format(i), due=due, supplier_id=due.supplier_id,
+                                     create_user=user)
+            details = DueDetail.objects.filter(due=due).values_list('material_id', 'amount')
+            PayDetail.objects.bulk_create([
+                PayDetail(num=format_num(row), pay=pay, material_id=material_id, amount=amount / 2,
+                          discount=0, currency=currency, rate=1)
+                for row, (material_id, amount) in enumerate(details, 1)], batch_size=BULK_BATCH_SIZE)
+            post_pay(pay)
+
+    #尚未出货订单的制程单，一半已领料
+    graph = BomGraph.load()
+    order_lines = OrderProduct.objects.filter(order__pi_no__startswith=prefix, order__status='N')\
+        .order_by('id').values_list('order_id', 'product_id', 'quantity')
+    for i, (order_id, product_id, quantity) in enumerate(order_lines):
+        with transaction.atomic():
+            process = Process.objects.create(order_id=order_id, product_id=product_id, quantity=quantity,
+                                             create_user=user)
+            details = [ProcessDetail(num=format_num(row), process=process, material_id=material_id,
+                                     quantity=bom_quantity * quantity)
+                       for row, (material_id, bom_quantity)
+                       in enumerate(graph.unit_materials(product_id).items(), 1)]
+            ProcessDetail.objects.bulk_create(details, batch_size=BULK_BATCH_SIZE)
+            if i % 2:
+                try:
+                    post_material_stock('PROCESS', process.id,
+                                        [(d.material_id, 0 - d.quantity) for d in details], user)
+                except StockShortage:
+                    #原料库存不足时该制程单维持尚未领料
+                    continue
+                Process.objects.filter(id=process.id).update(status='C', claimed=datetime.datetime.now(),
+                                                             claim_user=user)
+
+    counts['boms'] = len(boms)
+    counts['order_lines'] = OrderProduct.objects.filter(order__pi_no__startswith=prefix).count()
+    counts['processes'] = len(order_lines)
+    return counts
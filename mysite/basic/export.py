@@ -0,0 +1,152 @@
+import csv
+import datetime
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 2000
+
+#值必须是整数的导出条件
+INT_FILTERS = ('item',)
+
+
+"""
+依keys顺序分页读取查询结果(keyset pagination)，每页最多chunk_size笔
+不使用OFFSET，也不依赖数据库驱动是否支持服务器端游标，内存用量只与chunk_size有关
+keys必须能唯一决定顺序(最后一个通常是id)，且必须包含在fields中
+"""
+def iter_rows(queryset, fields, keys=('id',), chunk_size=EXPORT_CHUNK_SIZE):
+    key_index = [fields.index(key) for key in keys]
+    queryset = queryset.order_by(*keys)
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            condition = Q()
+            for i in range(len(keys)):
+                equal = dict((keys[j], last[j]) for j in range(i))
+                equal[keys[i] + '__gt'] = last[i]
+                condition |= Q(**equal)
+            page = page.filter(condition)
+        rows = list(page.values_list(*fields)[:chunk_size])
+        if not rows:
+            break
+        for row in rows:
+            yield row
+        last = [rows[-1][i] for i in key_index]
+
+
+"""
+导出条件，由request.GET或命令参数取得：
+date_from/date_to: 日期区间，格式YYYY-MM-DD，包含结束日
+"""
+def parse_date_range(date_from, date_to):
+    start = end = None
+    try:
+        if date_from:
+            start = datetime.datetime.strptime(date_from, '%Y-%m-%d')
+        if date_to:
+            end = datetime.datetime.strptime(date_to, '%Y-%m-%d') + datetime.timedelta(days=1)
+    except ValueError:
+        raise ValueError(u'日期格式错误，格式为YYYY-MM-DD')
+    return start, end
+
+
+def filter_date_range(queryset, field, start, end):
+    if start is not None:
+        queryset = queryset.filter(**{field + '__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{field + '__lt': end})
+    return queryset
+
+
+class Echo:
+    #csv.writer写入时直接回传该行，由StreamingHttpResponse逐行送出
+    def write(self, value):
+        return value
+
+
+def _format(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    #加上BOM，Excel开启时才不会乱码
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_format(value) for value in row])
+
+
+def csv_response(filename, header, rows):
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def write_csv(path, header, rows):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([_format(value) for value in row])
+            count += 1
+    return count
+
+
+"""
+写入xlsx，需要安装openpyxl，使用write_only模式逐行写入
+"""
+def write_xlsx(path, header, rows):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImportError(u'导出xlsx需要安装openpyxl')
+
+    count = 0
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(header)
+    for row in rows:
+        sheet.append([_format(value) for value in row])
+        count += 1
+    workbook.save(path)
+    return count
+
+
+"""
+导出CSV的共用视图：
+1.判断使用者是否有权限(permission)
+2.由request.GET取得日期区间(date_from, date_to)与filters中的其他条件，格式错误时回传400
+3.以StreamingHttpResponse逐行送出，不会一次载入所有资料
+"""
+def export_csv(request, permission, name, rows_func, filters=('item',)):
+    return_dict = {}
+    if not request.user.has_perm(permission):
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限导出资料"
+        return JsonResponse(return_dict)
+
+    try:
+        start, end = parse_date_range(request.GET.get('date_from'), request.GET.get('date_to'))
+    except ValueError as e:
+        return_dict['code'] = 1
+        return_dict['msg'] = str(e)
+        return JsonResponse(return_dict, status=400)
+
+    kwargs = {}
+    for key in filters:
+        value = request.GET.get(key) or None
+        if value is not None and key in INT_FILTERS:
+            try:
+                value = int(value)
+            except ValueError:
+                return_dict['code'] = 1
+                return_dict['msg'] = u'{}格式错误，必须是整数'.format(key)
+                return JsonResponse(return_dict, status=400)
+        kwargs[key] = value
+    header, rows = rows_func(start=start, end=end, **kwargs)
+    filename = '{}_{}.csv'.format(name, datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+    return csv_response(filename, header, rows)
@@ -0,0 +1,393 @@
+import csv
+import io
+from django import forms
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
+from django.template.response import TemplateResponse
+from django.urls import path
+from . import costing, masterdata
+from .bom import BomCycle, BomGraph, invalidate_bom
+from .bulk import BULK_BATCH_SIZE, update_rows
+from .models import Bom, Category, Currency, Material, Part, Product, Size, Supplier
+from .numbering import format_num
+from .search import SEARCH_SOURCES, index_rows
+from .signals import bulk_bom_changes
+from .status import in_chunks
+
+#每批写入的笔数，读满一批才查询与写入资料库
+IMPORT_BATCH_SIZE = 1000
+
+#导入画面最多显示的错误行数
+MAX_ERROR_LINES = 100
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+#逐行解码，非UTF-8编码的档案可以回报是第几行
+def _utf8_lines(f):
+    for line, data in enumerate(f, 1):
+        try:
+            yield data.decode('utf-8-sig' if line == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise ValidationError(u'第{}行：档案不是UTF-8编码，请另存为CSV(UTF-8)后再导入'.format(line))
+
+
+#CSV格式错误(如引号未结束)时回报读到第几行
+def _csv_read(reader):
+    try:
+        for values in reader:
+            yield values
+    except csv.Error as e:
+        raise ValidationError(u'第{}行：CSV格式错误，{}'.format(reader.line_num, e))
+
+
+def _csv_rows(f):
+    reader = csv.reader(f if isinstance(f, io.TextIOBase) else _utf8_lines(f))
+    values = _csv_read(reader)
+    header = [_text(name) for name in next(values, [])]
+    return header, ((line, dict(zip(header, (_text(value) for value in row))))
+                    for line, row in enumerate(values, 2) if any(row))
+
+
+def _xlsx_rows(f):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError(u'导入xlsx需要安装openpyxl')
+
+    rows = load_workbook(f, read_only=True, data_only=True).active.iter_rows(values_only=True)
+    header = [_text(name) for name in next(rows, ())]
+    return header, ((line, dict(zip(header, (_text(value) for value in values))))
+                    for line, values in enumerate(rows, 2) if any(value is not None for value in values))
+
+
+"""
+逐行读取CSV(UTF-8)或xlsx档案，第一行为栏位名称，xlsx只读取第一个工作表
+回传(栏位名称, 依序产生(行号, {栏位名称: 文字})的generator)，空白行略过
+"""
+def read_rows(f, name):
+    if name.lower().endswith('.xlsx'):
+        return _xlsx_rows(f)
+    return _csv_rows(f)
+
+
+def _title_map(model, **filters):
+    return dict((row.title, row.pk) for row in masterdata.rows(model)
+                if all(getattr(row, key) == value for key, value in filters.items()))
+
+
+"""
+原料与商品依名称(title)新增或更新：
+1.外键栏位填写名称(币别填写代码)，开始时一次读入对照表，每行在内存中检查，不逐行查询
+2.其他栏位以Model.clean_fields检查格式与长度，错误记录行号后略过该行
+3.每IMPORT_BATCH_SIZE行查询一次已有资料的现值，新资料bulk_create，内容不同的资料以update_rows整批更新
+4.整批写入不会触发signal，每批以内存中的值更新搜寻索引，更新的资料只有搜寻栏位不同时才更新索引
+新增的资料状态为待审核，库存数量与状态不由档案更新
+"""
+class MasterImporter:
+    model = None
+    columns = []
+    foreign_keys = {}
+    kind = None
+
+    def __init__(self):
+        self.result = ImportResult()
+        self.maps = dict((column, load()) for column, load in self.foreign_keys.items())
+        self.existing = dict(self.model.objects.values_list('title', 'id'))
+        self.seen = set()
+        self.pending = []
+        self.created_ids = []
+        self.updated_ids = []
+
+    @property
+    def required(self):
+        return [column for column in self.columns if not self.model._meta.get_field(column).blank]
+
+    def add(self, line, record):
+        title = record.get('title', '')
+        if title in self.seen:
+            self.result.error(line, u'名称[{}]在档案中重复'.format(title))
+            return
+        self.seen.add(title)
+
+        errors = []
+        values = {}
+        for column in self.columns:
+            field = self.model._meta.get_field(column)
+            value = record.get(column, '')
+            if column not in self.maps:
+                values[column] = value
+            elif value:
+                if value not in self.maps[column]:
+                    errors.append(u'{}[{}]不存在或未核准'.format(field.verbose_name, value))
+                values[field.attname] = self.maps[column].get(value)
+            elif not field.null:
+                errors.append(u'{}必须填写'.format(field.verbose_name))
+        obj = self.model(**values)
+        try:
+            obj.clean_fields(exclude=[column for column in self.maps] + ['status', 'stock'])
+        except ValidationError as e:
+            errors.extend(u'{}：{}'.format(self.model._meta.get_field(column).verbose_name, ' '.join(messages))
+                          for column, messages in e.message_dict.items())
+        if errors:
+            self.result.error(line, u'；'.join(errors))
+            return
+        self.pending.append(obj)
+        if len(self.pending) >= IMPORT_BATCH_SIZE:
+            self.flush()
+
+    def search_values(self, obj):
+        return [getattr(obj, field) for field in SEARCH_SOURCES[self.kind].all_fields]
+
+    def flush(self):
+        fields = [self.model._meta.get_field(column).attname for column in self.columns if column != 'title']
+        #名称是对照的依据不会变动，只需比较其他搜寻栏位
+        indexed = [i for i, field in enumerate(fields) if field in SEARCH_SOURCES[self.kind].all_fields]
+        created = [obj for obj in self.pending if obj.title not in self.existing]
+        updated = [obj for obj in self.pending if obj.title in self.existing]
+        self.pending = []
+
+        if created:
+            self.model.objects.bulk_create(created, batch_size=BULK_BATCH_SIZE)
+            #MySQL的bulk_create不会回传id，依名称重新查询
+            ids = dict(self.model.objects.filter(title__in=[obj.title for obj in created]).values_list('title', 'id'))
+            self.existing.update(ids)
+            self.created_ids.extend(ids.values())
+            self.result.created += len(ids)
+            index_rows(self.kind, dict((ids[obj.title], self.search_values(obj)) for obj in created), created=True)
+
+        if updated:
+            for obj in updated:
+                obj.pk = self.existing[obj.title]
+            current = dict((row[0], row[1:]) for row in self.model.objects.filter(pk__in=[obj.pk for obj in updated])
+                           .values_list('pk', *fields))
+            changed = []
+            reindexed = {}
+            for obj in updated:
+                values = tuple(getattr(obj, field) for field in fields)
+                if current.get(obj.pk) != values:
+                    changed.append(obj)
+                    if any(current[obj.pk][i] != values[i] for i in indexed):
+                        reindexed[obj.pk] = self.search_values(obj)
+            update_rows(self.model, changed, fields)
+            index_rows(self.kind, reindexed)
+            self.updated_ids.extend(obj.pk for obj in changed)
+            self.result.updated += len(changed)
+            self.result.unchanged += len(updated) - len(changed)
+
+    def finish(self):
+        self.flush()
+
+
+class MaterialImporter(MasterImporter):
+    model = Material
+    kind = 'material'
+    columns = ['title', 'image_sub', 'supplier', 'category', 'price', 'tax', 'tax_price', 'currency', 'description']
+    foreign_keys = {
+        'supplier': lambda: dict(Supplier.objects.values_list('title', 'id')),
+        'category': lambda: _title_map(Category, status='A'),
+        'currency': lambda: dict((row.pk, row.pk) for row in masterdata.rows(Currency)),
+    }
+
+    def finish(self):
+        super().finish()
+        if self.updated_ids:
+            #原料含税价与币别影响使用该原料的商品标准成本
+            costing.mark_dirty(materials=self.updated_ids)
+
+
+class ProductImporter(MasterImporter):
+    model = Product
+    kind = 'product'
+    columns = ['title', 'part', 'size', 'image_sub', 'price', 'tax', 'tax_price', 'currency', 'description']
+    foreign_keys = {
+        'part': lambda: _title_map(Part, status='A'),
+        'size': lambda: _title_map(Size, status='A'),
+        'currency': lambda: dict((row.pk, row.pk) for row in masterdata.rows(Currency)),
+    }
+
+    def finish(self):
+        super().finish()
+        costing.mark_dirty(products=self.created_ids)
+
+
+"""
+BOM表依商品整批取代：档案中出现的商品，原有的单身全部删除，依档案顺序重新编项次
+1.商品、原料、半成品填写名称，原料与半成品只能填写一个，且必须是已核准的资料
+2.读完整个档案后以新的单身展开BOM表，有循环的商品维持原有的单身并记录错误
+3.以bulk_create写入，不逐笔执行Bom.save计算项次
+"""
+class BomImporter:
+    columns = ['product', 'material', 'component', 'quantity']
+    required = ['product', 'quantity']
+
+    def __init__(self):
+        self.result = ImportResult()
+        self.products = dict(Product.objects.values_list('title', 'id'))
+        self.components = dict(Product.objects.filter(status='A').values_list('title', 'id'))
+        self.materials = dict(Material.objects.filter(status='A').values_list('title', 'id'))
+        self.lines = {}
+        self.first_lines = {}
+
+    def add(self, line, record):
+        errors = []
+        product_id = self.products.get(record.get('product', ''))
+        if product_id is None:
+            errors.append(u'商品[{}]不存在'.format(record.get('product', '')))
+        material, component = record.get('material', ''), record.get('component', '')
+        if bool(material) == bool(component):
+            errors.append(u'原料与半成品必须填写一个，且只能填写一个')
+        elif material and material not in self.materials:
+            errors.append(u'原料[{}]不存在或未核准'.format(material))
+        elif component and component not in self.components:
+            errors.append(u'半成品[{}]不存在或未核准'.format(component))
+        elif component and self.components[component] == product_id:
+            errors.append(u'商品不能是自己的半成品')
+        quantity = record.get('quantity', '')
+        if not quantity.isdigit() or int(quantity) == 0:
+            errors.append(u'组成数量必须是正整数')
+        if errors:
+            self.result.error(line, u'；'.join(errors))
+            return
+        self.first_lines.setdefault(product_id, line)
+        self.lines.setdefault(product_id, []).append(
+            (self.materials.get(material), self.components.get(component), int(quantity)))
+
+    def _cycles(self):
+        rows = [row for row in Bom.objects.order_by('id').values_list('product_id', 'material_id', 'component_id',
+                                                                       'quantity') if row[0] not in self.lines]
+        rows.extend((product_id,) + line for product_id, lines in self.lines.items() for line in lines)
+        graph = BomGraph(rows)
+        cycles = {}
+        for product_id in self.lines:
+            try:
+                graph.unit_materials(product_id)
+            except BomCycle as e:
+                cycles[product_id] = str(e)
+        return cycles
+
+    def finish(self):
+        #有循环的商品移除后，其他商品可能因此不再有循环，重新检查到没有循环为止
+        cycles = self._cycles()
+        while cycles:
+            for product_id, message in cycles.items():
+                self.result.error(self.first_lines[product_id], message)
+                del self.lines[product_id]
+            cycles = self._cycles()
+
+        product_ids = sorted(self.lines)
+        for ids in in_chunks(product_ids):
+            existing = set(Bom.objects.filter(product_id__in=ids).values_list('product_id', flat=True).distinct())
+            self.result.updated += len(existing)
+            self.result.created += len(ids) - len(existing)
+            #删除时不逐笔失效BOM快取与记录重算，完成后一次处理
+            with bulk_bom_changes():
+                Bom.objects.filter(product_id__in=ids).delete()
+            Bom.objects.bulk_create([Bom(num=format_num(i), product_id=product_id, material_id=material_id,
+                                         component_id=component_id, quantity=quantity)
+                                     for product_id in ids
+                                     for i, (material_id, component_id, quantity)
+                                     in enumerate(self.lines[product_id], 1)], batch_size=BULK_BATCH_SIZE)
+        if product_ids:
+            invalidate_bom()
+            costing.mark_dirty(products=product_ids)
+
+
+IMPORTERS = {
+    'material': (MaterialImporter, Material),
+    'product': (ProductImporter, Product),
+    'bom': (BomImporter, Bom),
+}
+
+
+"""
+导入原料、商品或BOM表档案，整个档案在同一个交易中写入，有错误的行略过，其他行照常导入
+缺少必填栏位时抛出ValidationError，不导入任何资料
+回传ImportResult：新增/更新/未变更笔数(BOM表为商品数)与[(行号, 错误讯息)]
+"""
+def import_file(kind, f, name):
+    importer = IMPORTERS[kind][0]()
+    header, rows = read_rows(f, name)
+    missing = [column for column in importer.required if column not in header]
+    if missing:
+        raise ValidationError(u'档案缺少栏位：{}'.format(', '.join(missing)))
+    with transaction.atomic():
+        for line, record in rows:
+            importer.add(line, record)
+        importer.finish()
+    return importer.result
+
+
+class ImportForm(forms.Form):
+    kind = forms.ChoiceField(label=u'资料类别')
+    file = forms.FileField(label=u'档案', help_text=u'CSV(UTF-8)或xlsx，第一行为栏位名称，依名称新增或更新')
+
+
+"""
+管理界面列表上方加入"导入"页面，import_kinds为可导入的资料类别(IMPORTERS)
+使用者必须有该资料的新增与修改权限
+"""
+class ImportMixin:
+    change_list_template = 'admin/basic/import_change_list.html'
+    import_kinds = []
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_view), name='%s_%s_import' % info),
+        ]
+        return urls + super().get_urls()
+
+    def get_import_kinds(self, request):
+        kinds = []
+        for kind in self.import_kinds:
+            opts = IMPORTERS[kind][1]._meta
+            if request.user.has_perm('{}.add_{}'.format(opts.app_label, opts.model_name)) and \
+                    request.user.has_perm('{}.change_{}'.format(opts.app_label, opts.model_name)):
+                kinds.append(kind)
+        return kinds
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['has_import_permission'] = bool(self.get_import_kinds(request))
+        return super().changelist_view(request, extra_context)
+
+    def import_view(self, request):
+        kinds = self.get_import_kinds(request)
+        if not kinds:
+            raise PermissionDenied
+
+        result = None
+        form = ImportForm(request.POST or None, request.FILES or None)
+        form.fields['kind'].choices = [(kind, IMPORTERS[kind][1]._meta.verbose_name) for kind in kinds]
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                result = import_file(form.cleaned_data['kind'], upload.file, upload.name)
+            except ValidationError as e:
+                form.add_error('file', e)
+            except ImportError as e:
+                form.add_error('file', str(e))
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title=u'导入{}'.format(u'、'.join(str(IMPORTERS[kind][1]._meta.verbose_name) for kind in kinds)),
+            opts=self.model._meta,
+            form=form,
+            result=result,
+            errors=result.errors[:MAX_ERROR_LINES] if result else [],
+        )
+        return TemplateResponse(request, 'admin/basic/import.html', context)
@@ -0,0 +1,65 @@
+import datetime
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from basic.benchmark import compare, run_benchmark
+
+
+"""
+效能测试：
+1.建立测试资料库(不会动到正式资料库)
+2.依序以各资料量倍数产生资料，量测所有视图与过账流程的查询次数、数据库时间与耗时
+3.结果写入JSON档，指定--baseline时与之前的结果比较，有退步时以错误结束
+"""
+class Command(BaseCommand):
+    help = u'在测试资料库中产生不同资料量，量测各视图与过账流程的查询次数与耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1,2,4', help=u'资料量倍数，以逗号分隔')
+        parser.add_argument('--seed', type=int, default=0, help=u'随机数种子')
+        parser.add_argument('--repeat', type=int, default=3, help=u'每个视图执行次数')
+        parser.add_argument('--output', default='benchmark.json', help=u'结果JSON档')
+        parser.add_argument('--baseline', help=u'作为比较基准的结果JSON档')
+        parser.add_argument('--tolerance', type=float, default=0.5, help=u'耗时可容许增加的比例')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [float(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError(u'资料量倍数格式错误：{}'.format(options['scales']))
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            runs = run_benchmark(scales, seed=options['seed'], repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        result = {
+            'created': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'vendor': connection.vendor,
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'runs': runs,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+        for run in runs:
+            for item in run['urls'] + run['postings']:
+                self.stdout.write(u'[scale {}] {:<48} {:>4} {:>5} 次查询 {:>10.3f}ms'.format(
+                    run['scale'], item['name'], item['status'], item['queries'], item['wall_time']))
+        self.stdout.write(u'结果已写入 {}'.format(options['output']))
+
+        if baseline is not None:
+            regressions = compare(baseline, runs, options['tolerance'])
+            if regressions:
+                raise CommandError('\n'.join(regressions))
+            self.stdout.write(u'与基准比较没有退步')
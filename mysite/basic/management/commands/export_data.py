@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from basic.export import parse_date_range, write_csv, write_xlsx
+from inventory.export import mtran_rows, ptran_rows
+from sale.export import margin_rows, order_rows
+
+EXPORTS = {
+    'mtran': (mtran_rows, ('item', 'source_form')),
+    'ptran': (ptran_rows, ('item', 'source_form')),
+    'order': (order_rows, ('item',)),
+    'margin': (margin_rows, ('item',)),
+}
+
+
+class Command(BaseCommand):
+    help = u'导出原料/商品库存异动、订单与订单单身或订单毛利，逐批读取写入档案'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help=u'导出资料类别')
+        parser.add_argument('path', help=u'导出档案，副档名为.csv或.xlsx')
+        parser.add_argument('--date-from', help=u'开始日期，格式YYYY-MM-DD')
+        parser.add_argument('--date-to', help=u'结束日期(含)，格式YYYY-MM-DD')
+        parser.add_argument('--item', type=int, help=u'原料/商品id')
+        parser.add_argument('--source-form', help=u'来源单类别，仅适用于库存异动')
+
+    def handle(self, *args, **options):
+        rows_func, filters = EXPORTS[options['kind']]
+        if options['source_form'] and 'source_form' not in filters:
+            raise CommandError(u'{}不支持--source-form'.format(options['kind']))
+        try:
+            start, end = parse_date_range(options['date_from'], options['date_to'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        header, rows = rows_func(start=start, end=end, **dict((key, options[key]) for key in filters))
+        path = options['path']
+        if path.endswith('.xlsx'):
+            try:
+                count = write_xlsx(path, header, rows)
+            except ImportError as e:
+                raise CommandError(str(e))
+        else:
+            count = write_csv(path, header, rows)
+        self.stdout.write(u'已导出 {} 笔至 {}'.format(count, path))
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from basic.datagen import generate
+
+
+class Command(BaseCommand):
+    help = u'产生供效能测试使用的供货商、客户、原料、商品、BOM表与各种单据'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help=u'建立人员帐号')
+        parser.add_argument('--scale', type=float, default=1, help=u'资料量倍数，1为20张订单与20张采购单')
+        parser.add_argument('--seed', type=int, default=0, help=u'随机数种子，相同种子产生相同资料')
+        parser.add_argument('--prefix', default='GEN', help=u'名称前缀，重复产生资料时必须不同')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(u'帐号[{}]不存在'.format(options['user']))
+
+        counts = generate(user, scale=options['scale'], seed=options['seed'], prefix=options['prefix'])
+        for key, count in sorted(counts.items()):
+            self.stdout.write(u'{}: {}'.format(key, count))
@@ -0,0 +1,31 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from basic.export import write_csv
+from basic.importer import IMPORTERS, import_file
+
+#错误讯息最多显示的行数，其余写入--errors指定的档案
+MAX_ERROR_LINES = 50
+
+
+class Command(BaseCommand):
+    help = u'由CSV或xlsx档案导入原料、商品或BOM表，依名称新增或更新'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help=u'导入资料类别')
+        parser.add_argument('path', help=u'导入档案，副档名为.csv或.xlsx')
+        parser.add_argument('--errors', help=u'所有错误写入此CSV档案')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, 'rb') as f:
+                result = import_file(options['kind'], f, path)
+        except (ImportError, ValidationError) as e:
+            raise CommandError(' '.join(e.messages) if isinstance(e, ValidationError) else str(e))
+
+        self.stdout.write(u'新增 {} 笔，更新 {} 笔，未变更 {} 笔，错误 {} 笔'.format(
+            result.created, result.updated, result.unchanged, len(result.errors)))
+        for line, message in result.errors[:MAX_ERROR_LINES]:
+            self.stdout.write(u'第{}行：{}'.format(line, message))
+        if options['errors'] and result.errors:
+            write_csv(options['errors'], [u'行号', u'错误讯息'], result.errors)
@@ -0,0 +1,29 @@
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand
+from django.db.models import Value
+from django.db.models.functions import LPad
+from basic.numbering import NUM_WIDTH
+
+#有单身项次(num)的应用
+NUMBERED_APPS = ['basic', 'sale', 'purchase', 'inventory', 'finance']
+
+
+"""
+旧资料的单身项次只有两位(01,02...)，补零到NUM_WIDTH位，同一张单据新旧单身依项次排序时顺序才正确
+每个单身表以一个UPDATE语句处理，已补零的项次不会再修改，可重复执行
+"""
+class Command(BaseCommand):
+    help = u'将旧资料的单身项次补零到{}位'.format(NUM_WIDTH)
+
+    def handle(self, *args, **options):
+        for model in apps.get_models():
+            if model._meta.app_label not in NUMBERED_APPS:
+                continue
+            try:
+                model._meta.get_field('num')
+            except FieldDoesNotExist:
+                continue
+            count = model.objects.filter(num__regex=r'^[0-9]{{1,{}}}$'.format(NUM_WIDTH - 1))\
+                .update(num=LPad('num', NUM_WIDTH, Value('0')))
+            self.stdout.write(u'{}补零 {} 笔'.format(model._meta.verbose_name, count))
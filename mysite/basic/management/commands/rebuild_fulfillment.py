@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from finance.models import Due, Receivable
+from finance.status import rebuild_due_lines, rebuild_receivable_lines
+from purchase.models import Procurement
+from purchase.status import rebuild_procurement_lines
+from sale.models import Order
+from sale.status import rebuild_order_lines
+
+KINDS = {
+    'order': (Order, rebuild_order_lines, u'订单'),
+    'procurement': (Procurement, rebuild_procurement_lines, u'采购单'),
+    'receivable': (Receivable, rebuild_receivable_lines, u'应收帐款'),
+    'due': (Due, rebuild_due_lines, u'应付帐款'),
+}
+
+
+"""
+重新计算单身维护的已完成数量/金额栏位：
+1.订单单身的已出货数量(shipped_quantity)与已收含税金额(tax_receive)
+2.采购单单身的已到货数量(arrived_quantity)与已付含税金额(tax_pay)
+3.应收/应付帐款单身的已收/已付金额(received_amount/paid_amount)
+依id分批读取单据，每批以group by查询合计后以一个UPDATE写回，并重新计算单据状态
+资料由旧版本升级或直接修改资料库后执行
+"""
+class Command(BaseCommand):
+    help = u'由出货/到货/收款/付款单身重新计算订单、采购单与应收/应付帐款单身的已完成栏位'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['all'] + list(KINDS), default='all',
+                            help=u'重新计算的单据类别')
+        parser.add_argument('--chunk-size', type=int, default=1000, help=u'每批读取笔数')
+
+    def handle(self, *args, **options):
+        kinds = list(KINDS) if options['kind'] == 'all' else [options['kind']]
+        for kind in kinds:
+            model, rebuild, label = KINDS[kind]
+            count = 0
+            for ids in self.iter_ids(model, options['chunk_size']):
+                with transaction.atomic():
+                    rebuild(ids)
+                count += len(ids)
+            self.stdout.write(u'{}重新计算 {} 笔'.format(label, count))
+
+    def iter_ids(self, model, chunk_size):
+        last_id = 0
+        while True:
+            ids = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            yield ids
+            last_id = ids[-1]
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from basic.search import SEARCH_SOURCES, rebuild
+
+
+"""
+重建搜寻索引(三字元组与字词)，资料由旧版本升级、直接修改资料库或以update整批修改索引栏位后执行
+"""
+class Command(BaseCommand):
+    help = u'重建原料、商品、供货商、客户、订单与收付款单的搜寻索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['all'] + list(SEARCH_SOURCES), default='all',
+                            help=u'重建的资料类别')
+        parser.add_argument('--chunk-size', type=int, default=1000, help=u'每批读取笔数')
+
+    def handle(self, *args, **options):
+        kinds = list(SEARCH_SOURCES) if options['kind'] == 'all' else [options['kind']]
+        for kind in kinds:
+            with transaction.atomic():
+                count = rebuild(kind, options['chunk_size'])
+            self.stdout.write(u'{}重建索引 {} 笔'.format(SEARCH_SOURCES[kind].model._meta.verbose_name, count))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from basic.costing import rollup
+
+
+class Command(BaseCommand):
+    help = u'重新计算所有商品的标准原料成本，写入商品标准成本表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', help=u'只计算指定商品id，可重复指定')
+
+    def handle(self, *args, **options):
+        count = rollup(options['product'])
+        self.stdout.write(u'已计算 {} 个商品的标准成本'.format(count))
@@ -0,0 +1,182 @@
+import threading
+import time
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.forms.models import ModelChoiceIterator
+from .models import Category, Currency, Part, Period, Size
+
+#很少异动且经常读取的基本资料，整个表读入进程内存
+MASTER_MODELS = (Currency, Period, Category, Part, Size)
+
+VERSION_KEY = 'masterdata:version:{}'
+
+_tables = {}
+_local = threading.local()
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _pending():
+    if not hasattr(_local, 'pending'):
+        _local.pending = {}
+    return _local.pending
+
+
+def _shared_version(model):
+    key = VERSION_KEY.format(_label(model))
+    cache.add(key, 1, None)
+    return cache.get(key) or 1
+
+
+def _load(model, version):
+    rows = list(model.objects.order_by('pk'))
+    return {'version': version, 'checked': time.monotonic(), 'rows': dict((row.pk, row) for row in rows),
+            'ordered': rows}
+
+
+#交易或savepoint回滚时Django会移除其中登记的on_commit回调，回调仍在表示该次异动仍未提交也未回滚
+def _registered(connection, callback):
+    return any(item[1] is callback for item in connection.run_on_commit)
+
+
+"""
+取得基本资料表的进程内副本：
+1.距离上次检查不到MASTER_DATA_CHECK_INTERVAL秒时直接使用进程内副本，不查询共用快取与资料库
+2.否则读取共用快取中的版本号，版本号与进程内副本不同时重新读入整个表
+3.目前的交易异动过该表且尚未提交时，改用本线程专属的副本，不影响其他线程与进程
+  专属副本以异动时登记的on_commit回调对应到该次交易：部分异动所在的savepoint回滚时重新读入，
+  全部异动都已回滚时丢弃，回滚的资料不会留到下一个交易
+"""
+def _table(model):
+    label = _label(model)
+    pending = _pending()
+    if label in pending:
+        entry = pending[label]
+        connection = transaction.get_connection()
+        callbacks = [callback for callback in entry['callbacks'] if _registered(connection, callback)]
+        if callbacks:
+            if len(callbacks) != len(entry['callbacks']):
+                entry['callbacks'] = callbacks
+                entry['table'] = None
+            if entry['table'] is None:
+                entry['table'] = _load(model, None)
+            return entry['table']
+        del pending[label]
+
+    table = _tables.get(label)
+    now = time.monotonic()
+    if table is not None and now - table['checked'] < getattr(settings, 'MASTER_DATA_CHECK_INTERVAL', 1):
+        return table
+    version = _shared_version(model)
+    if table is None or table['version'] != version:
+        table = _load(model, version)
+        _tables[label] = table
+    table['checked'] = now
+    return table
+
+
+"""
+依主键取得基本资料，找不到时(其他进程刚新增、本进程尚未重新读入)再查询资料库
+回传的物件由所有请求共用，不可修改
+"""
+def get(model, pk):
+    row = _table(model)['rows'].get(pk)
+    if row is None:
+        row = model.objects.filter(pk=pk).first()
+    return row
+
+
+def rows(model):
+    return list(_table(model)['ordered'])
+
+
+def choice_list(model):
+    return [(row.pk, str(row)) for row in _table(model)['ordered']]
+
+
+"""
+基本资料异动后呼叫(post_save/post_delete)：
+1.立即丢弃本进程的副本，交易提交前本线程改用专属的副本
+2.交易提交后递增共用快取中的版本号，其他进程在下次检查时重新读入
+"""
+def invalidate(model):
+    label = _label(model)
+    _tables.pop(label, None)
+    callback = lambda: _committed(model)
+    if transaction.get_connection().in_atomic_block:
+        entry = _pending().setdefault(label, {'callbacks': [], 'table': None})
+        entry['callbacks'].append(callback)
+        entry['table'] = None
+    transaction.on_commit(callback)
+
+
+def _committed(model):
+    label = _label(model)
+    _pending().pop(label, None)
+    _tables.pop(label, None)
+    key = VERSION_KEY.format(label)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 2, None)
+
+
+"""
+预先读入所有基本资料表，启动后处理第一个请求前执行
+"""
+def warm():
+    for model in MASTER_MODELS:
+        _table(model)
+
+
+def clear():
+    _tables.clear()
+    _pending().clear()
+
+
+"""
+下拉选单选项由进程内副本产生，画面显示时不查询资料库，存盘验证时仍以queryset检查资料是否存在
+limit_choices_to只支援栏位等于条件(例如{'status': 'A'})，其他条件仍由资料库读取选项
+"""
+class MasterDataChoiceIterator(ModelChoiceIterator):
+    def rows(self):
+        limit = self.field.get_limit_choices_to() or {}
+        if not isinstance(limit, dict) or any('__' in key for key in limit):
+            return None
+        return [row for row in _table(self.queryset.model)['ordered']
+                if all(getattr(row, key) == value for key, value in limit.items())]
+
+    def __iter__(self):
+        rows = self.rows()
+        if rows is None:
+            yield from super().__iter__()
+            return
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for row in rows:
+            yield self.choice(row)
+
+    def __len__(self):
+        return len(list(self))
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.rows() is None or self.rows())
+
+
+class MasterDataChoiceField(forms.ModelChoiceField):
+    iterator = MasterDataChoiceIterator
+
+
+"""
+管理界面中指向基本资料的下拉选单改用MasterDataChoiceField，raw_id_fields与自订queryset的栏位不变
+"""
+class MasterDataChoicesMixin:
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.related_model in MASTER_MODELS and db_field.name not in self.raw_id_fields \
+                and 'queryset' not in kwargs:
+            kwargs['form_class'] = MasterDataChoiceField
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
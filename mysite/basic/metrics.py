@@ -0,0 +1,186 @@
+import contextlib
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+"""
+SQL指纹：把字串、数字与IN列表换成占位符，只差参数的查询会得到相同指纹
+同一个指纹在一次请求中出现多次，通常是逐笔查询(N+1)
+"""
+def fingerprint(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+"""
+记录一段程序执行的查询次数、数据库时间、重复查询指纹与总耗时：
+with QueryMetrics() as metrics:
+    ...
+metrics.count, metrics.db_time, metrics.duplicates(), metrics.wall_time
+时间单位为毫秒，以connection.execute_wrapper记录所有数据库连接的查询
+"""
+class QueryMetrics:
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.wall_time = 0.0
+        self.fingerprints = Counter()
+        self._stack = None
+        self._started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time = (time.perf_counter() - self._started) * 1000
+        self._stack.close()
+        return False
+
+    def duplicates(self, limit=10):
+        return [(sql, count) for sql, count in self.fingerprints.most_common(limit) if count > 1]
+
+    def as_dict(self):
+        return {
+            'queries': self.count,
+            'db_time': round(self.db_time, 3),
+            'wall_time': round(self.wall_time, 3),
+            'duplicates': [{'sql': sql, 'count': count} for sql, count in self.duplicates()],
+        }
+
+
+"""
+依名称(视图名称或过账名称)累计的统计，供metrics视图读取
+"""
+_lock = threading.Lock()
+_stats = {}
+
+
+def record(name, metrics):
+    with _lock:
+        stat = _stats.setdefault(name, {'calls': 0, 'queries': 0, 'max_queries': 0, 'db_time': 0.0,
+                                        'wall_time': 0.0, 'max_wall_time': 0.0, 'over_budget': 0})
+        stat['calls'] += 1
+        stat['queries'] += metrics.count
+        stat['max_queries'] = max(stat['max_queries'], metrics.count)
+        stat['db_time'] += metrics.db_time
+        stat['wall_time'] += metrics.wall_time
+        stat['max_wall_time'] = max(stat['max_wall_time'], metrics.wall_time)
+        if budget_exceeded(name, metrics):
+            stat['over_budget'] += 1
+
+
+def snapshot():
+    with _lock:
+        result = {}
+        for name, stat in _stats.items():
+            stat = dict(stat)
+            stat['avg_queries'] = round(stat['queries'] / stat['calls'], 2)
+            stat['avg_db_time'] = round(stat['db_time'] / stat['calls'], 3)
+            stat['avg_wall_time'] = round(stat['wall_time'] / stat['calls'], 3)
+            stat['db_time'] = round(stat['db_time'], 3)
+            stat['wall_time'] = round(stat['wall_time'], 3)
+            stat['max_wall_time'] = round(stat['max_wall_time'], 3)
+            result[name] = stat
+        return result
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def budget_exceeded(name, metrics):
+    budget = getattr(settings, 'QUERY_BUDGETS', {}).get(name)
+    return budget is not None and metrics.count > budget
+
+
+"""
+检查查询次数是否超过settings.QUERY_BUDGETS中设定的上限
+超过时记录警告，QUERY_BUDGET_STRICT为True时(测试用)抛出QueryBudgetExceeded
+"""
+def check_budget(name, metrics):
+    if not budget_exceeded(name, metrics):
+        return
+    message = u'{} 执行了 {} 次查询，超过上限 {}，重复查询：{}'.format(
+        name, metrics.count, settings.QUERY_BUDGETS[name], metrics.duplicates(3))
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+"""
+量测一段过账程序，可作为context manager或decorator使用：
+@measure('posting:ship')
+def post_ship(ship, user):
+"""
+class measure(contextlib.ContextDecorator):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.metrics = QueryMetrics().__enter__()
+        return self.metrics
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.__exit__(exc_type, exc_value, traceback)
+        record(self.name, self.metrics)
+        if exc_type is None:
+            check_budget(self.name, self.metrics)
+        return False
+
+
+#无法对应到视图的请求(404等)统一累计在这个名称下，避免任意路径使统计无限增长
+UNRESOLVED = '<unresolved>'
+
+
+"""
+每个请求记录查询次数、数据库时间与总耗时：
+1.DEBUG模式或员工(is_staff)的请求加入回应标头X-DB-Queries, X-DB-Time, X-Wall-Time(毫秒)与X-DB-Duplicates(重复查询次数)
+2.依视图名称(app_name:name)累计统计并检查查询上限，无法对应视图的请求累计在UNRESOLVED
+串流回应(StreamingHttpResponse)只计算送出回应前的查询
+"""
+class QueryMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryMetrics() as metrics:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else UNRESOLVED
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['X-DB-Queries'] = str(metrics.count)
+            response['X-DB-Time'] = '{:.3f}'.format(metrics.db_time)
+            response['X-Wall-Time'] = '{:.3f}'.format(metrics.wall_time)
+            response['X-DB-Duplicates'] = str(sum(count - 1 for sql, count in metrics.duplicates(None)))
+        record(name, metrics)
+        check_budget(name, metrics)
+        return response
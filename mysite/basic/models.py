@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.urls import reverse
 
@@ -187,7 +188,7 @@ class Product(models.Model):
     tax_price = models.DecimalField(max_digits=16, decimal_places=4, verbose_name=u'含税价', null=False, blank=False)
     currency = models.ForeignKey(Currency, verbose_name=u'报价币别', blank=False, null=False, on_delete=models.PROTECT)
     description = models.CharField(max_length=256, verbose_name=u'描述', blank=True)
-    combines = models.ManyToManyField(Material, through='Bom')
+    combines = models.ManyToManyField(Material, through='Bom', through_fields=('product', 'material'))
     status = models.CharField(max_length=1, choices=STATUS_CHOICES, default='W', verbose_name=u'状态')
     stock = models.PositiveIntegerField(default=0, verbose_name=u'库存数量')
 
@@ -206,18 +207,42 @@ class Product(models.Model):
         )
 
 
+class Sequence(models.Model):
+    name = models.CharField(max_length=16, verbose_name=u'单据类别')
+    period = models.CharField(max_length=16, verbose_name=u'期间')
+    last = models.PositiveIntegerField(default=0, verbose_name=u'最后使用号码')
+
+    def __str__(self):
+        return '{}-{}'.format(self.name, self.period)
+
+    class Meta:
+        verbose_name = '单据流水号'
+        verbose_name_plural = verbose_name
+        unique_together = (('name', 'period'),)
+
+
 class Bom(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     product = models.ForeignKey(Product, verbose_name='商品', on_delete=models.CASCADE)
-    material = models.ForeignKey(Material, verbose_name='原料', on_delete=models.PROTECT, limit_choices_to={'status': 'A'},)
+    material = models.ForeignKey(Material, verbose_name='原料', null=True, blank=True, on_delete=models.PROTECT,
+                                 limit_choices_to={'status': 'A'},)
+    component = models.ForeignKey(Product, verbose_name=u'半成品', null=True, blank=True, related_name='used_in_boms',
+                                  on_delete=models.PROTECT, limit_choices_to={'status': 'A'},
+                                  help_text=u'组成为半成品商品时填写，原料与半成品只能填写一个')
     quantity = models.PositiveIntegerField(default=1, verbose_name=u'组成数量')
 
+    def clean(self):
+        if (self.material_id is None) == (self.component_id is None):
+            raise ValidationError(u'BOM表单身的原料与半成品必须填写一个，且只能填写一个')
+        if self.component_id is not None and self.component_id == self.product_id:
+            raise ValidationError(u'商品不能是自己的半成品')
+
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...，numbering引用本模块，在此才载入
+            from .numbering import format_num
             boms = Bom.objects.filter(product=self.product)
-            num = "{0:02d}".format(boms.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(boms.count() + 1)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -226,4 +251,55 @@ class Bom(models.Model):
     class Meta:
         verbose_name = 'BOM表'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['product', 'material']),
+            models.Index(fields=['material', 'product']),
+            models.Index(fields=['component', 'product']),
+        ]
+
+
+class ProductCost(models.Model):
+    product = models.OneToOneField(Product, verbose_name=u'商品', related_name='cost', on_delete=models.CASCADE)
+    material_cost = models.DecimalField(max_digits=16, decimal_places=4, default=0, verbose_name=u'标准原料成本',
+                                        help_text=u'BOM表原料含税价依汇率换算为本位币后的合计')
+
+    def __str__(self):
+        return '{}'.format(self.product_id)
+
+    class Meta:
+        verbose_name = u'商品标准成本'
+        verbose_name_plural = verbose_name
+
+
+class SearchGram(models.Model):
+    kind = models.CharField(max_length=16, verbose_name=u'资料类别')
+    object_id = models.PositiveIntegerField(verbose_name=u'资料id')
+    gram = models.CharField(max_length=3, verbose_name=u'三字元组')
+
+    def __str__(self):
+        return '{}-{}-{}'.format(self.kind, self.object_id, self.gram)
+
+    class Meta:
+        verbose_name = u'搜寻索引(三字元组)'
+        verbose_name_plural = verbose_name
+        unique_together = (('kind', 'object_id', 'gram'),)
+        indexes = [
+            models.Index(fields=['kind', 'gram', 'object_id']),
+        ]
+
 
+class SearchWord(models.Model):
+    kind = models.CharField(max_length=16, verbose_name=u'资料类别')
+    object_id = models.PositiveIntegerField(verbose_name=u'资料id')
+    word = models.CharField(max_length=32, verbose_name=u'字词')
+
+    def __str__(self):
+        return '{}-{}-{}'.format(self.kind, self.object_id, self.word)
+
+    class Meta:
+        verbose_name = u'搜寻索引(字词)'
+        verbose_name_plural = verbose_name
+        unique_together = (('kind', 'object_id', 'word'),)
+        indexes = [
+            models.Index(fields=['kind', 'word', 'object_id']),
+        ]
@@ -0,0 +1,52 @@
+from django import forms
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import Sequence
+
+
+#单身项次栏位(num)的长度，项次补零到此长度，依字串排序时与数字顺序相同
+NUM_WIDTH = 5
+
+
+def format_num(num):
+    #项次的格式是00001,00002...
+    return str(num).zfill(NUM_WIDTH)
+
+
+"""
+向流水号表(Sequence)一次取得count个连续号码，回传range
+1.锁定(单据类别, 期间)这一笔流水号，并发取号时会依序等待，不会取得重复号码
+2.第一次使用该期间时建立流水号，seed为取得目前已使用最大号码的函数，用于接续旧资料
+锁定会持续到呼叫端的交易结束，所以取号后应尽快完成单据存盘
+"""
+def allocate_numbers(name, period, count=1, seed=None):
+    with transaction.atomic():
+        sequence = Sequence.objects.select_for_update().filter(name=name, period=period).first()
+        if sequence is None:
+            try:
+                with transaction.atomic():
+                    sequence = Sequence.objects.create(name=name, period=period, last=seed() if seed else 0)
+            except IntegrityError:
+                sequence = Sequence.objects.select_for_update().get(name=name, period=period)
+
+        first = sequence.last + 1
+        Sequence.objects.filter(id=sequence.id).update(last=F('last') + count)
+    return range(first, first + count)
+
+
+"""
+单身项次在内存中依序编号，不需要每一笔单身都查询一次已有笔数
+已有单身的最大项次由formset已载入的单身取得
+"""
+class NumberedInlineFormSet(forms.models.BaseInlineFormSet):
+    def next_num(self):
+        if not hasattr(self, '_last_num'):
+            nums = [int(form.instance.num) for form in self.initial_forms if form.instance.num.isdigit()]
+            self._last_num = max(nums) if nums else 0
+        self._last_num += 1
+        return self._last_num
+
+    def save_new(self, form, commit=True):
+        if form.instance.num == '':
+            form.instance.num = format_num(self.next_num())
+        return super().save_new(form, commit=commit)
@@ -0,0 +1,273 @@
+import re
+from django.contrib.admin.utils import quote
+from django.db.models import Q
+from django.urls import reverse
+from finance.models import Pay, Receive
+from sale.models import Order
+from .bulk import insert_rows
+from .models import Customer, Material, Product, SearchGram, SearchWord, Supplier
+from .status import in_chunks
+
+GRAM_SIZE = 3
+
+#字词索引保留的长度，较长的字词以前缀建立索引
+WORD_SIZE = 32
+
+#全域搜寻每种资料最多回传的笔数
+SEARCH_LIMIT = 10
+
+#候选资料的上限，索引中符合的笔数超过此数时不使用索引
+SEARCH_CANDIDATES = 2000
+
+#每次搜寻最多查询的三字元组个数
+SEARCH_MAX_GRAMS = 5
+
+
+"""
+可搜寻的资料：
+fields为名称、单号等较短的栏位，以三字元组建立索引，可比对任意位置，第一个栏位必须有资料库索引(输入少于三个字元时以前缀比对)
+text_fields为描述等较长的栏位，以字词建立索引，比对字词的前缀
+"""
+class SearchSource:
+    def __init__(self, model, fields, text_fields=()):
+        self.model = model
+        self.fields = list(fields)
+        self.text_fields = list(text_fields)
+
+    @property
+    def all_fields(self):
+        return self.fields + self.text_fields
+
+    def permission(self):
+        opts = self.model._meta
+        return '{}.view_{}'.format(opts.app_label, opts.model_name)
+
+
+SEARCH_SOURCES = {
+    'material': SearchSource(Material, ['title'], ['description']),
+    'product': SearchSource(Product, ['title'], ['description']),
+    'supplier': SearchSource(Supplier, ['title'], ['description']),
+    'customer': SearchSource(Customer, ['title'], ['description']),
+    'order': SearchSource(Order, ['pi_no', 'po_no']),
+    'receive': SearchSource(Receive, ['invoice_no']),
+    'pay': SearchSource(Pay, ['invoice_no']),
+}
+
+MODEL_KINDS = dict((source.model, kind) for kind, source in SEARCH_SOURCES.items())
+
+
+def normalize(text):
+    return ' '.join(str(text or '').lower().split())
+
+
+def grams(text):
+    text = normalize(text)
+    return set(text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1))
+
+
+def words(text):
+    return set(word[:WORD_SIZE] for word in re.findall(r'\w+', normalize(text)))
+
+
+#(索引表, 索引值栏位, SearchSource中建立该索引的栏位, 切分方式)
+INDEXES = [
+    (SearchGram, 'gram', 'fields', grams),
+    (SearchWord, 'word', 'text_fields', words),
+]
+
+
+"""
+一笔资料在各索引中的值，values依SearchSource.all_fields的顺序
+"""
+def _entries(source, values):
+    values = dict(zip(source.all_fields, values))
+    entries = []
+    for model, column, fields, split in INDEXES:
+        result = set()
+        for field in getattr(source, fields):
+            result |= split(values[field])
+        entries.append(result)
+    return entries
+
+
+def _sync(model, column, kind, wanted, created):
+    existing = {}
+    removed = []
+    if not created:
+        for ids in in_chunks(sorted(wanted)):
+            for index_id, object_id, value in model.objects.filter(kind=kind, object_id__in=ids)\
+                    .values_list('id', 'object_id', column):
+                existing.setdefault(object_id, set()).add(value)
+                if value not in wanted[object_id]:
+                    removed.append(index_id)
+    added = [(pk, value) for pk in sorted(wanted) for value in sorted(wanted[pk] - existing.get(pk, set()))]
+    for ids in in_chunks(removed):
+        model.objects.filter(id__in=ids).delete()
+    insert_rows(model, ['kind', 'object_id', column], [(kind, pk, value) for pk, value in added])
+    return [pk for pk in sorted(wanted) if existing.get(pk, set()) != wanted[pk]]
+
+
+"""
+更新资料的索引，rows为{id: [SearchSource.all_fields各栏位的值]}
+与索引中现有的值比较，只删除不再需要的值、写入新增的值，回传索引有变动的笔数
+新增的资料(created)没有旧的索引，直接写入
+"""
+def index_rows(kind, rows, created=False):
+    source = SEARCH_SOURCES[kind]
+    entries = dict((pk, _entries(source, values)) for pk, values in rows.items())
+    changed = set()
+    for position, (model, column, fields, split) in enumerate(INDEXES):
+        if getattr(source, fields):
+            changed.update(_sync(model, column, kind, dict((pk, entry[position]) for pk, entry in entries.items()),
+                                 created))
+    return len(changed)
+
+
+"""
+依id由资料库读取后更新索引，bulk_create/update等不触发signal的写入后呼叫
+"""
+def index_objects(kind, ids, created=False):
+    source = SEARCH_SOURCES[kind]
+    count = 0
+    for chunk in in_chunks(ids):
+        rows = dict((row[0], row[1:]) for row
+                    in source.model.objects.filter(pk__in=chunk).values_list('pk', *source.all_fields))
+        count += index_rows(kind, rows, created)
+    return count
+
+
+"""
+存盘时更新该笔资料的索引，update_fields不包含索引栏位时不处理
+"""
+def index_instance(instance, created=False, update_fields=None):
+    kind = MODEL_KINDS[type(instance)]
+    fields = SEARCH_SOURCES[kind].all_fields
+    if update_fields is not None and not set(update_fields) & set(fields):
+        return
+    index_rows(kind, {instance.pk: [getattr(instance, field) for field in fields]}, created)
+
+
+def remove(kind, ids):
+    for chunk in in_chunks(ids):
+        for model, column, fields, split in INDEXES:
+            model.objects.filter(kind=kind, object_id__in=chunk).delete()
+
+
+"""
+重建一种资料的全部索引，依id分批读取，不比对旧的索引
+"""
+def rebuild(kind, chunk_size=1000):
+    source = SEARCH_SOURCES[kind]
+    for model, column, fields, split in INDEXES:
+        model.objects.filter(kind=kind).delete()
+    count = 0
+    last_id = 0
+    while True:
+        rows = list(source.model.objects.filter(pk__gt=last_id).order_by('pk')
+                    .values_list('pk', *source.all_fields)[:chunk_size])
+        if not rows:
+            break
+        index_rows(kind, dict((row[0], row[1:]) for row in rows), created=True)
+        count += len(rows)
+        last_id = rows[-1][0]
+    return count
+
+
+"""
+输入文字中用来查询索引的三字元组，依位置取不重叠的三字元组(再加上最后一个)，最多SEARCH_MAX_GRAMS个
+"""
+def _term_grams(term):
+    positions = list(range(0, len(term) - GRAM_SIZE + 1, GRAM_SIZE)) + [len(term) - GRAM_SIZE]
+    result = []
+    for i in positions:
+        if term[i:i + GRAM_SIZE] not in result:
+            result.append(term[i:i + GRAM_SIZE])
+    return result[:SEARCH_MAX_GRAMS]
+
+
+def _contains(fields, term):
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{field + '__icontains': term})
+    return condition
+
+
+def _count(index):
+    return index[:SEARCH_CANDIDATES + 1].count()
+
+
+"""
+搜寻条件，符合以下任一项的资料：
+1.fields包含输入的文字：三个字元以上时以笔数最少的三字元组取候选资料，少于三个字元时以第一个栏位的前缀比对
+2.text_fields包含输入的文字，且输入中最长的字词是某个字词的前缀，以该字词前缀的索引取候选资料
+3.输入数字时比对id
+候选资料的索引笔数(最多计算到SEARCH_CANDIDATES笔)为0时该项没有符合的资料；
+都不超过SEARCH_CANDIDATES笔时先读出候选资料的id，再以icontains排除不符的资料，不扫描资料表；
+超过时符合的资料很多，直接以icontains查询，分页读到足够的笔数即停止
+"""
+def search_filter(kind, term):
+    source = SEARCH_SOURCES[kind]
+    term = normalize(term)
+    if not term:
+        return Q()
+
+    condition = Q(pk=int(term)) if term.isdigit() else Q(pk__in=[])
+    indexes = []
+    if len(term) >= GRAM_SIZE:
+        count, gram = min((_count(SearchGram.objects.filter(kind=kind, gram=gram)), gram) for gram in _term_grams(term))
+        indexes.append((SearchGram.objects.filter(kind=kind, gram=gram), count, source.fields))
+    else:
+        condition |= Q(**{source.fields[0] + '__istartswith': term})
+    term_words = re.findall(r'\w+', term)
+    if source.text_fields and term_words:
+        word = max(term_words, key=len)[:WORD_SIZE]
+        #前缀比对改为范围条件，所有资料库都能使用索引
+        index = SearchWord.objects.filter(kind=kind, word__gte=word, word__lt=word[:-1] + chr(ord(word[-1]) + 1))
+        indexes.append((index, _count(index), source.text_fields))
+
+    indexes = [(index, count, _contains(fields, term)) for index, count, fields in indexes if count > 0]
+    if any(count > SEARCH_CANDIDATES for index, count, contains in indexes):
+        for index, count, contains in indexes:
+            condition |= contains
+    else:
+        for index, count, contains in indexes:
+            condition |= Q(pk__in=list(index.values_list('object_id', flat=True))) & contains
+    return condition
+
+
+"""
+全域搜寻单据与基本资料，只搜寻使用者有检视权限的资料，每种资料依id由新到旧最多回传limit笔
+回传[{'kind', 'kind_title', 'id', 'title', 'url'}]
+"""
+def search_documents(user, term, limit=SEARCH_LIMIT):
+    results = []
+    if not normalize(term):
+        return results
+    for kind, source in SEARCH_SOURCES.items():
+        if not user.has_perm(source.permission()):
+            continue
+        opts = source.model._meta
+        for obj in source.model.objects.filter(search_filter(kind, term)).only(*source.all_fields).order_by('-pk')[:limit]:
+            results.append({
+                'kind': kind,
+                'kind_title': str(opts.verbose_name),
+                'id': obj.pk,
+                'title': str(obj),
+                'url': reverse('admin:{}_{}_change'.format(opts.app_label, opts.model_name), args=[quote(obj.pk)]),
+            })
+    return results
+
+
+"""
+管理界面的搜寻改用索引，search_kind为SEARCH_SOURCES中的资料类别
+"""
+class SearchIndexMixin:
+    search_kind = None
+
+    def get_search_fields(self, request):
+        return SEARCH_SOURCES[self.search_kind].all_fields
+
+    def get_search_results(self, request, queryset, search_term):
+        if not normalize(search_term):
+            return queryset, False
+        return queryset.filter(search_filter(self.search_kind, search_term)), False
@@ -0,0 +1,82 @@
+import contextlib
+import threading
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+from . import costing, masterdata, search
+from .bom import invalidate_bom
+from .models import Bom, Currency, Material, Product
+
+_local = threading.local()
+
+
+def invalidate_master_data(sender, **kwargs):
+    masterdata.invalidate(sender)
+
+
+def material_changed(sender, instance, **kwargs):
+    invalidate_bom()
+    costing.mark_dirty(materials=[instance.pk])
+
+
+def bom_changed(sender, instance, **kwargs):
+    if getattr(_local, 'bulk_bom', False):
+        return
+    invalidate_bom()
+    costing.mark_dirty(products=[instance.product_id])
+
+
+"""
+整批取代BOM表时使用，期间本线程的BOM表异动不逐笔失效快取与记录重算，由呼叫端完成后一次处理
+只影响本线程，其他线程同时异动BOM表仍照常处理
+"""
+@contextlib.contextmanager
+def bulk_bom_changes():
+    _local.bulk_bom = True
+    try:
+        yield
+    finally:
+        _local.bulk_bom = False
+
+
+def product_created(sender, instance, created, **kwargs):
+    if created:
+        costing.mark_dirty(products=[instance.pk])
+
+
+def currency_changed(sender, instance, **kwargs):
+    costing.mark_dirty(currencies=[instance.pk])
+
+
+def search_saved(sender, instance, created, update_fields=None, **kwargs):
+    search.index_instance(instance, created, update_fields)
+
+
+def search_deleted(sender, instance, **kwargs):
+    search.remove(search.MODEL_KINDS[sender], [instance.pk])
+
+
+def warm_master_data(sender, **kwargs):
+    request_started.disconnect(dispatch_uid='basic.warm_master_data')
+    masterdata.warm()
+
+
+"""
+1.基本资料异动时失效快取
+2.原料、BOM表、币别异动与新增商品时，交易提交后重算受影响商品的标准成本
+3.原料与BOM表异动时递增BOM版本号，BOM表展开结果的快取失效
+4.可搜寻的资料存盘与删除时更新搜寻索引
+5.启动后第一个请求开始时预先读入基本资料(避免在应用程序初始化时存取资料库)
+"""
+def connect():
+    for model in masterdata.MASTER_MODELS:
+        post_save.connect(invalidate_master_data, sender=model, dispatch_uid='basic.masterdata.save')
+        post_delete.connect(invalidate_master_data, sender=model, dispatch_uid='basic.masterdata.delete')
+    post_save.connect(material_changed, sender=Material, dispatch_uid='basic.costing.material')
+    post_save.connect(bom_changed, sender=Bom, dispatch_uid='basic.costing.bom_save')
+    post_delete.connect(bom_changed, sender=Bom, dispatch_uid='basic.costing.bom_delete')
+    post_save.connect(product_created, sender=Product, dispatch_uid='basic.costing.product')
+    post_save.connect(currency_changed, sender=Currency, dispatch_uid='basic.costing.currency')
+    for model in search.MODEL_KINDS:
+        post_save.connect(search_saved, sender=model, dispatch_uid='basic.search.save')
+        post_delete.connect(search_deleted, sender=model, dispatch_uid='basic.search.delete')
+    request_started.connect(warm_master_data, dispatch_uid='basic.warm_master_data')
@@ -0,0 +1,88 @@
+from django.db.models import Case, F, Value, When
+
+STATUS_CHUNK_SIZE = 500
+
+#CASE WHEN每笔两个参数，加上IN条件每批约900个参数，不超过SQLite(旧版上限999)与MySQL的限制
+CASE_CHUNK_SIZE = 300
+
+
+def in_chunks(ids, size=STATUS_CHUNK_SIZE):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+"""
+依单身的(应完成数量或金额, 已完成数量或金额)决定单头状态：
+('N', 尚未), ('A', 全部), ('P', 部分), ('O', 超额)
+1.全部单身都还没有完成任何数量时为N
+2.over_first为False时(出货、到货、收款)：有一笔部分完成就是P，其次有一笔超额就是O
+3.over_first为True时(付款)：有一笔超额就是O，其次有一笔部分完成就是P
+4.其他情况为A
+"""
+def decide_status(lines, over_first=False):
+    started = False
+    partial = False
+    over = False
+    for required, fulfilled in lines:
+        if fulfilled:
+            started = True
+        if fulfilled < required:
+            partial = True
+        elif fulfilled > required:
+            over = True
+
+    if not started:
+        return 'N'
+    if over_first:
+        return 'O' if over else 'P' if partial else 'A'
+    return 'P' if partial else 'O' if over else 'A'
+
+
+"""
+批量重算单头状态：
+lines为(单头id, 应完成数量或金额, 已完成数量或金额)的查询结果，已完成数量直接读取单身维护的栏位
+同状态的单头以一个UPDATE语句修改，回传{单头id: 状态}
+"""
+def apply_statuses(header_model, header_ids, lines, over_first=False):
+    grouped = dict((header_id, []) for header_id in header_ids)
+    for header_id, required, fulfilled in lines:
+        grouped[header_id].append((required, fulfilled or 0))
+
+    statuses = {}
+    by_status = {}
+    for header_id, header_lines in grouped.items():
+        status = decide_status(header_lines, over_first)
+        statuses[header_id] = status
+        by_status.setdefault(status, []).append(header_id)
+
+    for status, ids in by_status.items():
+        header_model.objects.filter(id__in=ids).update(status=status)
+    return statuses
+
+
+"""
+过账时以UPDATE语句累加单身的已完成数量或金额：field = field + deltas[原料或商品id]
+queryset为同一张单据的单身，deltas为{原料或商品id: 增减量}，每CASE_CHUNK_SIZE笔一个UPDATE语句
+"""
+def add_to_lines(queryset, item_key, field, deltas, output_field):
+    deltas = dict((item_id, delta) for item_id, delta in deltas.items() if delta)
+    count = 0
+    for item_ids in in_chunks(sorted(deltas), CASE_CHUNK_SIZE):
+        whens = [When(**{item_key: item_id, 'then': Value(deltas[item_id])}) for item_id in item_ids]
+        count += queryset.filter(**{item_key + '__in': item_ids}).update(
+            **{field: F(field) + Case(*whens, default=Value(0), output_field=output_field)})
+    return count
+
+
+"""
+重建时以UPDATE语句设定多笔单身的栏位：field = values[单身id]，key可指定其他唯一栏位
+每CASE_CHUNK_SIZE笔一个UPDATE语句
+"""
+def set_lines(model, field, values, output_field, key='id'):
+    count = 0
+    for line_ids in in_chunks(sorted(values), CASE_CHUNK_SIZE):
+        whens = [When(**{key: line_id, 'then': Value(values[line_id])}) for line_id in line_ids]
+        count += model.objects.filter(**{key + '__in': line_ids}).update(
+            **{field: Case(*whens, output_field=output_field)})
+    return count
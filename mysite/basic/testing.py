@@ -0,0 +1,43 @@
+import re
+from django.db import connection
+
+
+"""
+检查查询计划是否走索引，依数据库类别判断：
+sqlite: EXPLAIN QUERY PLAN 中该表必须是 SEARCH ... USING INDEX，不能是 SCAN
+mysql: EXPLAIN 中该表的type不能是ALL(全表扫描)
+postgresql: 关闭seqscan后计划中不能出现 Seq Scan on 该表
+"""
+class QueryPlanMixin:
+    def assertUsesIndex(self, queryset):
+        table = queryset.model._meta.db_table
+        sql, params = queryset.query.sql_with_params()
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            lines = [line for line in plan if re.search(r'\b{}\b'.format(table), line)]
+            self.assertTrue(lines, u'查询计划中找不到{}：{}'.format(table, plan))
+            for line in lines:
+                self.assertTrue(line.startswith('SEARCH') and 'INDEX' in line,
+                                u'{}未使用索引：{}'.format(table, plan))
+
+        elif connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN ' + sql, params)
+                columns = [c[0] for c in cursor.description]
+                plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            for row in plan:
+                if row.get('table') == table:
+                    self.assertNotEqual(row.get('type'), 'ALL', u'{}全表扫描：{}'.format(table, plan))
+
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+                try:
+                    cursor.execute('EXPLAIN ' + sql, params)
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+                finally:
+                    cursor.execute('SET enable_seqscan = on')
+            self.assertNotIn('Seq Scan on {}'.format(table), plan)
@@ -1,3 +1,752 @@
-from django.test import TestCase
+import datetime
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.forms import inlineformset_factory
+from django.db.models import QuerySet, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from finance.models import DueDetail, ReceivableDetail
+from inventory.models import Mtran, Process, Ptran
+from inventory.stock import take_material_snapshots, take_product_snapshots
+from purchase.models import ProcurementMaterial
+from sale.models import Order, OrderProduct
+from . import costing, masterdata, metrics, search
+from .numbering import NumberedInlineFormSet, allocate_numbers
+from .status import apply_statuses, decide_status
+from .autocomplete import AUTOCOMPLETE_PAGE_SIZE
+from .bom import BomCycle, BomGraph
+from .datagen import generate
+from .export import iter_rows
+from .importer import import_file
+from .models import Bom, Category, Currency, Customer, Material, Part, Period, Product, ProductCost, SearchGram, SearchWord, Sequence, Size, Supplier
+from .testing import QueryPlanMixin
+from .whereused import where_used
 
-# Create your tests here.
+
+class BasicQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_bom_by_product_and_material(self):
+        self.assertUsesIndex(Bom.objects.filter(product_id=1, material_id=1))
+
+    def test_bom_by_material(self):
+        self.assertUsesIndex(Bom.objects.filter(material_id=1).values('product_id'))
+
+
+class StatusRuleTests(TestCase):
+    def test_decide_status(self):
+        cases = [
+            ([(10, 0), (5, 0)], 'N', 'N'),
+            ([], 'N', 'N'),
+            ([(10, 4), (5, 0)], 'P', 'P'),
+            ([(10, 10), (5, 5)], 'A', 'A'),
+            ([(10, 12), (5, 5)], 'O', 'O'),
+            #部分与超额同时存在时，出货/到货/收款以部分优先，付款以超额优先
+            ([(10, 12), (5, 1)], 'P', 'O'),
+            ([(0, 0), (5, 5)], 'A', 'A'),
+        ]
+        for lines, status, over_first_status in cases:
+            self.assertEqual((decide_status(lines), decide_status(lines, over_first=True)),
+                             (status, over_first_status), lines)
+
+    def test_apply_statuses_updates_by_status(self):
+        user = User.objects.create_user('user')
+        customer = Customer.objects.create(title='C', period=Period.objects.create(title='P', period=30), status='A')
+        orders = [Order.objects.create(cat_id='1', pi_no='R{}'.format(i), customer=customer, etd='2019-01-31',
+                                       create_user=user) for i in range(4)]
+        lines = [(orders[0].id, 10, 10), (orders[1].id, 10, 5), (orders[2].id, 10, 10), (orders[2].id, 5, None)]
+        with self.assertNumQueries(3):
+            statuses = apply_statuses(Order, [order.id for order in orders], lines)
+        #没有单身的单头为N
+        self.assertEqual(statuses, {orders[0].id: 'A', orders[1].id: 'P', orders[2].id: 'P', orders[3].id: 'N'})
+        self.assertEqual(dict(Order.objects.values_list('id', 'status')), statuses)
+
+
+class ExportTests(TestCase):
+    def test_iter_rows_keyset_pages(self):
+        for i, status in enumerate('AWAAWAA'):
+            Size.objects.create(title='Z{}'.format(i), status=status)
+        expected = list(Size.objects.order_by('status', 'id').values_list('status', 'id', 'title'))
+        #每页2笔，7笔资料4页，再加一个确认没有下一页的查询；status相同时依id接续，不重复也不遗漏
+        with self.assertNumQueries(5):
+            rows = list(iter_rows(Size.objects.all(), ['status', 'id', 'title'], keys=('status', 'id'), chunk_size=2))
+        self.assertEqual(rows, expected)
+        self.assertEqual(list(iter_rows(Size.objects.filter(status='X'), ['id'])), [])
+
+
+class NumberingTests(TestCase):
+    def test_allocate_numbers(self):
+        self.assertEqual(list(allocate_numbers('ORDER', '201901', seed=lambda: 7)), [8])
+        self.assertEqual(list(allocate_numbers('ORDER', '201901', count=3, seed=lambda: 100)), [9, 10, 11])
+        self.assertEqual(list(allocate_numbers('ORDER', '201902')), [1])
+        self.assertEqual(Sequence.objects.get(name='ORDER', period='201901').last, 11)
+
+    def test_allocate_numbers_after_concurrent_create(self):
+        #查询时流水号还不存在，建立前其他交易已建立同一期间的流水号，违反唯一限制后改为锁定该笔流水号
+        Sequence.objects.create(name='ORDER', period='201901', last=20)
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            self.assertEqual(list(allocate_numbers('ORDER', '201901', count=2, seed=lambda: 5)), [21, 22])
+        self.assertEqual(Sequence.objects.get().last, 22)
+
+    def test_inline_formset_continues_numbers(self):
+        rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        supplier = Supplier.objects.create(title='S', period=Period.objects.create(title='P', period=30), status='A')
+        defaults = {'image_sub': '-', 'price': 1, 'tax': 0, 'tax_price': 1, 'currency': rmb, 'status': 'A'}
+        material = Material.objects.create(title='M', supplier=supplier,
+                                           category=Category.objects.create(title='C', status='A'), **defaults)
+        product = Product.objects.create(title='P', size=Size.objects.create(title='Z', status='A'), **defaults)
+        #旧资料的两位项次与新项次混用
+        Bom.objects.create(product=product, material=material, num='01')
+        Bom.objects.create(product=product, material=material, num='00009')
+
+        formset_class = inlineformset_factory(Product, Bom, formset=NumberedInlineFormSet,
+                                              fk_name='product', fields=['material', 'quantity'], extra=0)
+        data = {'bom_set-TOTAL_FORMS': 4, 'bom_set-INITIAL_FORMS': 2}
+        for i, bom in enumerate(Bom.objects.order_by('id')):
+            data.update({'bom_set-{}-id'.format(i): bom.id, 'bom_set-{}-material'.format(i): material.id,
+                         'bom_set-{}-quantity'.format(i): 1})
+        for i in (2, 3):
+            data.update({'bom_set-{}-material'.format(i): material.id, 'bom_set-{}-quantity'.format(i): i})
+        formset = formset_class(data, instance=product)
+        self.assertTrue(formset.is_valid(), formset.errors)
+        with self.assertNumQueries(2):
+            formset.save()
+        self.assertEqual(list(Bom.objects.order_by('num').values_list('num', 'quantity')),
+                         [('00009', 1), ('00010', 2), ('00011', 3), ('01', 1)])
+
+        call_command('pad_line_numbers', stdout=StringIO())
+        self.assertEqual(list(Bom.objects.order_by('num').values_list('num', flat=True)),
+                         ['00001', '00009', '00010', '00011'])
+
+
+class QueryMetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_count_and_duplicates(self):
+        Currency.objects.create(id='RMB', title='rmb', rate=1)
+        with metrics.QueryMetrics() as m:
+            for i in range(3):
+                list(Currency.objects.filter(id='ID{}'.format(i)))
+            Currency.objects.count()
+        self.assertEqual(m.count, 4)
+        self.assertEqual(len(m.duplicates()), 1)
+        self.assertEqual(m.duplicates()[0][1], 3)
+        self.assertGreater(m.wall_time, 0)
+
+    def test_fingerprint(self):
+        self.assertEqual(metrics.fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND title = 'a'"),
+                         metrics.fingerprint("SELECT * FROM t WHERE id IN (4) AND title = 'b'"))
+
+    @override_settings(QUERY_BUDGETS={'test': 1}, QUERY_BUDGET_STRICT=True)
+    def test_measure_budget(self):
+        with self.assertRaises(metrics.QueryBudgetExceeded):
+            with metrics.measure('test'):
+                Currency.objects.count()
+                Currency.objects.count()
+        self.assertEqual(metrics.snapshot()['test']['over_budget'], 1)
+
+    @override_settings(QUERY_BUDGETS={'test': 1}, QUERY_BUDGET_STRICT=False)
+    def test_measure_budget_logs(self):
+        with self.assertLogs('basic.metrics', level='WARNING'):
+            with metrics.measure('test'):
+                Currency.objects.count()
+                Currency.objects.count()
+
+    def test_middleware_headers_and_summary(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get('/basic/metrics/')
+        self.assertIn('X-DB-Queries', response)
+        self.assertIn('X-DB-Time', response)
+        self.assertIn('X-Wall-Time', response)
+        self.assertEqual(response.json()['code'], 0)
+
+        response = self.client.get('/basic/metrics/')
+        stat = response.json()['views']['basic:metrics_summary']
+        self.assertEqual(stat['calls'], 1)
+        self.assertEqual(stat['max_queries'], int(response['X-DB-Queries']))
+
+    def test_middleware_headers_only_for_staff_or_debug(self):
+        self.client.force_login(User.objects.create_user('user'))
+        response = self.client.get('/basic/metrics/')
+        self.assertNotIn('X-DB-Queries', response)
+        self.assertNotIn('X-Wall-Time', response)
+        with override_settings(DEBUG=True):
+            self.assertIn('X-DB-Queries', self.client.get('/basic/metrics/'))
+
+    def test_unresolved_paths_share_one_bucket(self):
+        for path in ['/no-such-page/', '/no-such-page/2/', '/basic/unknown/']:
+            self.assertEqual(self.client.get(path).status_code, 404)
+        views = metrics.snapshot()
+        self.assertEqual(views[metrics.UNRESOLVED]['calls'], 3)
+        self.assertFalse([name for name in views if name.startswith('/')])
+
+
+class MasterDataTests(TestCase):
+    def setUp(self):
+        Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        Period.objects.create(title=u'月结30天', period=30)
+        Category.objects.create(title='C-A', status='A')
+        Category.objects.create(title='C-W', status='W')
+        #模拟资料已提交
+        masterdata.clear()
+
+    def tearDown(self):
+        masterdata.clear()
+
+    def test_reads_from_process_memory(self):
+        masterdata.warm()
+        with self.assertNumQueries(0):
+            self.assertEqual(masterdata.get(Currency, 'RMB').rate, 1)
+            self.assertEqual([p.period for p in masterdata.rows(Period)], [30])
+
+    def test_save_in_transaction_is_visible(self):
+        masterdata.warm()
+        Currency(id='RMB', title=u'人民币', rate=7).save()
+        self.assertEqual(masterdata.get(Currency, 'RMB').rate, 7)
+
+    def test_rollback_is_not_cached(self):
+        masterdata.warm()
+        try:
+            with transaction.atomic():
+                Currency(id='RMB', title=u'人民币', rate=9).save()
+                self.assertEqual(masterdata.get(Currency, 'RMB').rate, 9)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(masterdata.get(Currency, 'RMB').rate, 1)
+
+    @override_settings(MASTER_DATA_CHECK_INTERVAL=0)
+    def test_shared_version_reloads(self):
+        masterdata.warm()
+        Currency.objects.filter(id='RMB').update(rate=6)
+        self.assertEqual(masterdata.get(Currency, 'RMB').rate, 1)
+        #其他进程提交后递增版本号
+        masterdata._committed(Currency)
+        self.assertEqual(masterdata.get(Currency, 'RMB').rate, 6)
+
+    def test_choice_field_limit_choices_to(self):
+        field = Material._meta.get_field('category').formfield(form_class=masterdata.MasterDataChoiceField)
+        field.limit_choices_to = {'status': 'A'}
+        masterdata.warm()
+        with self.assertNumQueries(0):
+            titles = [label for value, label in field.choices]
+        self.assertEqual(titles, [field.empty_label, 'C-A'])
+
+
+class MasterDataTransactionTests(TransactionTestCase):
+    def setUp(self):
+        Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        masterdata.clear()
+
+    def tearDown(self):
+        masterdata.clear()
+
+    def rate(self):
+        return masterdata.get(Currency, 'RMB').rate
+
+    def test_rollback_does_not_leak_into_next_transaction(self):
+        masterdata.warm()
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Currency(id='RMB', title=u'人民币', rate=9).save()
+                self.assertEqual(self.rate(), 9)
+                raise IntegrityError
+        #下一个交易不可读到已回滚交易的专属副本
+        with transaction.atomic():
+            self.assertEqual(self.rate(), 1)
+        self.assertEqual(self.rate(), 1)
+
+    def test_savepoint_rollback_keeps_outer_change(self):
+        with transaction.atomic():
+            Currency(id='RMB', title=u'人民币', rate=7).save()
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    Currency(id='RMB', title=u'人民币', rate=8).save()
+                    self.assertEqual(self.rate(), 8)
+                    raise IntegrityError
+            self.assertEqual(self.rate(), 7)
+        self.assertEqual(self.rate(), 7)
+        self.assertEqual(Currency.objects.get(id='RMB').rate, 7)
+
+
+class CostingTests(TestCase):
+    def setUp(self):
+        masterdata.clear()
+        rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        usd = Currency.objects.create(id='USD', title=u'美元', rate=7)
+        period = Period.objects.create(title=u'月结30天', period=30)
+        supplier = Supplier.objects.create(title='S', period=period, status='A')
+        category = Category.objects.create(title='C', status='A')
+        size = Size.objects.create(title='Z', status='A')
+        defaults = {'image_sub': '-', 'price': 1, 'tax': 0}
+        self.m1 = Material.objects.create(title='M1', supplier=supplier, category=category, tax_price=2,
+                                          currency=rmb, **defaults)
+        self.m2 = Material.objects.create(title='M2', supplier=supplier, category=category, tax_price=1,
+                                          currency=usd, **defaults)
+        self.p1 = Product.objects.create(title='P1', size=size, tax_price=30, currency=rmb, **defaults)
+        self.p2 = Product.objects.create(title='P2', size=size, tax_price=10, currency=rmb, **defaults)
+        Bom.objects.create(product=self.p1, material=self.m1, quantity=3)
+        Bom.objects.create(product=self.p1, material=self.m2, quantity=1)
+        self.p2_bom = Bom.objects.create(product=self.p2, material=self.m1, quantity=1)
+        costing.flush()
+
+    def tearDown(self):
+        masterdata.clear()
+
+    def cost(self, product):
+        return ProductCost.objects.get(product=product).material_cost
+
+    def test_rollup(self):
+        self.assertEqual(self.cost(self.p1), 13)
+        self.assertEqual(self.cost(self.p2), 2)
+        ProductCost.objects.all().delete()
+        self.assertEqual(costing.rollup(), 2)
+        self.assertEqual(self.cost(self.p1), 13)
+        with self.assertNumQueries(6):
+            costing.rollup()
+
+    def test_material_change_recomputes_where_used_only(self):
+        Bom.objects.filter(id=self.p2_bom.id).update(quantity=5)
+        self.m2.tax_price = 2
+        self.m2.save()
+        self.assertEqual(costing.flush(), 1)
+        self.assertEqual(self.cost(self.p1), 20)
+        self.assertEqual(self.cost(self.p2), 2)
+
+    def test_currency_rate_change(self):
+        Currency(id='USD', title=u'美元', rate=8).save()
+        costing.flush()
+        self.assertEqual(self.cost(self.p1), 14)
+        self.assertEqual(self.cost(self.p2), 2)
+
+    def test_nested_component(self):
+        Bom.objects.create(product=self.p1, component=self.p2, quantity=2)
+        costing.flush()
+        self.assertEqual(self.cost(self.p1), 17)
+        #半成品的原料异动时，使用该半成品的商品也要重算
+        self.m1.tax_price = 3
+        self.m1.save()
+        costing.flush()
+        self.assertEqual(self.cost(self.p2), 3)
+        self.assertEqual(self.cost(self.p1), 22)
+
+    def test_bom_delete(self):
+        self.p2_bom.delete()
+        costing.flush()
+        self.assertEqual(self.cost(self.p2), 0)
+
+
+class WhereUsedTests(TestCase):
+    def test_where_used_matches_explosion(self):
+        user = User.objects.create_superuser('user', 'user@example.com', 'user')
+        generate(user, scale=0.2, seed=1)
+        #经由半成品间接使用的原料
+        component_id = Bom.objects.filter(component__isnull=False).order_by('id')\
+            .values_list('component_id', flat=True).first()
+        material_id = Bom.objects.filter(product_id=component_id, material__isnull=False).order_by('id')\
+            .values_list('material_id', flat=True).first()
+        graph = BomGraph.load()
+        product_ids = set(product_id for product_id in Product.objects.values_list('id', flat=True)
+                          if material_id in graph.unit_materials(product_id))
+        self.assertGreater(len(product_ids), 1)
+        order_ids = set(OrderProduct.objects.filter(product_id__in=product_ids, order__is_active=True,
+                                                    order__status__in=['N', 'P']).values_list('order_id', flat=True))
+        process_ids = set(Process.objects.filter(product_id__in=product_ids, status__in=['A', 'C'])
+                          .values_list('id', flat=True))
+
+        #原料1个查询 + 每阶1个查询 + 商品1个查询 + 订单2个查询 + 制程单2个查询
+        with self.assertNumQueries(8):
+            used = where_used(user, material_id)
+        self.assertEqual(used['products']['count'], len(product_ids))
+        self.assertEqual(dict((item['id'], item['quantity']) for item in used['products']['items']),
+                         dict((product_id, graph.unit_materials(product_id)[material_id])
+                              for product_id in product_ids))
+        self.assertEqual(used['orders']['count'], len(order_ids))
+        self.assertEqual(used['processes']['count'], len(process_ids))
+        self.assertEqual(set(item['id'] for item in where_used(user, material_id, limit=1)['processes']['items']),
+                         set(sorted(process_ids)[:1]))
+
+        self.client.force_login(user)
+        response = self.client.get('/basic/material/ajax/where_used/', {'id': material_id})
+        self.assertEqual(response.json()['products']['count'], len(product_ids))
+        response = self.client.get('/admin/basic/material/{}/change/'.format(material_id))
+        self.assertContains(response, u'使用此原料的商品（{}）'.format(len(product_ids)))
+
+        #订单与制程单只列给有检视权限的使用者
+        staff = User.objects.create_user('staff', is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename='view_material'))
+        self.client.force_login(staff)
+        response = self.client.get('/basic/material/ajax/where_used/', {'id': material_id}).json()
+        self.assertEqual((response['code'], 'orders' in response, 'processes' in response), (0, False, False))
+        response = self.client.get('/admin/basic/material/{}/change/'.format(material_id))
+        self.assertContains(response, u'使用此原料的商品（{}）'.format(len(product_ids)))
+        self.assertNotContains(response, u'尚未全部出货的订单')
+        self.assertNotContains(response, u'尚未入库的制程单')
+
+        staff.user_permissions.add(Permission.objects.get(codename='view_order'))
+        staff = User.objects.get(id=staff.id)
+        self.assertEqual(set(where_used(staff, material_id)), {'products', 'orders'})
+
+
+class BomGraphTests(TestCase):
+    def test_explode_nested(self):
+        #商品1 = 原料10 x 2 + 半成品2 x 3，半成品2 = 原料10 x 1 + 原料11 x 4
+        graph = BomGraph([(1, 10, None, 2), (1, None, 2, 3), (2, 10, None, 1), (2, 11, None, 4)])
+        self.assertEqual(graph.unit_materials(1), {10: 5, 11: 12})
+        self.assertEqual(graph.explode({1: 2, 2: 1}), {10: 11, 11: 28})
+        self.assertIs(graph.unit_materials(2), graph.unit_materials(2))
+
+    def test_cycle(self):
+        graph = BomGraph([(1, None, 2, 1), (2, None, 3, 1), (3, 10, None, 1)])
+        self.assertEqual(graph.unit_materials(1), {10: 1})
+        with self.assertRaises(BomCycle) as cm:
+            graph.replace(3, [(None, 1, 1)])
+        self.assertEqual(cm.exception.path, (3, 1, 2, 3))
+        self.assertEqual(graph.replace(3, [(11, None, 2)]).unit_materials(1), {11: 2})
+
+    def test_load_is_one_query(self):
+        with self.assertNumQueries(1):
+            BomGraph.load()
+
+
+class DataGeneratorTests(TestCase):
+    def test_generate_is_consistent(self):
+        user = User.objects.create_user('user')
+        counts = generate(user, scale=0.2, seed=1)
+        self.assertEqual(Material.objects.count(), counts['materials'])
+        self.assertEqual(Product.objects.count(), counts['products'])
+        self.assertEqual(Material.objects.aggregate(total=Sum('stock'))['total'],
+                         Mtran.objects.aggregate(total=Sum('tran_quantity'))['total'])
+        self.assertEqual(Product.objects.aggregate(total=Sum('stock'))['total'],
+                         Ptran.objects.aggregate(total=Sum('tran_quantity'))['total'])
+
+    def test_fulfillment_columns_match_rebuild(self):
+        user = User.objects.create_user('user')
+        generate(user, scale=0.2, seed=1)
+        columns = [
+            (OrderProduct, ('shipped_quantity', 'tax_receive')),
+            (ProcurementMaterial, ('arrived_quantity', 'tax_pay')),
+            (ReceivableDetail, ('received_amount',)),
+            (DueDetail, ('paid_amount',)),
+        ]
+        posted = [list(model.objects.order_by('id').values_list('id', *fields)) for model, fields in columns]
+        self.assertTrue(any(row[1] for row in posted[0]))
+        call_command('rebuild_fulfillment', stdout=StringIO())
+        rebuilt = [list(model.objects.order_by('id').values_list('id', *fields)) for model, fields in columns]
+        self.assertEqual(posted, rebuilt)
+
+
+class ChangelistQueryTests(TestCase):
+    def changelist_queries(self):
+        queries = {}
+        for model, model_admin in admin.site._registry.items():
+            url = reverse('admin:{}_{}_changelist'.format(model._meta.app_label, model._meta.model_name))
+            cache.clear()
+            self.client.get(url, {'all': ''})
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url, {'all': ''})
+            self.assertEqual(response.status_code, 200, url)
+            queries[url] = (len(captured), len(response.context['cl'].result_list))
+        return queries
+
+    def generate(self, user, **kwargs):
+        generate(user, **kwargs)
+        part = Part.objects.create(title='{}-P'.format(kwargs['prefix']), status='A')
+        Product.objects.filter(title__startswith=kwargs['prefix']).update(part=part)
+        take_material_snapshots(datetime.date.today())
+        take_product_snapshots(datetime.date.today())
+        return self.changelist_queries()
+
+    def test_queries_do_not_grow_with_rows(self):
+        user = User.objects.create_superuser('user', 'user@example.com', 'user')
+        self.client.force_login(user)
+        small = self.generate(user, scale=0.1, seed=1, prefix='A')
+        large = self.generate(user, scale=0.25, seed=2, prefix='B')
+        for url, (count, rows) in small.items():
+            self.assertEqual(large[url][0], count, u'{}：{}笔 {}个查询，{}笔 {}个查询'.format(
+                url, rows, count, large[url][1], large[url][0]))
+        self.assertTrue(any(large[url][1] > rows for url, (count, rows) in small.items()))
+
+        #计算栏位与单身逐笔计算的结果一致
+        for order in self.client.get('/admin/sale/order/', {'all': ''}).context['cl'].result_list:
+            lines = OrderProduct.objects.filter(order=order)
+            self.assertEqual(order.open_quantity, sum(max(line.quantity - line.shipped_quantity, 0) for line in lines))
+            self.assertEqual(order.total, sum(line.tax_subtotal for line in lines))
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('user', 'user@example.com', 'user')
+        generate(cls.user, scale=2, seed=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def search(self, source, **params):
+        return self.client.get(reverse('basic:autocomplete', args=[source]), params).json()
+
+    def test_pages_open_orders(self):
+        open_ids = set(str(pk) for pk in Order.objects.filter(is_active=True).exclude(status='A')
+                       .values_list('id', flat=True))
+        self.assertGreater(len(open_ids), AUTOCOMPLETE_PAGE_SIZE)
+        first = self.search('open_order', term='GEN')
+        second = self.search('open_order', term='GEN', page=2)
+        self.assertTrue(first['pagination']['more'])
+        self.assertEqual(len(first['results']), AUTOCOMPLETE_PAGE_SIZE)
+        self.assertEqual(set(row['id'] for row in first['results'] + second['results']), open_ids)
+
+        order = Order.objects.filter(status='A').first()
+        self.assertEqual(self.search('open_order', term=order.pi_no)['results'], [])
+        self.assertEqual([row['id'] for row in self.search('order', term=order.pi_no)['results']], [str(order.id)])
+
+    def test_cached_per_user(self):
+        self.search('product', term='GEN-P00000')
+        with CaptureQueriesContext(connection) as captured:
+            self.search('product', term='GEN-P00000')
+        self.assertFalse([q for q in captured if 'basic_product' in q['sql']])
+
+        other = User.objects.create_user('other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('basic:autocomplete', args=['product'])).status_code, 403)
+        other.user_permissions.add(Permission.objects.get(codename='view_product'))
+        with CaptureQueriesContext(connection) as captured:
+            self.search('product', term='GEN-P00000')
+        self.assertTrue([q for q in captured if 'basic_product' in q['sql']])
+        self.assertEqual(self.client.get(reverse('basic:autocomplete', args=['unknown'])).status_code, 404)
+
+    def test_admin_renders_selected_only(self):
+        response = self.client.get(reverse('admin:sale_ship_add'))
+        self.assertContains(response, reverse('basic:autocomplete', args=['open_order']))
+        self.assertLessEqual(response.content.decode().count('<option'), 10)
+
+        order = Process.objects.first().order
+        response = self.client.get(reverse('admin:inventory_process_changelist'), {'order__id__exact': order.id})
+        self.assertContains(response, reverse('basic:autocomplete', args=['order']))
+        self.assertContains(response, '<option value="{}" selected>'.format(order.id))
+        self.assertEqual(set(response.context['cl'].result_list.values_list('order_id', flat=True)), {order.id})
+
+
+class SearchTests(QueryPlanMixin, TestCase):
+    def setUp(self):
+        rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        period = Period.objects.create(title=u'月结30天', period=30)
+        self.supplier = Supplier.objects.create(title='S', period=period, status='A')
+        self.category = Category.objects.create(title='C', status='A')
+        self.material = Material.objects.create(title='AB-BOLT-M6', description=u'不锈钢 Hex bolt', image_sub='-',
+                                                supplier=self.supplier, category=self.category, price=1, tax=0,
+                                                tax_price=1, currency=rmb)
+
+    def find(self, kind, term):
+        return list(search.SEARCH_SOURCES[kind].model.objects.filter(search.search_filter(kind, term))
+                    .order_by('pk').values_list('pk', flat=True))
+
+    def test_substring_and_incremental_update(self):
+        self.assertEqual(self.find('material', 'bolt'), [self.material.pk])
+        self.assertEqual(self.find('material', u'不锈钢'), [self.material.pk])
+        self.assertEqual(self.find('material', 'ab'), [self.material.pk])
+        self.assertEqual(self.find('material', 'tlob'), [])
+        self.assertEqual(self.find('material', str(self.material.pk)), [self.material.pk])
+
+        self.material.title = 'AB-NUT-M6'
+        self.material.save()
+        self.assertEqual(self.find('material', 'bolt-m6'), [])
+        self.assertEqual(self.find('material', 'nut-m'), [self.material.pk])
+        #只更新未建立索引的栏位时不查询索引
+        with self.assertNumQueries(1):
+            self.material.save(update_fields=['stock'])
+
+        self.material.delete()
+        self.assertFalse(SearchGram.objects.filter(kind='material').exists())
+        self.assertFalse(SearchWord.objects.filter(kind='material').exists())
+
+    def test_gram_lookup_uses_index(self):
+        self.assertUsesIndex(SearchGram.objects.filter(kind='material', gram='bol').values('object_id'))
+
+    def test_rebuild_matches_incremental(self):
+        generate(User.objects.create_user('user'), scale=0.2, seed=1)
+        indexed = [sorted(SearchGram.objects.values_list('kind', 'object_id', 'gram')),
+                   sorted(SearchWord.objects.values_list('kind', 'object_id', 'word'))]
+        self.assertTrue(set(kind for kind, object_id, gram in indexed[0]) >= set(search.SEARCH_SOURCES) - {'pay'})
+        call_command('rebuild_search', stdout=StringIO())
+        self.assertEqual([sorted(SearchGram.objects.values_list('kind', 'object_id', 'gram')),
+                          sorted(SearchWord.objects.values_list('kind', 'object_id', 'word'))], indexed)
+
+    def test_find_document_and_admin_search(self):
+        user = User.objects.create_superuser('user', 'user@example.com', 'user')
+        generate(user, scale=0.2, seed=1)
+        order = Order.objects.order_by('id').first()
+        self.client.force_login(user)
+        response = self.client.get(reverse('basic:find_document'), {'q': order.pi_no}).json()
+        self.assertIn({'kind': 'order', 'kind_title': str(Order._meta.verbose_name), 'id': order.id,
+                       'title': str(order), 'url': reverse('admin:sale_order_change', args=[order.id])},
+                      response['results'])
+
+        response = self.client.get(reverse('admin:basic_material_changelist'), {'q': 'bolt'})
+        self.assertEqual([m.pk for m in response.context['cl'].result_list], [self.material.pk])
+
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.client.get(reverse('basic:find_document'), {'q': order.pi_no}).json()['results'], [])
+
+
+class ImportTests(TestCase):
+    MATERIAL_HEADER = 'title,image_sub,supplier,category,price,tax,tax_price,currency,description\n'
+
+    def setUp(self):
+        rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        period = Period.objects.create(title=u'月结30天', period=30)
+        self.supplier = Supplier.objects.create(title='S', period=period, status='A')
+        Category.objects.create(title='C-A', status='A')
+        Category.objects.create(title='C-W', status='W')
+        self.material = Material.objects.create(title='M-OLD', description='old', image_sub='-', supplier=self.supplier,
+                                                category=Category.objects.get(title='C-A'), price=1, tax=0,
+                                                tax_price=1, currency=rmb, status='A')
+        size = Size.objects.create(title='XL', status='A')
+        self.products = [Product.objects.create(title=title, size=size, image_sub='-', price=1, tax=0, tax_price=1,
+                                                currency=rmb, status='A') for title in ['P-1', 'P-2', 'P-3']]
+        masterdata.clear()
+
+    def tearDown(self):
+        masterdata.clear()
+
+    def load(self, kind, text):
+        return import_file(kind, BytesIO(text.encode('utf-8')), kind + '.csv')
+
+    def test_material_create_update_and_errors(self):
+        result = self.load('material', self.MATERIAL_HEADER +
+                           'M-OLD,-,S,C-A,1,0,1,RMB,old\n'
+                           'M-NEW,img,S,C-A,2.5,0,2.5,RMB,Hex bolt\n'
+                           '\n'
+                           'M-BAD,img,X,C-W,abc,0,1,USD,\n'
+                           'M-NEW,img,S,C-A,3,0,3,RMB,\n')
+        self.assertEqual((result.created, result.updated, result.unchanged), (1, 0, 1))
+        self.assertEqual([line for line, message in result.errors], [5, 6])
+        self.assertIn(u'供货商[X]不存在', result.errors[0][1])
+        self.assertIn(u'种类[C-W]不存在或未核准', result.errors[0][1])
+        self.assertIn(u'未税价', result.errors[0][1])
+        self.assertIn(u'重复', result.errors[1][1])
+        created = Material.objects.get(title='M-NEW')
+        self.assertEqual((created.status, created.price, created.currency_id), ('W', 2.5, 'RMB'))
+        self.assertEqual(search.search_documents(User.objects.create_superuser('user', 'u@example.com', 'user'),
+                                                 'hex bo')[0]['id'], created.pk)
+
+        result = self.load('material', self.MATERIAL_HEADER + 'M-OLD,-,S,C-A,2,0,2,RMB,new nut\n')
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 1, 0))
+        self.material.refresh_from_db()
+        self.assertEqual((self.material.price, self.material.description, self.material.status), (2, 'new nut', 'A'))
+        self.assertEqual(list(Material.objects.filter(search.search_filter('material', 'nut'))
+                              .values_list('pk', flat=True)), [self.material.pk])
+
+    def test_reindex_only_changed_search_fields(self):
+        words = dict(SearchWord.objects.filter(kind='material', object_id=self.material.pk).values_list('word', 'id'))
+        with mock.patch('basic.importer.index_rows', wraps=search.index_rows) as index_rows:
+            self.load('material', self.MATERIAL_HEADER + 'M-OLD,-,S,C-A,5,0,5,RMB,old\n')
+        #只有价格不同，不更新索引
+        self.assertEqual(index_rows.call_args[0][1], {})
+
+        self.load('material', self.MATERIAL_HEADER + 'M-OLD,-,S,C-A,5,0,5,RMB,old nut\n')
+        #索引只写入新增的字词，原有的字词不删除重写
+        self.assertEqual(dict(SearchWord.objects.filter(kind='material', object_id=self.material.pk)
+                              .values_list('word', 'id')), dict(words, nut=SearchWord.objects.get(word='nut').id))
+
+    def test_missing_column(self):
+        with self.assertRaises(ValidationError):
+            self.load('material', 'title,price\nM-NEW,1\n')
+        self.assertFalse(Material.objects.filter(title='M-NEW').exists())
+
+    def test_unreadable_csv(self):
+        #非UTF-8编码与引号未结束都回报行号，已读取的资料不写入
+        gbk = (self.MATERIAL_HEADER + 'M-NEW,img,S,C-A,1,0,1,RMB,\n' + u'M-螺丝,img,S,C-A,1,0,1,RMB,\n').encode('gbk')
+        quote = (self.MATERIAL_HEADER + 'M-NEW,img,S,C-A,1,0,1,RMB,\nM-X,"' + 'x' * 200000 + '\n').encode('utf-8')
+        for data, message in [(gbk, u'第3行：档案不是UTF-8编码'), (quote, u'第3行：CSV格式错误')]:
+            with self.assertRaises(ValidationError) as raised:
+                import_file('material', BytesIO(data), 'material.csv')
+            self.assertTrue(raised.exception.messages[0].startswith(message))
+            self.assertFalse(Material.objects.filter(title='M-NEW').exists())
+
+        path = os.path.join(tempfile.mkdtemp(), 'material.csv')
+        with open(path, 'wb') as f:
+            f.write(gbk)
+        with self.assertRaisesMessage(CommandError, u'第3行'):
+            call_command('import_masterdata', 'material', path, stdout=StringIO())
+
+    def test_bom_replaces_lines(self):
+        p1, p2, p3 = self.products
+        Bom.objects.create(product=p1, material=self.material, quantity=9)
+        result = self.load('bom', 'product,material,component,quantity\n'
+                                  'P-1,M-OLD,,2\n'
+                                  'P-1,,P-2,1\n'
+                                  'P-2,M-OLD,,3\n'
+                                  'P-3,M-OLD,P-1,1\n'
+                                  'P-3,,P-3,1\n'
+                                  'P-9,M-OLD,,0\n')
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual([line for line, message in result.errors], [5, 6, 7])
+        self.assertEqual(list(Bom.objects.filter(product=p1).order_by('num')
+                              .values_list('num', 'material_id', 'component_id', 'quantity')),
+                         [('00001', self.material.pk, None, 2), ('00002', None, p2.pk, 1)])
+        self.assertEqual(BomGraph.load().unit_materials(p1.pk), {self.material.pk: 5})
+
+        #整批删除原有单身只失效一次BOM快取，其他线程的BOM异动照常处理
+        with mock.patch('basic.signals.invalidate_bom') as per_line, \
+                mock.patch('basic.importer.invalidate_bom') as once:
+            self.load('bom', 'product,material,component,quantity\nP-1,M-OLD,,2\nP-1,,P-2,1\nP-2,M-OLD,,4\n')
+        self.assertEqual((per_line.call_count, once.call_count), (0, 1))
+        with mock.patch('basic.signals.invalidate_bom') as per_line:
+            Bom.objects.filter(product=p2).delete()
+        self.assertEqual(per_line.call_count, 1)
+        Bom.objects.create(product=p2, material=self.material, quantity=3)
+
+        #P-2改用P-1会形成循环，P-2维持原有的单身
+        result = self.load('bom', 'product,material,component,quantity\nP-2,,P-1,1\n')
+        self.assertEqual(result.created + result.updated, 0)
+        self.assertEqual([line for line, message in result.errors], [2])
+        self.assertEqual(list(Bom.objects.filter(product=p2).values_list('material_id', 'quantity')),
+                         [(self.material.pk, 3)])
+
+    def test_admin_import_view(self):
+        user = User.objects.create_user('user', is_staff=True)
+        user.user_permissions.add(*Permission.objects.filter(codename__in=['view_material', 'add_material']))
+        self.client.force_login(user)
+        url = reverse('admin:basic_material_import')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertFalse(self.client.get(reverse('admin:basic_material_changelist')).context['has_import_permission'])
+
+        user.user_permissions.add(Permission.objects.get(codename='change_material'))
+        self.assertTrue(self.client.get(reverse('admin:basic_material_changelist')).context['has_import_permission'])
+        upload = SimpleUploadedFile('material.csv', (self.MATERIAL_HEADER + 'M-NEW,img,S,C-A,1,0,1,RMB,\n'
+                                                     'M-BAD,img,S,C-A,1,0,1,XXX,\n').encode('utf-8'))
+        response = self.client.post(url, {'kind': 'material', 'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].created, 1)
+        self.assertEqual([line for line, message in response.context['errors']], [3])
+
+        response = self.client.post(url, {'kind': 'product', 'file': SimpleUploadedFile('p.csv', b'title\n')})
+        self.assertIn('kind', response.context['form'].errors)
+
+        upload = SimpleUploadedFile('material.csv', (self.MATERIAL_HEADER + u'M-螺丝,img,S,C-A,1,0,1,RMB,\n').encode('gbk'))
+        response = self.client.post(url, {'kind': 'material', 'file': upload})
+        self.assertIn(u'第2行', response.context['form'].errors['file'][0])
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'material.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.MATERIAL_HEADER + 'M-NEW,img,S,C-A,1,0,1,RMB,\nM-BAD,img,S,C-A,1,0,1,XXX,\n')
+        out = StringIO()
+        call_command('import_masterdata', 'material', path, errors=path + '.errors', stdout=out)
+        self.assertIn(u'新增 1 笔，更新 0 笔，未变更 0 笔，错误 1 笔', out.getvalue())
+        self.assertIn(u'第3行', out.getvalue())
+        with open(path + '.errors', encoding='utf-8-sig') as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
@@ -6,4 +6,8 @@ app_name = 'basic'
 
 
 urlpatterns = [
+    path('metrics/', views.metrics_summary, name='metrics_summary'),
+    path('material/ajax/where_used/', views.material_ajax_where_used, name='material_ajax_where_used'),
+    path('find/', views.find_document, name='find_document'),
+    path('autocomplete/<str:source>/', views.autocomplete, name='autocomplete'),
 ]
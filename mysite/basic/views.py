@@ -1,3 +1,71 @@
-from django.shortcuts import render
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
+from . import metrics
+from .autocomplete import SOURCES, search
+from .search import search_documents
+from .whereused import where_used
 
-# Create your views here.
+
+def metrics_summary(request):
+    return_dict = {}
+    #只有管理员可以检视与重置统计
+    if request.user.is_superuser:
+        return_dict['code'] = 0
+        return_dict['msg'] = ''
+        return_dict['views'] = metrics.snapshot()
+        if request.GET.get('reset'):
+            metrics.reset()
+    else:
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限检视查询统计"
+    return JsonResponse(return_dict)
+
+
+"""
+原料的使用情况(where-used)：使用该原料的商品、有效且尚未全部出货的订单与尚未入库的制程单
+订单与制程单只在使用者有检视权限时回传
+查询次数固定，与BOM表笔数无关
+"""
+def material_ajax_where_used(request):
+    return_dict = {}
+    #判断使用者是否有权限检视原料
+    if request.user.has_perm('basic.view_material'):
+        material_id = request.GET.get('id') or ''
+        if material_id.isdigit():
+            return_dict['code'] = 0
+            return_dict['msg'] = ''
+            return_dict.update(where_used(request.user, int(material_id)))
+        else:
+            return_dict['code'] = 1
+            return_dict['msg'] = u'原料id格式错误'
+    else:
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限浏览原料"
+    return JsonResponse(return_dict)
+
+
+"""
+管理界面自动完成(select2)，source为basic.autocomplete.SOURCES中的资料来源
+"""
+def autocomplete(request, source):
+    if source not in SOURCES:
+        raise Http404
+    if not request.user.has_perm(SOURCES[source].permission()):
+        raise PermissionDenied
+    page = request.GET.get('page') or '1'
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    return JsonResponse(search(request.user, source, request.GET.get('term', ''), page))
+
+
+"""
+全域搜寻，以单号、发票号码或名称/描述中的文字搜寻订单、收付款单与基本资料
+"""
+def find_document(request):
+    return_dict = {}
+    term = request.GET.get('q', '')
+    return_dict['code'] = 0
+    return_dict['msg'] = ''
+    return_dict['results'] = search_documents(request.user, term)
+    if not return_dict['results']:
+        return_dict['msg'] = u'找不到符合"{}"的资料'.format(term)
+    return JsonResponse(return_dict)
@@ -0,0 +1,101 @@
+from inventory.models import Process
+from sale.models import OrderProduct
+from .bom import MAX_BOM_DEPTH, BomCycle
+from .models import Bom, Product
+
+#各区块最多列出的笔数，合计笔数不受限制
+WHERE_USED_LIMIT = 50
+
+#有效且尚未全部出货的订单
+OPEN_ORDER_STATUS = ['N', 'P']
+
+#尚未入库的制程单
+OPEN_PROCESS_STATUS = ['A', 'C']
+
+
+"""
+由商品往上找出使用这些商品作为半成品的商品，每一阶一个以Bom(component, product)索引的查询
+quantities为{商品id: 每单位用量}，回传包含原商品的{商品id: 每单位用量}
+"""
+def _walk_up(quantities):
+    total = dict(quantities)
+    frontier = dict(quantities)
+    depth = 0
+    while frontier:
+        depth += 1
+        if depth > MAX_BOM_DEPTH:
+            raise BomCycle(tuple(frontier))
+        parents = {}
+        for product_id, component_id, quantity in Bom.objects.filter(component_id__in=list(frontier))\
+                .values_list('product_id', 'component_id', 'quantity'):
+            parents[product_id] = parents.get(product_id, 0) + frontier[component_id] * quantity
+        for product_id, quantity in parents.items():
+            total[product_id] = total.get(product_id, 0) + quantity
+        frontier = parents
+    return total
+
+
+"""
+使用原料的商品与每单位商品的原料用量，包含经由半成品间接使用的商品
+"""
+def used_quantities(material_id):
+    direct = {}
+    for product_id, quantity in Bom.objects.filter(material_id=material_id).values_list('product_id', 'quantity'):
+        direct[product_id] = direct.get(product_id, 0) + quantity
+    return _walk_up(direct)
+
+
+"""
+反查使用原料的商品(where-used)，以Bom(material, product)索引查询，不读取BOM表资料列
+包含经由半成品间接使用的商品
+"""
+def products_using(material_ids):
+    direct = set(Bom.objects.filter(material_id__in=list(material_ids)).values_list('product_id', flat=True))
+    return set(_walk_up(dict.fromkeys(direct, 1)))
+
+
+"""
+商品本身与所有使用这些商品作为半成品的商品
+"""
+def products_containing(product_ids):
+    return set(_walk_up(dict.fromkeys(product_ids, 1)))
+
+
+def _section(queryset, key, fields, limit):
+    return {
+        'count': queryset.values(key).distinct().count(),
+        'items': [dict(zip(fields, row)) for row in queryset.values_list(*fields).distinct()[:limit]],
+    }
+
+
+"""
+原料的使用情况，每个查询都以索引读取，与BOM表笔数无关：
+1.products: 直接或经由半成品使用该原料的商品与每单位用量，查询次数为BOM阶数 + 2
+2.orders: 订购这些商品的有效且尚未全部出货订单，2个查询，使用者须有检视订单权限
+3.processes: 这些商品尚未入库的制程单，2个查询，使用者须有检视制程单权限
+各区块回传{'count': 合计笔数, 'items': 前limit笔}，没有权限的区块不回传
+修改原料价格、原料缺料或终止原料前检视影响范围时使用
+"""
+def where_used(user, material_id, limit=WHERE_USED_LIMIT):
+    quantities = used_quantities(material_id)
+    product_ids = list(quantities)
+    products = Product.objects.filter(id__in=product_ids).order_by('id').values_list('id', 'title', 'status')[:limit]
+    result = {
+        'products': {
+            'count': len(product_ids),
+            'items': [{'id': product_id, 'title': title, 'quantity': quantities[product_id], 'status': status}
+                      for product_id, title, status in products],
+        },
+    }
+    if user.has_perm('sale.view_order'):
+        orders = OrderProduct.objects.filter(product_id__in=product_ids, order__is_active=True,
+                                             order__status__in=OPEN_ORDER_STATUS).order_by('order_id')
+        result['orders'] = _section(orders, 'order_id', ['order_id', 'order__pi_no', 'order__customer__title',
+                                                         'order__status', 'order__etd'], limit)
+    if user.has_perm('inventory.view_process'):
+        processes = Process.objects.filter(product_id__in=product_ids, status__in=OPEN_PROCESS_STATUS)\
+            .order_by('id')
+        result['processes'] = _section(processes, 'id',
+                                       ['id', 'order_id', 'product_id', 'product__title', 'quantity', 'status'],
+                                       limit)
+    return result
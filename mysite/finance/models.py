@@ -1,6 +1,7 @@
 from django.db import models
 from django.urls import reverse
 from basic.models import Currency, Customer, Material, Product, Supplier
+from basic.numbering import format_num
 from sale.models import Ship
 from purchase.models import Arrive
 
@@ -29,21 +30,24 @@ class Receivable(models.Model):
     class Meta:
         verbose_name = '应收帐款'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['is_active', 'status']),
+        ]
 
 
 class ReceivableDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     receivable = models.ForeignKey(Receivable, verbose_name=u'应收帐款单头', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, verbose_name=u'商品', on_delete=models.PROTECT)
     amount = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'金额')
+    received_amount = models.DecimalField(max_digits=16, decimal_places=4, default=0, verbose_name=u'已收金额')
     currency = models.ForeignKey(Currency, verbose_name=u'币别', on_delete=models.PROTECT)
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             receivable_details = ReceivableDetail.objects.filter(receivable=self.receivable)
-            num = "{0:02d}".format(receivable_details.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(receivable_details.count() + 1)
 
         super().save(*args, **kwargs)
 
@@ -53,6 +57,9 @@ class ReceivableDetail(models.Model):
     class Meta:
         verbose_name = '应收帐款单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['receivable', 'product']),
+        ]
 
 
 class Receive(models.Model):
@@ -75,10 +82,15 @@ class Receive(models.Model):
     class Meta:
         verbose_name = '收款单'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['receivable', 'is_active']),
+            models.Index(fields=['created', 'id']),
+            models.Index(fields=['invoice_no']),
+        ]
 
 
 class ReceiveDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     receive = models.ForeignKey(Receive, verbose_name=u'收款单单头', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, verbose_name=u'商品', on_delete=models.PROTECT)
     amount = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'金额')
@@ -89,10 +101,9 @@ class ReceiveDetail(models.Model):
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             receive_details = ReceiveDetail.objects.filter(receive=self.receive)
-            num = "{0:02d}".format(receive_details.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(receive_details.count() + 1)
 
         super().save(*args, **kwargs)
 
@@ -102,6 +113,9 @@ class ReceiveDetail(models.Model):
     class Meta:
         verbose_name = '收款单单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['receive', 'product']),
+        ]
 
 
 DUE_CHOICES = [
@@ -129,21 +143,24 @@ class Due(models.Model):
     class Meta:
         verbose_name = '应付帐款'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['is_active', 'status']),
+        ]
 
 
 class DueDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     due = models.ForeignKey(Due, verbose_name=u'应付帐款单头', on_delete=models.CASCADE)
     material = models.ForeignKey(Material, verbose_name=u'原料', on_delete=models.PROTECT)
     amount = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'金额')
+    paid_amount = models.DecimalField(max_digits=16, decimal_places=4, default=0, verbose_name=u'已付金额')
     currency = models.ForeignKey(Currency, verbose_name=u'币别', on_delete=models.PROTECT)
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             due_details = DueDetail.objects.filter(due=self.due)
-            num = "{0:02d}".format(due_details.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(due_details.count() + 1)
 
         super().save(*args, **kwargs)
 
@@ -153,6 +170,9 @@ class DueDetail(models.Model):
     class Meta:
         verbose_name = '应付帐款单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['due', 'material']),
+        ]
 
 
 class Pay(models.Model):
@@ -175,10 +195,15 @@ class Pay(models.Model):
     class Meta:
         verbose_name = '付款单'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['due', 'is_active']),
+            models.Index(fields=['created', 'id']),
+            models.Index(fields=['invoice_no']),
+        ]
 
 
 class PayDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     pay = models.ForeignKey(Pay, verbose_name=u'付款单单头', on_delete=models.CASCADE)
     material = models.ForeignKey(Material, verbose_name=u'原料', on_delete=models.PROTECT)
     amount = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'金额')
@@ -189,10 +214,9 @@ class PayDetail(models.Model):
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             pay_details = PayDetail.objects.filter(pay=self.pay)
-            num = "{0:02d}".format(pay_details.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(pay_details.count() + 1)
 
         super().save(*args, **kwargs)
 
@@ -202,4 +226,7 @@ class PayDetail(models.Model):
     class Meta:
         verbose_name = '付款单单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['pay', 'material']),
+        ]
 
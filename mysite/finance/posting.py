@@ -0,0 +1,65 @@
+import datetime
+from django.db.models import DecimalField
+from basic.metrics import measure
+from basic.status import add_to_lines
+from purchase.models import ProcurementMaterial
+from sale.models import OrderProduct
+from .models import DueDetail, PayDetail, ReceivableDetail, ReceiveDetail
+from .status import refresh_due_status, refresh_receivable_status
+
+AMOUNT_FIELD = DecimalField(max_digits=16, decimal_places=4)
+
+
+"""
+收款单过账，收款单单头与单身存盘后呼叫：
+1.累加应收帐款单身的已收金额(received_amount)与订单单身的已收含税金额(tax_receive)，金额为收款金额 + 折扣
+2.重算应收帐款状态
+3.检查收款日期是否有延迟(is_delay)
+"""
+@measure('posting:receive')
+def post_receive(receive):
+    receivable = receive.receivable
+    received = {}
+    for product_id, amount, discount in ReceiveDetail.objects.filter(receive=receive)\
+            .values_list('product_id', 'amount', 'discount'):
+        received[product_id] = received.get(product_id, 0) + amount + discount
+
+    add_to_lines(ReceivableDetail.objects.filter(receivable=receivable), 'product_id', 'received_amount',
+                 received, AMOUNT_FIELD)
+    add_to_lines(OrderProduct.objects.filter(order_id=receivable.ship.order_id), 'product_id', 'tax_receive',
+                 received, AMOUNT_FIELD)
+
+    #决定对应应收帐款状态('A', '全部收款'),('P', '部分收款')，('O', '超额收款')
+    refresh_receivable_status([receivable.id])
+
+    today = datetime.datetime.now().date()
+    if today > receivable.receivabled:
+        receive.is_delay = True
+        receive.save()
+
+
+"""
+付款单过账，付款单单头与单身存盘后呼叫：
+1.累加应付帐款单身的已付金额(paid_amount)与采购单单身的已付含税金额(tax_pay)，金额为付款金额 + 折扣
+2.重算应付帐款状态
+3.检查付款日期是否有延迟(is_delay)
+"""
+@measure('posting:pay')
+def post_pay(pay):
+    due = pay.due
+    paid = {}
+    for material_id, amount, discount in PayDetail.objects.filter(pay=pay)\
+            .values_list('material_id', 'amount', 'discount'):
+        paid[material_id] = paid.get(material_id, 0) + amount + discount
+
+    add_to_lines(DueDetail.objects.filter(due=due), 'material_id', 'paid_amount', paid, AMOUNT_FIELD)
+    add_to_lines(ProcurementMaterial.objects.filter(procurement_id=due.arrive.procurement_id), 'material_id',
+                 'tax_pay', paid, AMOUNT_FIELD)
+
+    #决定对应应付帐款状态('A', '全部付款'),('P', '部分付款')，('O', '超额付款')
+    refresh_due_status([due.id])
+
+    today = datetime.datetime.now().date()
+    if today > due.dued:
+        pay.is_delay = True
+        pay.save()
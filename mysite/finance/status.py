@@ -0,0 +1,101 @@
+from django.db.models import DecimalField, F, Sum
+from basic import masterdata
+from basic.models import Currency
+from basic.status import apply_statuses, in_chunks, set_lines
+from .models import Due, DueDetail, PayDetail, Receivable, ReceivableDetail, ReceiveDetail
+
+
+"""
+各应收帐款各商品的已收款金额(收款金额 + 折扣，只计有效收款单)，回传{(应收帐款id, 商品id): 金额}
+重建应收帐款单身已收金额(received_amount)时使用
+"""
+def received_amounts(receivable_ids):
+    rows = ReceiveDetail.objects.filter(receive__receivable_id__in=receivable_ids, receive__is_active=True)\
+        .values('receive__receivable_id', 'product_id').annotate(total=Sum(F('amount') + F('discount')))\
+        .values_list('receive__receivable_id', 'product_id', 'total')
+    return dict(((receivable_id, product_id), total) for receivable_id, product_id, total in rows)
+
+
+"""
+各应付帐款各原料的已付款金额(付款金额 + 折扣，只计有效付款单)，回传{(应付帐款id, 原料id): 金额}
+重建应付帐款单身已付金额(paid_amount)时使用
+"""
+def paid_amounts(due_ids):
+    rows = PayDetail.objects.filter(pay__due_id__in=due_ids, pay__is_active=True)\
+        .values('pay__due_id', 'material_id').annotate(total=Sum(F('amount') + F('discount')))\
+        .values_list('pay__due_id', 'material_id', 'total')
+    return dict(((due_id, material_id), total) for due_id, material_id, total in rows)
+
+
+"""
+各单头各原料/商品的未收/未付金额，每批单头一个查询：
+单身依(单头, 原料/商品)合计应收/应付金额与已收/已付金额，汇率由基本资料快取取得
+回传[(单头id, 原料/商品id, 名称, 未收/未付金额, 币别, 汇率)]，依单头与原料/商品排序
+"""
+def _outstanding(detail_model, header_key, item_key, settled_field, header_ids):
+    item_field = item_key[:-3]
+    rows = []
+    for ids in in_chunks(header_ids):
+        details = detail_model.objects.filter(**{header_key + '__in': ids})\
+            .values(header_key, item_key, item_field + '__title', 'currency_id')\
+            .annotate(total=Sum(F('amount') - F(settled_field))).order_by(header_key, item_key)\
+            .values_list(header_key, item_key, item_field + '__title', 'total', 'currency_id')
+        for header_id, item_id, title, total, currency_id in details:
+            rows.append((header_id, item_id, title, total, currency_id, masterdata.get(Currency, currency_id).rate))
+    return rows
+
+
+def outstanding_receivables(receivable_ids):
+    return _outstanding(ReceivableDetail, 'receivable_id', 'product_id', 'received_amount', receivable_ids)
+
+
+def outstanding_dues(due_ids):
+    return _outstanding(DueDetail, 'due_id', 'material_id', 'paid_amount', due_ids)
+
+
+"""
+重算应收帐款状态('N', '尚未收款'),('A', '全部收款'),('P', '部分收款'),('O', '超额收款')
+已收金额读取单身维护的栏位
+"""
+def refresh_receivable_status(receivable_ids):
+    statuses = {}
+    for ids in in_chunks(receivable_ids):
+        lines = ReceivableDetail.objects.filter(receivable_id__in=ids)\
+            .values_list('receivable_id', 'amount', 'received_amount')
+        statuses.update(apply_statuses(Receivable, ids, lines))
+    return statuses
+
+
+"""
+重算应付帐款状态('N', '尚未付款'),('A', '全部付款'),('P', '部分付款'),('O', '超额付款')
+有一笔超额付款就算O，已付金额读取单身维护的栏位
+"""
+def refresh_due_status(due_ids):
+    statuses = {}
+    for ids in in_chunks(due_ids):
+        lines = DueDetail.objects.filter(due_id__in=ids).values_list('due_id', 'amount', 'paid_amount')
+        statuses.update(apply_statuses(Due, ids, lines, over_first=True))
+    return statuses
+
+
+"""
+由收款单/付款单重新合计应收/应付帐款单身的已收/已付金额，再重算状态
+"""
+def _rebuild(detail_model, header_key, item_key, settled_field, settled_amounts, header_ids):
+    for ids in in_chunks(header_ids):
+        settled = settled_amounts(ids)
+        values = {}
+        for line_id, header_id, item_id in detail_model.objects.filter(**{header_key + '__in': ids})\
+                .values_list('id', header_key, item_key):
+            values[line_id] = settled.get((header_id, item_id)) or 0
+        set_lines(detail_model, settled_field, values, DecimalField(max_digits=16, decimal_places=4))
+
+
+def rebuild_receivable_lines(receivable_ids):
+    _rebuild(ReceivableDetail, 'receivable_id', 'product_id', 'received_amount', received_amounts, receivable_ids)
+    return refresh_receivable_status(receivable_ids)
+
+
+def rebuild_due_lines(due_ids):
+    _rebuild(DueDetail, 'due_id', 'material_id', 'paid_amount', paid_amounts, due_ids)
+    return refresh_due_status(due_ids)
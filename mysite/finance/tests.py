@@ -1,3 +1,240 @@
+import datetime
+from decimal import Decimal
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from basic.bulk import BulkLine
+from basic.models import Category, Currency, Customer, Material, Period, Product, Size, Supplier
+from basic.testing import QueryPlanMixin
+from purchase.bulk import add_arrive_lines, add_procurement_lines
+from purchase.models import Procurement, ProcurementMaterial
+from purchase.status import rebuild_procurement_lines
+from sale.bulk import add_order_lines, add_ship_lines
+from sale.models import Order, OrderProduct
+from sale.status import rebuild_order_lines
+from .models import Due, DueDetail, Pay, PayDetail, Receivable, ReceivableDetail, Receive, ReceiveDetail
+from .posting import post_pay, post_receive
+from .status import rebuild_due_lines, rebuild_receivable_lines
 
-# Create your tests here.
+
+class FinanceQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_open_receivables_and_dues(self):
+        self.assertUsesIndex(Receivable.objects.filter(is_active=True, status='N'))
+        self.assertUsesIndex(Due.objects.filter(is_active=True, status='N'))
+
+    def test_details_by_header_and_item(self):
+        self.assertUsesIndex(ReceivableDetail.objects.filter(receivable_id=1, product_id=1))
+        self.assertUsesIndex(ReceiveDetail.objects.filter(receive_id=1, product_id=1))
+        self.assertUsesIndex(DueDetail.objects.filter(due_id=1, material_id=1))
+        self.assertUsesIndex(PayDetail.objects.filter(pay_id=1, material_id=1))
+
+    def test_active_receives_and_pays(self):
+        self.assertUsesIndex(Receive.objects.filter(receivable_id=1, is_active=True))
+        self.assertUsesIndex(Pay.objects.filter(due_id=1, is_active=True))
+
+
+"""
+出货10个P1、10个P2(含税价2)产生应收帐款，到货10个M1、10个M2(含税价3)产生应付帐款
+"""
+class FinanceFixtureMixin:
+    def setUp(self):
+        self.user = User.objects.create_superuser('user', 'user@example.com', 'user')
+        self.rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        period = Period.objects.create(title='P', period=30)
+        self.customer = Customer.objects.create(title='C', period=period, status='A')
+        self.supplier = Supplier.objects.create(title='S', period=period, status='A')
+        size = Size.objects.create(title='Z', status='A')
+        category = Category.objects.create(title='C', status='A')
+        defaults = {'image_sub': '-', 'tax': 0, 'currency': self.rmb, 'stock': 100, 'status': 'A'}
+        self.products = [Product.objects.create(title='P{}'.format(i), size=size, price=2, tax_price=2, **defaults)
+                         for i in range(1, 3)]
+        self.materials = [Material.objects.create(title='M{}'.format(i), supplier=self.supplier, category=category,
+                                                  price=3, tax_price=3, **defaults) for i in range(1, 3)]
+        etd = datetime.date(2019, 1, 31)
+        order = Order.objects.create(cat_id='1', pi_no='R201901001', customer=self.customer, etd=etd,
+                                     create_user=self.user)
+        lines = [BulkLine(row, product.id, 10) for row, product in enumerate(self.products, 1)]
+        add_order_lines(order, lines)
+        self.receivable = Receivable.objects.get(ship=add_ship_lines(order, lines, self.user))
+        procurement = Procurement.objects.create(is_correspond='0', supplier=self.supplier, etd=etd,
+                                                 create_user=self.user)
+        lines = [BulkLine(row, material.id, 10) for row, material in enumerate(self.materials, 1)]
+        add_procurement_lines(procurement, lines)
+        self.due = Due.objects.get(arrive=add_arrive_lines(procurement, lines, self.user))
+
+    def receive(self, amounts, receivable=None):
+        receivable = receivable or self.receivable
+        receive = Receive.objects.create(invoice_no='I{}'.format(Receive.objects.count()), receivable=receivable,
+                                         customer=self.customer, create_user=self.user)
+        ReceiveDetail.objects.bulk_create([ReceiveDetail(receive=receive, product=product, amount=amount,
+                                                         discount=discount, currency=self.rmb, rate=1)
+                                           for product, (amount, discount) in zip(self.products, amounts)])
+        post_receive(receive)
+        return receive
+
+    def pay(self, amounts):
+        pay = Pay.objects.create(invoice_no='I{}'.format(Pay.objects.count()), due=self.due, supplier=self.supplier,
+                                 create_user=self.user)
+        PayDetail.objects.bulk_create([PayDetail(pay=pay, material=material, amount=amount, discount=discount,
+                                                 currency=self.rmb, rate=1)
+                                       for material, (amount, discount) in zip(self.materials, amounts)])
+        post_pay(pay)
+        return pay
+
+
+class SettlementStatusTests(FinanceFixtureMixin, TestCase):
+    def settled(self, detail_model, header, field):
+        return list(detail_model.objects.filter(**{header._meta.model_name: header}).order_by('id')
+                    .values_list(field, flat=True))
+
+    def test_receivable_transitions(self):
+        self.assertEqual(self.receivable.status, 'N')
+        receive = self.receive([(10, 0), (0, 0)])
+        self.assertEqual(Receivable.objects.get(id=self.receivable.id).status, 'P')
+        #折扣计入已收金额
+        self.receive([(8, 2), (25, 0)])
+        self.assertEqual(self.settled(ReceivableDetail, self.receivable, 'received_amount'), [20, 25])
+        self.assertEqual(Receivable.objects.get(id=self.receivable.id).status, 'O')
+
+        #终止的收款单不计入，部分收款优先于超额收款
+        Receive.objects.filter(id=receive.id).update(is_active=False)
+        self.assertEqual(rebuild_receivable_lines([self.receivable.id]), {self.receivable.id: 'P'})
+        self.assertEqual(self.settled(ReceivableDetail, self.receivable, 'received_amount'), [10, 25])
+
+    def test_order_and_procurement_paid_columns(self):
+        #收款/付款过账累加订单单身已收含税金额(tax_receive)与采购单单身已付含税金额(tax_pay)，含折扣
+        receive = self.receive([(5, 1), (20, 0)])
+        self.receive([(3, 0), (0, 0)])
+        self.pay([(10, 2), (0, 0)])
+        self.assertEqual(list(OrderProduct.objects.order_by('id').values_list('tax_receive', flat=True)), [9, 20])
+        self.assertEqual(list(ProcurementMaterial.objects.order_by('id').values_list('tax_pay', flat=True)), [12, 0])
+
+        #重建时只计有效收款单/付款单
+        Receive.objects.filter(id=receive.id).update(is_active=False)
+        Pay.objects.update(is_active=False)
+        rebuild_order_lines(list(Order.objects.values_list('id', flat=True)))
+        rebuild_procurement_lines(list(Procurement.objects.values_list('id', flat=True)))
+        self.assertEqual(list(OrderProduct.objects.order_by('id').values_list('tax_receive', flat=True)), [3, 0])
+        self.assertEqual(list(ProcurementMaterial.objects.order_by('id').values_list('tax_pay', flat=True)), [0, 0])
+
+    def test_due_over_payment_first(self):
+        self.pay([(10, 0), (35, 0)])
+        self.assertEqual(self.settled(DueDetail, self.due, 'paid_amount'), [10, 35])
+        #付款有一笔超额就是O
+        self.assertEqual(Due.objects.get(id=self.due.id).status, 'O')
+        self.pay([(20, 0), (0, 0)])
+        self.assertEqual(Due.objects.get(id=self.due.id).status, 'O')
+        Pay.objects.update(is_active=False)
+        self.assertEqual(rebuild_due_lines([self.due.id]), {self.due.id: 'N'})
+
+
+class OutstandingViewTests(FinanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def get(self, name, **params):
+        response = self.client.get(reverse(name), params).json()
+        self.assertEqual(response['code'], 0)
+        return response
+
+    def amounts(self, result, item_name):
+        return [(item[item_name]['title'], Decimal(str(item['amount']))) for item in result['items']]
+
+    def test_receivable_outstanding_subtracts_amount_and_discount(self):
+        self.receive([(5, 1), (20, 0)])
+        receivables = self.get('finance:receivable_ajax_outstanding', ids=str(self.receivable.id))['receivables']
+        #未收金额 = 20 - (5 + 折扣1)，已全部收款的单身不列出但计入合计
+        self.assertEqual(self.amounts(receivables[0], 'product'), [('P1', 14)])
+        self.assertEqual(Decimal(str(receivables[0]['totals']['RMB'])), 14)
+        self.assertEqual(receivables[0]['partner'], {'id': self.customer.id, 'title': 'C'})
+
+        self.receive([(10, 4), (0, 0)])
+        self.assertEqual(self.get('finance:receivable_ajax_outstanding', customer=self.customer.id)['receivables'],
+                         [])
+
+    def test_receivable_outstanding_queries_do_not_grow(self):
+        order = Order.objects.get()
+        second = Receivable.objects.get(ship=add_ship_lines(order, [BulkLine(1, self.products[0].id, 1)], self.user))
+        self.receive([(5, 0), (0, 0)])
+        self.receive([(1, 0)], receivable=second)
+
+        #先载入币别快取，只比较视图本身的查询
+        self.get('finance:receivable_ajax_outstanding', ids=str(self.receivable.id))
+        with CaptureQueriesContext(connection) as one:
+            self.get('finance:receivable_ajax_outstanding', ids=str(self.receivable.id))
+        with CaptureQueriesContext(connection) as both:
+            receivables = self.get('finance:receivable_ajax_outstanding', customer=self.customer.id)['receivables']
+        self.assertEqual(len(one), len(both))
+        self.assertEqual([(result['id'], self.amounts(result, 'product')) for result in receivables],
+                         [(self.receivable.id, [('P1', 15), ('P2', 20)]), (second.id, [('P1', 1)])])
+
+    def test_receivable_detail_list(self):
+        receive = self.receive([(5, 1), (0, 0)])
+        response = self.get('finance:receivable_ajax_detail_list', id=str(self.receivable.id))
+        self.assertIn(str(receive.id), response['msg'])
+        self.assertEqual([Decimal(str(item['amount'])) for item in response['receivables']], [14, 20])
+
+    def test_due_outstanding_subtracts_amount_and_discount(self):
+        self.pay([(10, 2), (0, 0)])
+        dues = self.get('finance:due_ajax_outstanding', supplier=self.supplier.id)['dues']
+        self.assertEqual([due['id'] for due in dues], [self.due.id])
+        self.assertEqual(self.amounts(dues[0], 'material'), [('M1', 18), ('M2', 30)])
+        self.assertEqual(Decimal(str(dues[0]['totals']['RMB'])), 48)
+
+        response = self.get('finance:due_ajax_detail_list', id=str(self.due.id))
+        self.assertEqual([Decimal(str(item['amount'])) for item in response['dues']], [18, 30])
+
+    def test_requires_permission(self):
+        self.client.force_login(User.objects.create_user('other'))
+        for name in ['finance:receivable_ajax_outstanding', 'finance:due_ajax_outstanding']:
+            self.assertEqual(self.client.get(reverse(name), {'ids': '1'}).json()['code'], 1)
+
+    def test_partner_id_must_be_number(self):
+        for name, partner, message in [('finance:receivable_ajax_outstanding', 'customer', u'客户id格式错误'),
+                                       ('finance:due_ajax_outstanding', 'supplier', u'供货商id格式错误')]:
+            response = self.client.get(reverse(name), {partner: 'abc'}).json()
+            self.assertEqual((response['code'], response['msg']), (1, message))
+
+
+"""
+在后台修改已过账的收款单/付款单，已收/已付金额按单身重算而不是再累加一次
+"""
+class SettlementAdminChangeTests(FinanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def change(self, header, prefix, item_field, fields):
+        data = dict(fields, **{prefix + '-TOTAL_FORMS': '0', prefix + '-INITIAL_FORMS': '0',
+                               prefix + '-MIN_NUM_FORMS': '0', prefix + '-MAX_NUM_FORMS': '1000'})
+        details = list(getattr(header, prefix).order_by('id'))
+        data[prefix + '-TOTAL_FORMS'] = data[prefix + '-INITIAL_FORMS'] = str(len(details))
+        for i, detail in enumerate(details):
+            for key, value in [('id', detail.id), (header._meta.model_name, header.id),
+                               (item_field, getattr(detail, item_field + '_id')), ('amount', detail.amount),
+                               ('discount', detail.discount), ('currency', detail.currency_id),
+                               ('rate', detail.rate), ('description', '')]:
+                data['{}-{}-{}'.format(prefix, i, key)] = value
+        url = reverse('admin:finance_{}_change'.format(header._meta.model_name), args=[header.id])
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_resave_receive(self):
+        receive = self.receive([(10, 0), (0, 0)])
+        self.change(receive, 'receivedetail_set', 'product',
+                    {'receivable': self.receivable.id, 'invoice_no': 'CHANGED'})
+        self.assertEqual(Receive.objects.get(id=receive.id).invoice_no, 'CHANGED')
+        self.assertEqual(list(ReceivableDetail.objects.order_by('id').values_list('received_amount', flat=True)),
+                         [10, 0])
+        self.assertEqual(list(OrderProduct.objects.order_by('id').values_list('tax_receive', flat=True)), [10, 0])
+        self.assertEqual(Receivable.objects.get(id=self.receivable.id).status, 'P')
+
+    def test_resave_pay(self):
+        pay = self.pay([(10, 2), (0, 0)])
+        self.change(pay, 'paydetail_set', 'material', {'due': self.due.id, 'invoice_no': 'CHANGED'})
+        self.assertEqual(list(DueDetail.objects.order_by('id').values_list('paid_amount', flat=True)), [12, 0])
+        self.assertEqual(list(ProcurementMaterial.objects.order_by('id').values_list('tax_pay', flat=True)), [12, 0])
+        self.assertEqual(Due.objects.get(id=self.due.id).status, 'P')
@@ -7,4 +7,6 @@ app_name = 'finance'
 urlpatterns = [
     path('receivable/ajax/list/', views.receivable_ajax_detail_list, name='receivable_ajax_detail_list'),
     path('due/ajax/list/', views.due_ajax_detail_list, name='due_ajax_detail_list'),
+    path('receivable/ajax/outstanding/', views.receivable_ajax_outstanding, name='receivable_ajax_outstanding'),
+    path('due/ajax/outstanding/', views.due_ajax_outstanding, name='due_ajax_outstanding'),
 ]
@@ -1,37 +1,35 @@
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
-from .models import Due, DueDetail, Pay, PayDetail, Receivable, ReceivableDetail, Receive, ReceiveDetail
+from .models import Due, Pay, Receivable, Receive
+from .status import outstanding_dues, outstanding_receivables
 
 
+def _parse_ids(value):
+    return [int(i) for i in (value or '').split(',') if i.strip().isdigit()]
+
+
+"""
+应收帐款未收金额，收款单选择对应应收帐款时使用
+未收金额 = 应收金额 - 有效收款单(收款金额 + 折扣)合计，查询次数固定，与收款单笔数无关
+"""
 def receivable_ajax_detail_list(request):
     return_dict = {}
     #判断使用者是否有权限检视应收帐款
     if request.user.has_perm('finance.view_receivable'):
-        receivable_id = request.GET.get('id')
-        receivable = Receivable.objects.get(id=receivable_id)
+        receivable_ids = _parse_ids(request.GET.get('id'))
         return_dict['code'] = 0
         return_dict['msg'] = ''
         return_dict['receivables'] = []
-        receivable_details = ReceivableDetail.objects.filter(receivable=receivable)
-
-        for d in receivable_details.all():
-            product = d.product
-            amount = d.amount
-            currency = d.currency
-            rate = currency.rate
-
-            # 如果该应收帐款有其他对应收款，则需扣掉已收款的商品金额
-            other_receives = Receive.objects.filter(receivable=receivable, is_active=True)
-            if other_receives.count() > 0:
-                return_dict['msg'] = u'此应收帐款已有对应收款单，收款单单号如下：'
-                for r in other_receives.all():
-                    return_dict['msg'] += ' ' + str(r.id)
-                    receive_detail = ReceiveDetail.objects.filter(receive=r, product=product)
-                    if receive_detail.all().count() > 0:
-                        amount -= receive_detail[0].amount
 
+        # 如果该应收帐款有其他对应收款，列出收款单单号
+        receive_ids = list(Receive.objects.filter(receivable_id__in=receivable_ids, is_active=True)
+                           .order_by('id').values_list('id', flat=True))
+        if receive_ids:
+            return_dict['msg'] = u'此应收帐款已有对应收款单，收款单单号如下：' + ''.join(' ' + str(i) for i in receive_ids)
+
+        for receivable_id, product_id, title, amount, currency_id, rate in outstanding_receivables(receivable_ids):
             if amount != 0:
-                product_info = {'id': product.id, 'title': product.title}
-                product_dict = {'product': product_info, 'amount': amount, 'currency': currency.id, 'rate': rate}
+                product_info = {'id': product_id, 'title': title}
+                product_dict = {'product': product_info, 'amount': amount, 'currency': currency_id, 'rate': rate}
                 return_dict['receivables'].append(product_dict)
     else:
         return_dict['code'] = 1
@@ -39,39 +37,96 @@ def receivable_ajax_detail_list(request):
     return JsonResponse(return_dict)
 
 
+"""
+应付帐款未付金额，付款单选择对应应付帐款时使用
+未付金额 = 应付金额 - 有效付款单(付款金额 + 折扣)合计，查询次数固定，与付款单笔数无关
+"""
 def due_ajax_detail_list(request):
     return_dict = {}
     #判断使用者是否有权限检视应付帐款
     if request.user.has_perm('finance.view_due'):
-        due_id = request.GET.get('id')
-        due = Due.objects.get(id=due_id)
+        due_ids = _parse_ids(request.GET.get('id'))
         return_dict['code'] = 0
         return_dict['msg'] = ''
         return_dict['dues'] = []
-        due_details = DueDetail.objects.filter(due=due)
-
-        for d in due_details.all():
-            material = d.material
-            amount = d.amount
-            currency = d.currency
-            rate = currency.rate
-
-            # 如果该应付帐款有其他对应付款，则需扣掉已付款的金额
-            other_pays = Pay.objects.filter(due=due, is_active=True)
-            if other_pays.count() > 0:
-                return_dict['msg'] = u'此应付帐款已有对应付款单，付款单号如下：'
-                for p in other_pays.all():
-                    return_dict['msg'] += ' ' + str(p.id)
-                    pay_detail = PayDetail.objects.filter(pay=p, material=material)
-                    if pay_detail.all().count() > 0:
-                        amount -= pay_detail[0].amount
 
+        # 如果该应付帐款有其他对应付款，列出付款单单号
+        pay_ids = list(Pay.objects.filter(due_id__in=due_ids, is_active=True).order_by('id').values_list('id', flat=True))
+        if pay_ids:
+            return_dict['msg'] = u'此应付帐款已有对应付款单，付款单号如下：' + ''.join(' ' + str(i) for i in pay_ids)
+
+        for due_id, material_id, title, amount, currency_id, rate in outstanding_dues(due_ids):
             if amount != 0:
-                material_info = {'id': material.id, 'title': material.title}
-                material_dict = {'material': material_info, 'amount': amount, 'currency': currency.id, 'rate': rate}
+                material_info = {'id': material_id, 'title': title}
+                material_dict = {'material': material_info, 'amount': amount, 'currency': currency_id, 'rate': rate}
                 return_dict['dues'].append(material_dict)
     else:
         return_dict['code'] = 1
         return_dict['msg'] = u"您无权限浏览应付帐款"
     return JsonResponse(return_dict)
 
+
+"""
+多笔应收/应付帐款的未收/未付金额，供收付款画面一次显示整个客户/供货商的余额
+1.ids为应收/应付帐款id(以逗号分隔)，或customer/supplier为客户/供货商id(该客户/供货商所有有效且未全部收付的帐款)
+2.每笔帐款回传单身未收/未付金额(items)与依币别合计的余额(totals)
+"""
+def _outstanding_list(request, header_model, partner_field, outstanding, item_name):
+    if request.GET.get('ids'):
+        headers = header_model.objects.filter(id__in=_parse_ids(request.GET.get('ids')))
+    else:
+        headers = header_model.objects.filter(**{partner_field + '_id': int(request.GET.get(partner_field) or 0),
+                                                 'is_active': True}).exclude(status='A')
+    headers = headers.order_by('id').values('id', partner_field + '_id', partner_field + '__title', 'status')
+
+    results = {}
+    for header in headers:
+        results[header['id']] = {'id': header['id'], 'partner': {'id': header[partner_field + '_id'],
+                                                                  'title': header[partner_field + '__title']},
+                                 'status': header['status'], 'items': [], 'totals': {}}
+
+    for header_id, item_id, title, amount, currency_id, rate in outstanding(list(results)):
+        result = results[header_id]
+        if amount != 0:
+            result['items'].append({item_name: {'id': item_id, 'title': title}, 'amount': amount,
+                                    'currency': currency_id, 'rate': rate})
+        result['totals'][currency_id] = result['totals'].get(currency_id, 0) + amount
+    return list(results.values())
+
+
+#未传ids时customer/supplier必须是数字
+def _partner_id_valid(request, partner_field):
+    return bool(request.GET.get('ids')) or (request.GET.get(partner_field) or '0').isdigit()
+
+
+def receivable_ajax_outstanding(request):
+    return_dict = {}
+    #判断使用者是否有权限检视应收帐款
+    if not request.user.has_perm('finance.view_receivable'):
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限浏览应收帐款"
+    elif not _partner_id_valid(request, 'customer'):
+        return_dict['code'] = 1
+        return_dict['msg'] = u'客户id格式错误'
+    else:
+        return_dict['code'] = 0
+        return_dict['msg'] = ''
+        return_dict['receivables'] = _outstanding_list(request, Receivable, 'customer', outstanding_receivables,
+                                                       'product')
+    return JsonResponse(return_dict)
+
+
+def due_ajax_outstanding(request):
+    return_dict = {}
+    #判断使用者是否有权限检视应付帐款
+    if not request.user.has_perm('finance.view_due'):
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限浏览应付帐款"
+    elif not _partner_id_valid(request, 'supplier'):
+        return_dict['code'] = 1
+        return_dict['msg'] = u'供货商id格式错误'
+    else:
+        return_dict['code'] = 0
+        return_dict['msg'] = ''
+        return_dict['dues'] = _outstanding_list(request, Due, 'supplier', outstanding_dues, 'material')
+    return JsonResponse(return_dict)
@@ -1,11 +1,20 @@
 from django import forms
 from django.contrib import admin
-from .models import Mcheck, McheckDetail, Mtran, Pcheck, PcheckDetail, Process, ProcessDetail, Ptran
-from basic.models import Product
-
-class MtranAdmin(admin.ModelAdmin):
+from django.contrib.admin.widgets import AdminDateWidget
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import Mcheck, McheckDetail, Msnapshot, Mtran, Pcheck, PcheckDetail, Process, ProcessDetail, Psnapshot, Ptran
+from .stock import StockShortageMixin, material_stock_at, post_material_stock, post_product_stock, product_stock_at
+from basic.autocomplete import AutocompleteFilterMixin, AutocompleteListFilter, AutocompleteSourcesMixin
+from basic.changelist import KeysetPaginationMixin
+from basic.models import Material, Product
+from basic.numbering import NumberedInlineFormSet
+
+class MtranAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ['id', 'material', 'source_form', 'source_id', 'from_quantity', 'tran_quantity',
                     'to_quantity', 'created', 'create_user']
+    list_select_related = ['material', 'create_user']
     list_filter = ['material']
     view_on_site = False
     list_per_page = 10
@@ -16,9 +25,10 @@ class MtranAdmin(admin.ModelAdmin):
 admin.site.register(Mtran, MtranAdmin)
 
 
-class PtranAdmin(admin.ModelAdmin):
+class PtranAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ['id', 'product', 'source_form', 'source_id', 'from_quantity', 'tran_quantity',
                     'to_quantity', 'created', 'create_user']
+    list_select_related = ['product', 'create_user']
     list_filter = ['product']
     view_on_site = False
     list_per_page = 10
@@ -29,6 +39,85 @@ class PtranAdmin(admin.ModelAdmin):
 admin.site.register(Ptran, PtranAdmin)
 
 
+class StockAtForm(forms.Form):
+    item_id = forms.IntegerField(label='id', min_value=1)
+    day = forms.DateField(label=u'日期', widget=AdminDateWidget)
+
+
+"""
+库存结存只能由stock_snapshot指令建立，后台仅供查询
+并提供"查询某日库存"页面：由最近一笔结存加上之后的库存异动计算
+"""
+class SnapshotAdmin(admin.ModelAdmin):
+    change_list_template = 'admin/inventory/snapshot_change_list.html'
+    view_on_site = False
+    list_per_page = 10
+    list_max_show_all = 100
+    date_hierarchy = 'closed'
+    item_model = None
+    stock_at = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            path('stock-at/', self.admin_site.admin_view(self.stock_at_view), name='%s_%s_stock_at' % info),
+        ]
+        return urls + super().get_urls()
+
+    def stock_at_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        result = None
+        form = StockAtForm(request.GET or None)
+        form.fields['item_id'].label = self.item_model._meta.verbose_name + ' id'
+        if form.is_valid():
+            item = self.item_model.objects.filter(id=form.cleaned_data['item_id']).first()
+            if item is None:
+                form.add_error('item_id', u'{}不存在'.format(self.item_model._meta.verbose_name))
+            else:
+                day = form.cleaned_data['day']
+                result = {'item': item, 'day': day, 'stock': self.stock_at(item.id, day)}
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title=u'查询某日{}库存'.format(self.item_model._meta.verbose_name),
+            opts=self.model._meta,
+            form=form,
+            result=result,
+            media=self.media + form.media,
+        )
+        return TemplateResponse(request, 'admin/inventory/stock_at.html', context)
+
+
+class MsnapshotAdmin(SnapshotAdmin):
+    list_display = ['id', 'material', 'closed', 'quantity', 'created']
+    list_select_related = ['material']
+    list_filter = ['material']
+    item_model = Material
+    stock_at = staticmethod(material_stock_at)
+
+
+admin.site.register(Msnapshot, MsnapshotAdmin)
+
+
+class PsnapshotAdmin(SnapshotAdmin):
+    list_display = ['id', 'product', 'closed', 'quantity', 'created']
+    list_select_related = ['product']
+    list_filter = ['product']
+    item_model = Product
+    stock_at = staticmethod(product_stock_at)
+
+
+admin.site.register(Psnapshot, PsnapshotAdmin)
+
+
 """
 原料库存异动申请单单身检查
 1.最少要有一个单身
@@ -36,7 +125,7 @@ admin.site.register(Ptran, PtranAdmin)
 3.单身异动数量不得为0
 4.单身原料异动后的库存数量不得小于0
 """
-class McheckDetailCheckInlineFormset(forms.models.BaseInlineFormSet):
+class McheckDetailCheckInlineFormset(NumberedInlineFormSet):
     def clean(self):
         count = 0
         material_list = []
@@ -71,8 +160,9 @@ class McheckDetailInline(admin.TabularInline):
     extra = 0
 
 
-class McheckAdmin(admin.ModelAdmin):
+class McheckAdmin(StockShortageMixin, admin.ModelAdmin):
     list_display = ['id', 'is_active', 'description', 'created', 'create_user']
+    list_select_related = ['create_user']
     fields = ['description']
     inlines = [McheckDetailInline]
     view_on_site = False
@@ -87,26 +177,9 @@ class McheckAdmin(admin.ModelAdmin):
 
         mcheck = form.save(commit=False)
 
+        #新增原料库存异动并异动原料库存量
         mcheck_details = McheckDetail.objects.filter(mcheck=mcheck)
-        for mcheck_detail in mcheck_details.all():
-            #新增原料库存异动
-            material = mcheck_detail.material
-            stock = material.stock
-            tran_quantity = mcheck_detail.quantity
-
-            mtran = Mtran()
-            mtran.material = material
-            mtran.source_form = 'MCHECK'
-            mtran.source_id = mcheck.id
-            mtran.from_quantity = stock
-            mtran.tran_quantity = tran_quantity
-            mtran.to_quantity = stock + tran_quantity
-            mtran.create_user = request.user
-            mtran.save()
-
-            #异动原料库存量
-            material.stock = stock + tran_quantity
-            material.save()
+        post_material_stock('MCHECK', mcheck.id, mcheck_details.values_list('material_id', 'quantity'), request.user)
 
         #如果没有发生错误则修改原料库存异动申请单状态
         mcheck.is_active = True
@@ -123,7 +196,7 @@ admin.site.register(Mcheck, McheckAdmin)
 3.单身异动数量不得为0
 4.单身商品异动后的库存数量不得小于0
 """
-class PcheckDetailCheckInlineFormset(forms.models.BaseInlineFormSet):
+class PcheckDetailCheckInlineFormset(NumberedInlineFormSet):
     def clean(self):
         count = 0
         product_list = []
@@ -158,8 +231,9 @@ class PcheckDetailInline(admin.TabularInline):
     extra = 0
 
 
-class PcheckAdmin(admin.ModelAdmin):
+class PcheckAdmin(StockShortageMixin, admin.ModelAdmin):
     list_display = ['id', 'is_active', 'description', 'created', 'create_user']
+    list_select_related = ['create_user']
     fields = ['description']
     inlines = [PcheckDetailInline]
     view_on_site = False
@@ -174,26 +248,9 @@ class PcheckAdmin(admin.ModelAdmin):
 
         pcheck = form.save(commit=False)
 
+        #新增商品库存异动并异动商品库存量
         pcheck_details = PcheckDetail.objects.filter(pcheck=pcheck)
-        for pcheck_detail in pcheck_details.all():
-            #新增商品库存异动
-            product = pcheck_detail.product
-            stock = product.stock
-            tran_quantity = pcheck_detail.quantity
-
-            ptran = Ptran()
-            ptran.product = product
-            ptran.source_form = 'PCHECK'
-            ptran.source_id = pcheck.id
-            ptran.from_quantity = stock
-            ptran.tran_quantity = tran_quantity
-            ptran.to_quantity = stock + tran_quantity
-            ptran.create_user = request.user
-            ptran.save()
-
-            #异动商品库存量
-            product.stock = stock + tran_quantity
-            product.save()
+        post_product_stock('PCHECK', pcheck.id, pcheck_details.values_list('product_id', 'quantity'), request.user)
 
         #如果没有发生错误则修改商品库存异动申请单状态
         pcheck.is_active = True
@@ -207,7 +264,7 @@ admin.site.register(Pcheck, PcheckAdmin)
 制程单单身检查
 1.最少要有一个单身
 """
-class ProcessDetailCheckInlineFormset(forms.models.BaseInlineFormSet):
+class ProcessDetailCheckInlineFormset(NumberedInlineFormSet):
     def clean(self):
         count = 0
         product_list = []
@@ -227,13 +284,16 @@ class ProcessDetailInline(admin.TabularInline):
     extra = 0
 
 
-class ProcessAdmin(admin.ModelAdmin):
+class ProcessAdmin(AutocompleteSourcesMixin, AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ['id', 'order', 'product', 'quantity', 'description', 'status', 'claimed',
                     'receipted', 'created', 'create_user']
+    list_select_related = ['order', 'product', 'create_user']
     fields = ['order', 'product', 'quantity', 'description']
+    autocomplete_sources = {'order': 'unshipped_order'}
     inlines = [ProcessDetailInline]
     view_on_site = False
-    list_filter = ['order', 'product', 'status']
+    list_filter = [('order', AutocompleteListFilter.using('order')), ('product', AutocompleteListFilter.using('product')),
+                   'status']
 
     def save_model(self, request, obj, form, change):
         if not change:
@@ -0,0 +1,94 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Sum
+from basic.bom import BomCycle, BomGraph
+from basic.bulk import BULK_BATCH_SIZE, number_lines
+from basic.models import Material
+from basic.status import in_chunks
+from sale.models import Order, OrderProduct
+from .models import Process, ProcessDetail
+
+#尚未领料的制程单，单身原料已预定但尚未扣库存
+RESERVED_PROCESS_STATUS = ['A']
+
+
+"""
+整批商品的原料需求与可用量比较，回传缺料的原料[{'id', 'title', 'required', 'available'}]
+可用量 = 库存量 - 其他尚未领料的制程单已预定的数量
+"""
+def material_shortages(requirements):
+    reserved = {}
+    stocks = {}
+    for ids in in_chunks(sorted(requirements)):
+        reserved.update(ProcessDetail.objects.filter(process__status__in=RESERVED_PROCESS_STATUS, material_id__in=ids)
+                        .order_by().values_list('material_id').annotate(Sum('quantity')))
+        stocks.update((m[0], m[1:]) for m in Material.objects.filter(id__in=ids).values_list('id', 'title', 'stock'))
+
+    shortages = []
+    for material_id in sorted(requirements):
+        title, stock = stocks[material_id]
+        available = stock - reserved.get(material_id, 0)
+        if requirements[material_id] > available:
+            shortages.append({'id': material_id, 'title': title, 'required': requirements[material_id],
+                              'available': available})
+    return shortages
+
+
+"""
+依订单一次产生所有商品的制程单：
+1.锁定订单，订单必须有效且尚未出货，已有制程单的商品不再产生，同一商品有多笔单身时合并为一张制程单
+2.整个BOM表一个查询，在内存中展开每个商品的末阶原料，单身数量 = 每单位用量 * 订单数量
+3.整批原料需求合计后一次检查可用量，任何错误(包含所有缺料)以一个ValidationError抛出，不写入任何资料
+4.以bulk_create写入制程单单头与单身
+回传新增的制程单
+"""
+def generate_processes(order, user):
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(id=order.id)
+        if not order.is_active or order.status != 'N':
+            raise ValidationError(u'订单[{}]已终止或已出货，无法产生制程单。'.format(order.pi_no))
+
+        existing = set(Process.objects.filter(order=order).values_list('product_id', flat=True))
+        quantities = {}
+        for product_id, quantity in OrderProduct.objects.filter(order=order).order_by('id')\
+                .values_list('product_id', 'quantity'):
+            if product_id not in existing:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+        lines = [(product_id, quantity) for product_id, quantity in quantities.items() if quantity > 0]
+        if not lines:
+            raise ValidationError(u'订单[{}]的商品都已有制程单。'.format(order.pi_no))
+
+        graph = BomGraph.load()
+        errors = []
+        plans = []
+        requirements = {}
+        for product_id, quantity in lines:
+            try:
+                materials = graph.unit_materials(product_id)
+            except BomCycle as e:
+                errors.append(str(e))
+                continue
+            if not materials:
+                errors.append(u'商品[{}]没有BOM表。'.format(product_id))
+                continue
+            plans.append((product_id, quantity, materials))
+            for material_id, unit_quantity in materials.items():
+                requirements[material_id] = requirements.get(material_id, 0) + unit_quantity * quantity
+
+        for shortage in material_shortages(requirements):
+            errors.append(u'原料[{id}-{title}]需求 {required}，可用量只有 {available}。'.format(**shortage))
+        if errors:
+            raise ValidationError(errors)
+
+        Process.objects.bulk_create([Process(order=order, product_id=product_id, quantity=quantity, create_user=user)
+                                     for product_id, quantity, materials in plans], batch_size=BULK_BATCH_SIZE)
+        processes = dict((process.product_id, process) for process
+                         in Process.objects.filter(order=order, product_id__in=[plan[0] for plan in plans]))
+        details = []
+        for product_id, quantity, materials in plans:
+            process_details = [ProcessDetail(process=processes[product_id], material_id=material_id,
+                                             quantity=unit_quantity * quantity)
+                               for material_id, unit_quantity in materials.items()]
+            details.extend(number_lines(process_details, []))
+        ProcessDetail.objects.bulk_create(details, batch_size=BULK_BATCH_SIZE)
+    return [processes[product_id] for product_id, quantity, materials in plans]
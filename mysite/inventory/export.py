@@ -0,0 +1,29 @@
+from basic.export import filter_date_range, iter_rows
+from .models import Mtran, Ptran
+
+TRAN_HEADER = [u'id', u'异动日期', u'料号id', u'料号', u'来源单类别', u'来源单号',
+               u'异动前数量', u'异动数量', u'异动后数量', u'异动人员']
+
+
+"""
+导出库存异动，料号名称与异动人员以join取得，不逐笔查询
+item: 原料/商品id
+source_form: 来源单类别
+"""
+def _tran_rows(tran_model, item_field, start=None, end=None, item=None, source_form=None):
+    trans = filter_date_range(tran_model.objects.all(), 'created', start, end)
+    if item:
+        trans = trans.filter(**{item_field + '_id': item})
+    if source_form:
+        trans = trans.filter(source_form=source_form)
+    fields = ['id', 'created', item_field + '_id', item_field + '__title', 'source_form', 'source_id',
+              'from_quantity', 'tran_quantity', 'to_quantity', 'create_user__username']
+    return TRAN_HEADER, iter_rows(trans, fields)
+
+
+def mtran_rows(**filters):
+    return _tran_rows(Mtran, 'material', **filters)
+
+
+def ptran_rows(**filters):
+    return _tran_rows(Ptran, 'product', **filters)
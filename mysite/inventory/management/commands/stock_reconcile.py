@@ -0,0 +1,125 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import IntegerField, Q, Sum
+from basic.models import Material, Product
+from basic.status import set_lines
+from inventory.models import Mtran, Ptran
+
+KINDS = {
+    'material': (Material, Mtran, 'material_id', u'原料'),
+    'product': (Product, Ptran, 'product_id', u'商品'),
+}
+
+
+"""
+核对库存：
+1.依id分批读取原料/商品，每批以一个group by查询合计库存异动数量，与库存量(stock)比对
+2.同一批原料/商品的库存异动依(原料/商品, 异动日期, id)顺序分页读取，检查异动前/异动后数量是否连续
+  i.第一笔异动前数量必须为0
+ ii.每一笔异动前数量必须等于上一笔异动后数量
+iii.每一笔异动后数量必须等于异动前数量加上异动数量
+3.指定--repair时，锁定有差异的原料/商品，重新合计后将库存量修正为库存异动合计，
+  合计为负数时库存量无法修正(库存量不得小于0)，只列出该原料/商品，需要先更正库存异动
+所有查询都以固定笔数分批进行，内存用量与数据量无关
+"""
+class Command(BaseCommand):
+    help = u'核对原料/商品库存量与库存异动合计，并检查库存异动数量是否连续'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['all', 'material', 'product'], default='all',
+                            help=u'核对原料、商品或全部')
+        parser.add_argument('--chunk-size', type=int, default=1000, help=u'每批读取笔数')
+        parser.add_argument('--repair', action='store_true', help=u'将有差异的库存量修正为库存异动合计')
+        parser.add_argument('--skip-chain', action='store_true', help=u'不检查库存异动数量是否连续')
+
+    def handle(self, *args, **options):
+        kinds = ['material', 'product'] if options['kind'] == 'all' else [options['kind']]
+        for kind in kinds:
+            item_model, tran_model, item_key, label = KINDS[kind]
+            drift_count = 0
+            skip_count = 0
+            break_count = 0
+            for items in self.iter_items(item_model, options['chunk_size']):
+                drifts = self.check_stock(tran_model, item_key, items)
+                drift_count += len(drifts)
+                for item_id, title, stock, total in drifts:
+                    self.stdout.write(u'{}[{}-{}]库存量 {} 与库存异动合计 {} 不符'.format(
+                        label, item_id, title, stock, total))
+                if drifts and options['repair']:
+                    for item_id, total in self.repair(item_model, tran_model, item_key, [d[0] for d in drifts]):
+                        skip_count += 1
+                        self.stdout.write(u'{}[{}]库存异动合计 {} 小于0，无法修正库存量'.format(label, item_id, total))
+
+                if not options['skip_chain']:
+                    for tran_id, item_id, message in self.check_chain(tran_model, item_key, items,
+                                                                      options['chunk_size']):
+                        break_count += 1
+                        self.stdout.write(u'{}[{}]库存异动[{}]{}'.format(label, item_id, tran_id, message))
+
+            repaired = u'(已修正 {} 笔)'.format(drift_count - skip_count) if options['repair'] and drift_count else ''
+            self.stdout.write(u'{}库存量不符 {} 笔{}，库存异动不连续 {} 笔'.format(
+                label, drift_count, repaired, break_count))
+
+    def iter_items(self, item_model, chunk_size):
+        last_id = 0
+        while True:
+            items = list(item_model.objects.filter(id__gt=last_id).order_by('id')
+                         .values_list('id', 'title', 'stock')[:chunk_size])
+            if not items:
+                break
+            yield items
+            last_id = items[-1][0]
+
+    def check_stock(self, tran_model, item_key, items):
+        totals = dict(tran_model.objects.filter(**{item_key + '__in': [item[0] for item in items]})
+                      .values(item_key).annotate(total=Sum('tran_quantity')).values_list(item_key, 'total'))
+        drifts = []
+        for item_id, title, stock in items:
+            total = totals.get(item_id) or 0
+            if stock != total:
+                drifts.append((item_id, title, stock, total))
+        return drifts
+
+    def check_chain(self, tran_model, item_key, items, chunk_size):
+        trans = tran_model.objects.filter(**{item_key + '__in': [item[0] for item in items]})\
+            .order_by(item_key, 'created', 'id')
+        previous_item = None
+        previous_to = 0
+        last = None
+        while True:
+            page = trans
+            if last is not None:
+                item_id, created, tran_id = last
+                page = page.filter(Q(**{item_key + '__gt': item_id}) |
+                                   Q(**{item_key: item_id, 'created__gt': created}) |
+                                   Q(**{item_key: item_id, 'created': created, 'id__gt': tran_id}))
+            rows = list(page.values_list('id', item_key, 'created', 'from_quantity', 'tran_quantity',
+                                         'to_quantity')[:chunk_size])
+            if not rows:
+                break
+
+            for tran_id, item_id, created, from_quantity, tran_quantity, to_quantity in rows:
+                if item_id != previous_item:
+                    previous_item = item_id
+                    previous_to = 0
+                if from_quantity != previous_to:
+                    yield tran_id, item_id, u'异动前数量 {} 与上一笔异动后数量 {} 不连续'.format(from_quantity, previous_to)
+                if to_quantity != from_quantity + tran_quantity:
+                    yield tran_id, item_id, u'异动后数量 {} 不等于 {} + {}'.format(to_quantity, from_quantity, tran_quantity)
+                previous_to = to_quantity
+
+            last = rows[-1][1], rows[-1][2], rows[-1][0]
+
+    """
+    修正库存量，回传库存异动合计为负数而未修正的[(原料/商品id, 合计)]
+    """
+    def repair(self, item_model, tran_model, item_key, item_ids):
+        with transaction.atomic():
+            list(item_model.objects.select_for_update().filter(id__in=item_ids).order_by('id').values_list('id'))
+            totals = dict(tran_model.objects.filter(**{item_key + '__in': item_ids})
+                          .values(item_key).annotate(total=Sum('tran_quantity')).values_list(item_key, 'total'))
+            negatives = [(item_id, totals[item_id]) for item_id in item_ids if (totals.get(item_id) or 0) < 0]
+            item_ids = [item_id for item_id in item_ids if (totals.get(item_id) or 0) >= 0]
+            set_lines(item_model, 'stock', dict((item_id, totals.get(item_id) or 0) for item_id in item_ids),
+                      IntegerField())
+        return negatives
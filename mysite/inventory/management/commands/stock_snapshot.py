@@ -0,0 +1,31 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from inventory.stock import take_material_snapshots, take_product_snapshots
+
+
+class Command(BaseCommand):
+    help = u'建立原料/商品在某一天结束时的库存结存，建议每日或每月排程执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help=u'结存日期，格式YYYY-MM-DD，默认为昨天，必须早于今天')
+        parser.add_argument('--kind', choices=['all', 'material', 'product'], default='all',
+                            help=u'结存原料、商品或全部')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                day = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(u'日期格式错误：{}'.format(options['date']))
+            #结存之后只读取结存日结束之后的异动，当天稍后过账的异动会被遗漏
+            if day >= datetime.date.today():
+                raise CommandError(u'结存日期必须早于今天：{}'.format(options['date']))
+        else:
+            day = datetime.date.today() - datetime.timedelta(days=1)
+
+        if options['kind'] in ('all', 'material'):
+            count = take_material_snapshots(day)
+            self.stdout.write(u'{} 原料库存结存 {} 笔'.format(day, count))
+        if options['kind'] in ('all', 'product'):
+            count = take_product_snapshots(day)
+            self.stdout.write(u'{} 商品库存结存 {} 笔'.format(day, count))
@@ -1,6 +1,7 @@
 from django.db import models
 from django.urls import reverse
 from basic.models import Material, Product
+from basic.numbering import format_num
 from sale.models import Order
 
 
@@ -22,7 +23,7 @@ class Mcheck(models.Model):
 
 
 class McheckDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     mcheck = models.ForeignKey(Mcheck, verbose_name=u'原料库存异动申请单', on_delete=models.CASCADE)
     material = models.ForeignKey(Material, verbose_name=u'原料', on_delete=models.PROTECT,
                                  limit_choices_to={'status': 'A'},)
@@ -31,10 +32,9 @@ class McheckDetail(models.Model):
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             mcheck_details = McheckDetail.objects.filter(mcheck=self.mcheck)
-            num = "{0:02d}".format(mcheck_details.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(mcheck_details.count() + 1)
 
         super().save(*args, **kwargs)
 
@@ -64,7 +64,7 @@ class Pcheck(models.Model):
 
 
 class PcheckDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     pcheck = models.ForeignKey(Pcheck, verbose_name=u'商品库存异动申请单', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, verbose_name=u'商品', on_delete=models.PROTECT,
                                  limit_choices_to={'status': 'A'},)
@@ -73,10 +73,9 @@ class PcheckDetail(models.Model):
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             pcheck_details = PcheckDetail.objects.filter(pcheck=self.pcheck)
-            num = "{0:02d}".format(pcheck_details.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(pcheck_details.count() + 1)
 
         super().save(*args, **kwargs)
 
@@ -122,23 +121,25 @@ class Process(models.Model):
     class Meta:
         verbose_name = '制程单'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['product', 'status']),
+        ]
         permissions = (
             ('check_process', '可确认制程单内商品与原料的出入库'),
         )
 
 
 class ProcessDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     process = models.ForeignKey(Process, verbose_name=u'制程单', on_delete=models.CASCADE)
     material = models.ForeignKey(Material, verbose_name=u'原料', on_delete=models.PROTECT)
     quantity = models.PositiveIntegerField(verbose_name=u'数量')
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             process_details = ProcessDetail.objects.filter(process=self.process)
-            num = "{0:02d}".format(process_details.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(process_details.count() + 1)
 
         super().save(*args, **kwargs)
 
@@ -177,6 +178,11 @@ class Mtran(models.Model):
     class Meta:
         verbose_name = '原料库存异动'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['material', 'created']),
+            models.Index(fields=['source_form', 'source_id']),
+            models.Index(fields=['created', 'id']),
+        ]
 
 
 PTRAIN_FORM_CHOICES = (
@@ -206,3 +212,38 @@ class Ptran(models.Model):
     class Meta:
         verbose_name = '商品库存异动'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['product', 'created']),
+            models.Index(fields=['source_form', 'source_id']),
+            models.Index(fields=['created', 'id']),
+        ]
+
+
+class Msnapshot(models.Model):
+    material = models.ForeignKey(Material, verbose_name=u'原料', on_delete=models.CASCADE)
+    closed = models.DateField(verbose_name=u'结存日期', help_text=u'该日结束时的库存数量')
+    quantity = models.PositiveIntegerField(default=0, verbose_name=u'结存数量')
+    created = models.DateTimeField(auto_now=True, verbose_name=u'建立时间')
+
+    def __str__(self):
+        return '{}'.format(self.id)
+
+    class Meta:
+        verbose_name = '原料库存结存'
+        verbose_name_plural = verbose_name
+        unique_together = (('material', 'closed'),)
+
+
+class Psnapshot(models.Model):
+    product = models.ForeignKey(Product, verbose_name=u'商品', on_delete=models.CASCADE)
+    closed = models.DateField(verbose_name=u'结存日期', help_text=u'该日结束时的库存数量')
+    quantity = models.PositiveIntegerField(default=0, verbose_name=u'结存数量')
+    created = models.DateTimeField(auto_now=True, verbose_name=u'建立时间')
+
+    def __str__(self):
+        return '{}'.format(self.id)
+
+    class Meta:
+        verbose_name = '商品库存结存'
+        verbose_name_plural = verbose_name
+        unique_together = (('product', 'closed'),)
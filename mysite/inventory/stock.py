@@ -0,0 +1,160 @@
+import datetime
+from django.contrib import messages
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Sum, Value, When
+from django.http import HttpResponseRedirect
+from basic.models import Material, Product
+from basic.status import CASE_CHUNK_SIZE, in_chunks
+from .models import Msnapshot, Mtran, Psnapshot, Ptran
+
+BULK_BATCH_SIZE = 500
+
+
+class StockShortage(Exception):
+    def __init__(self, item_id, title, stock, quantity):
+        self.item_id = item_id
+        self.title = title
+        self.stock = stock
+        self.quantity = quantity
+        super().__init__(u'[{}-{}]库存量只有{}，不足异动量{}'.format(item_id, title, stock, quantity))
+
+
+"""
+库存过账，一张单据的所有单身一次处理：
+1.依id顺序分批锁定所有相关的原料/商品(select_for_update)，避免并发过账互相覆盖或死锁
+2.在内存中依单身顺序计算每笔异动的异动前/异动后数量，库存不足则抛出StockShortage
+3.以UPDATE语句在数据库端加减库存量(stock = stock + 异动量)，每CASE_CHUNK_SIZE个原料/商品一个语句
+4.以bulk_create一次写入所有库存异动(Mtran/Ptran)
+lines为(原料或商品id, 异动数量)的列表，异动数量为正表示增加库存，为负表示减少库存
+必须在同一个交易中完成，呼叫端如果还有其他写入，应该包在同一个transaction.atomic()中
+"""
+def _post_stock(item_model, tran_model, item_field, source_form, source_id, lines, user):
+    lines = [(int(item_id), int(quantity)) for item_id, quantity in lines]
+    if not lines:
+        return []
+
+    item_ids = sorted(set(item_id for item_id, quantity in lines))
+    with transaction.atomic():
+        stocks = {}
+        titles = {}
+        for ids in in_chunks(item_ids):
+            locked_items = item_model.objects.select_for_update().filter(id__in=ids).order_by('id')
+            for item_id, title, stock in locked_items.values_list('id', 'title', 'stock'):
+                stocks[item_id] = stock
+                titles[item_id] = title
+
+        trans = []
+        deltas = {}
+        for item_id, quantity in lines:
+            stock = stocks[item_id]
+            if stock + quantity < 0:
+                raise StockShortage(item_id, titles[item_id], stock, 0 - quantity)
+
+            tran = tran_model(source_form=source_form, source_id=source_id, from_quantity=stock,
+                              tran_quantity=quantity, to_quantity=stock + quantity, create_user=user)
+            setattr(tran, item_field + '_id', item_id)
+            trans.append(tran)
+
+            stocks[item_id] = stock + quantity
+            deltas[item_id] = deltas.get(item_id, 0) + quantity
+
+        changed_ids = [item_id for item_id in item_ids if deltas[item_id] != 0]
+        for ids in in_chunks(changed_ids, CASE_CHUNK_SIZE):
+            whens = [When(id=item_id, then=Value(deltas[item_id])) for item_id in ids]
+            item_model.objects.filter(id__in=ids).update(
+                stock=F('stock') + Case(*whens, default=Value(0), output_field=IntegerField()))
+
+        tran_model.objects.bulk_create(trans, batch_size=BULK_BATCH_SIZE)
+    return trans
+
+
+"""
+管理界面存盘时过账库存的单据使用，表单检查后到过账之间库存被其他单据扣减时会抛出StockShortage，
+此时整张单据回滚(changeform_view在交易中执行)，以错误讯息回到原画面，不显示500错误
+"""
+class StockShortageMixin:
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except StockShortage as e:
+            messages.error(request, u'{}，单据未存盘，请重新填写。'.format(e))
+            return HttpResponseRedirect(request.get_full_path())
+
+
+def post_material_stock(source_form, source_id, lines, user):
+    return _post_stock(Material, Mtran, 'material', source_form, source_id, lines, user)
+
+
+def post_product_stock(source_form, source_id, lines, user):
+    return _post_stock(Product, Ptran, 'product', source_form, source_id, lines, user)
+
+
+def _day_end(day):
+    return datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min)
+
+
+"""
+查询某一天结束时的库存数量：
+1.找到该日(含)之前最近一笔结存(Msnapshot/Psnapshot)
+2.加上结存日之后到该日结束之间的库存异动数量合计
+没有结存时从第一笔库存异动开始累加，所以结存越密，需要读取的库存异动越少
+"""
+def _stock_at(tran_model, snapshot_model, item_field, item_id, day):
+    item_filter = {item_field + '_id': item_id}
+    snapshot = snapshot_model.objects.filter(closed__lte=day, **item_filter)\
+        .order_by('-closed').values_list('closed', 'quantity').first()
+
+    trans = tran_model.objects.filter(created__lt=_day_end(day), **item_filter)
+    quantity = 0
+    if snapshot is not None:
+        closed, quantity = snapshot
+        trans = trans.filter(created__gte=_day_end(closed))
+    return quantity + (trans.aggregate(total=Sum('tran_quantity'))['total'] or 0)
+
+
+def material_stock_at(material_id, day):
+    return _stock_at(Mtran, Msnapshot, 'material', material_id, day)
+
+
+def product_stock_at(product_id, day):
+    return _stock_at(Ptran, Psnapshot, 'product', product_id, day)
+
+
+"""
+建立某一天结束时所有原料/商品的库存结存：
+1.找到该日之前最近一次结存的日期，读出该次所有结存数量
+2.以一个group by查询合计上次结存日之后到该日结束之间每个原料/商品的库存异动数量
+3.删除该日已有的结存(可重复执行)，再以bulk_create写入新的结存
+day必须是已经结束的日期，结存日当天稍后写入的异动不会计入任何时点的库存
+"""
+def _take_snapshots(item_model, tran_model, snapshot_model, item_field, day):
+    item_key = item_field + '_id'
+    previous = snapshot_model.objects.filter(closed__lt=day).aggregate(closed=Max('closed'))['closed']
+
+    quantities = dict.fromkeys(item_model.objects.values_list('id', flat=True), 0)
+    trans = tran_model.objects.filter(created__lt=_day_end(day))
+    if previous is not None:
+        quantities.update(snapshot_model.objects.filter(closed=previous).values_list(item_key, 'quantity'))
+        trans = trans.filter(created__gte=_day_end(previous))
+
+    for item_id, total in trans.values(item_key).annotate(total=Sum('tran_quantity')).values_list(item_key, 'total'):
+        quantities[item_id] = quantities.get(item_id, 0) + total
+
+    snapshots = []
+    for item_id, quantity in quantities.items():
+        snapshot = snapshot_model(closed=day, quantity=quantity)
+        setattr(snapshot, item_key, item_id)
+        snapshots.append(snapshot)
+
+    with transaction.atomic():
+        snapshot_model.objects.filter(closed=day).delete()
+        snapshot_model.objects.bulk_create(snapshots, batch_size=BULK_BATCH_SIZE)
+    return len(snapshots)
+
+
+def take_material_snapshots(day):
+    return _take_snapshots(Material, Mtran, Msnapshot, 'material', day)
+
+
+def take_product_snapshots(day):
+    return _take_snapshots(Product, Ptran, Psnapshot, 'product', day)
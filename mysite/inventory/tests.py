@@ -1,3 +1,306 @@
+import datetime
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from basic.models import Bom, Category, Currency, Customer, Material, Period, Product, Size, Supplier
+from basic.testing import QueryPlanMixin
+from sale.models import Order, OrderProduct
+from .bulk import generate_processes
+from .models import Mcheck, McheckDetail, Msnapshot, Mtran, Process, ProcessDetail, Psnapshot, Ptran
+from .stock import (StockShortage, material_stock_at, post_material_stock, post_product_stock, product_stock_at,
+                    take_material_snapshots)
 
-# Create your tests here.
+
+class LedgerQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_mtran_by_material_and_created(self):
+        self.assertUsesIndex(Mtran.objects.filter(material_id=1).order_by('-created'))
+        self.assertUsesIndex(Mtran.objects.filter(material_id=1, created__gte='2019-01-01'))
+
+    def test_ptran_by_product_and_created(self):
+        self.assertUsesIndex(Ptran.objects.filter(product_id=1).order_by('-created'))
+        self.assertUsesIndex(Ptran.objects.filter(product_id=1, created__gte='2019-01-01'))
+
+    def test_ledger_by_source(self):
+        self.assertUsesIndex(Mtran.objects.filter(source_form='ARRIVE', source_id=1))
+        self.assertUsesIndex(Ptran.objects.filter(source_form='SHIP', source_id=1))
+
+    def test_keyset_page_by_created(self):
+        self.assertUsesIndex(Mtran.objects.filter(created__lte='2019-01-01').order_by('-created', '-id'))
+        self.assertUsesIndex(Ptran.objects.filter(product_id=1, created__lte='2019-01-01').order_by('-created', '-id'))
+
+    def test_snapshot_by_item_and_closed(self):
+        self.assertUsesIndex(Msnapshot.objects.filter(material_id=1, closed__lte='2019-01-01').order_by('-closed'))
+        self.assertUsesIndex(Psnapshot.objects.filter(product_id=1, closed__lte='2019-01-01').order_by('-closed'))
+
+
+class ProcessQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_open_processes_by_product(self):
+        self.assertUsesIndex(Process.objects.filter(product_id__in=[1, 2], status__in=['A', 'C']))
+
+
+class BomFixtureMixin:
+    def setUp(self):
+        rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        self.period = Period.objects.create(title=u'月结30天', period=30)
+        supplier = Supplier.objects.create(title='S', period=self.period, status='A')
+        defaults = {'image_sub': '-', 'price': 1, 'tax': 0, 'tax_price': 1, 'currency': rmb}
+        self.material = Material.objects.create(title='M1', supplier=supplier, stock=100,
+                                                category=Category.objects.create(title='C', status='A'), **defaults)
+        self.product = Product.objects.create(title='P1', size=Size.objects.create(title='Z', status='A'), **defaults)
+        self.bom = Bom.objects.create(product=self.product, material=self.material, quantity=3)
+        self.user = User.objects.create_superuser('user', 'user@example.com', 'user')
+        self.client.force_login(self.user)
+
+
+class StockPostingTests(BomFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Material.objects.create(title='M0', supplier=self.material.supplier, stock=5,
+                                             category=self.material.category, image_sub='-', price=1, tax=0,
+                                             tax_price=1, currency_id='RMB')
+
+    def test_ledger_rows_and_stock(self):
+        post_material_stock('MCHECK', 7, [(self.material.id, -30), (self.other.id, 10), (self.material.id, 5)],
+                            self.user)
+        self.assertEqual(list(Mtran.objects.order_by('id').values_list(
+            'material_id', 'source_form', 'source_id', 'from_quantity', 'tran_quantity', 'to_quantity')),
+            [(self.material.id, 'MCHECK', 7, 100, -30, 70), (self.other.id, 'MCHECK', 7, 5, 10, 15),
+             (self.material.id, 'MCHECK', 7, 70, 5, 75)])
+        self.assertEqual(dict(Material.objects.values_list('id', 'stock')), {self.material.id: 75, self.other.id: 15})
+
+        post_product_stock('PCHECK', 8, [(self.product.id, 4)], self.user)
+        self.assertEqual(list(Ptran.objects.values_list('source_form', 'source_id', 'from_quantity', 'to_quantity')),
+                         [('PCHECK', 8, 0, 4)])
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 4)
+
+    def test_lines_cancelling_out_leave_stock(self):
+        with CaptureQueriesContext(connection) as queries:
+            post_material_stock('MCHECK', 1, [(self.material.id, 3), (self.material.id, -3)], self.user)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')])
+        self.assertEqual(Mtran.objects.count(), 2)
+
+    def test_items_locked_in_id_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            post_material_stock('MCHECK', 1, [(self.material.id, 1), (self.other.id, 1)], self.user)
+        select = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')][0]
+        self.assertTrue(select.endswith('ORDER BY "basic_material"."id" ASC'))
+
+    def test_shortage_writes_nothing(self):
+        with self.assertRaises(StockShortage) as raised:
+            post_material_stock('MCHECK', 1, [(self.material.id, -60), (self.other.id, 1), (self.material.id, -60)],
+                                self.user)
+        self.assertEqual((raised.exception.item_id, raised.exception.stock, raised.exception.quantity),
+                         (self.material.id, 40, 60))
+        self.assertFalse(Mtran.objects.exists())
+        self.assertEqual(dict(Material.objects.values_list('id', 'stock')), {self.material.id: 100, self.other.id: 5})
+
+    def test_admin_reports_shortage_after_form_check(self):
+        #表单检查后、过账前库存被其他单据扣减
+        def race(*args):
+            Material.objects.filter(id=self.material.id).update(stock=0)
+            return post_material_stock(*args)
+
+        Material.objects.filter(id=self.material.id).update(status='A')
+        data = {'description': 'x', 'mcheckdetail_set-TOTAL_FORMS': 1, 'mcheckdetail_set-INITIAL_FORMS': 0,
+                'mcheckdetail_set-0-material': self.material.id, 'mcheckdetail_set-0-quantity': -10}
+        with mock.patch('inventory.admin.post_material_stock', race):
+            response = self.client.post('/admin/inventory/mcheck/add/', data, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(u'库存量只有0，不足异动量10', [str(m) for m in response.context['messages']][0])
+        self.assertFalse(Mcheck.objects.exists())
+        self.assertFalse(McheckDetail.objects.exists())
+        self.assertEqual(Material.objects.get(id=self.material.id).stock, 100)
+
+
+class StockAtTests(BomFixtureMixin, TestCase):
+    day = datetime.date(2019, 1, 10)
+
+    def setUp(self):
+        super().setUp()
+        #每天一笔异动：+10、-3、+5
+        for days, quantity in enumerate([10, -3, 5]):
+            post_material_stock('MCHECK', days, [(self.material.id, quantity)], self.user)
+            post_product_stock('PCHECK', days, [(self.product.id, quantity + 3)], self.user)
+            created = datetime.datetime.combine(self.day + datetime.timedelta(days=days), datetime.time(12))
+            Mtran.objects.filter(source_id=days).update(created=created)
+            Ptran.objects.filter(source_id=days).update(created=created)
+
+    def stocks(self, stock_at, item_id):
+        return [stock_at(item_id, self.day + datetime.timedelta(days=days)) for days in range(-1, 4)]
+
+    def test_without_snapshot(self):
+        self.assertEqual(self.stocks(material_stock_at, self.material.id), [0, 10, 7, 12, 12])
+        self.assertEqual(self.stocks(product_stock_at, self.product.id), [0, 13, 13, 21, 21])
+
+    def test_with_snapshot(self):
+        take_material_snapshots(self.day + datetime.timedelta(days=1))
+        self.assertEqual(Msnapshot.objects.get(material=self.material).quantity, 7)
+        #结存日之后只读取结存与其后的异动
+        Mtran.objects.filter(source_id=0).update(tran_quantity=1000)
+        self.assertEqual(self.stocks(material_stock_at, self.material.id)[2:], [7, 12, 12])
+        Psnapshot.objects.create(product=self.product, closed=self.day, quantity=50)
+        self.assertEqual(self.stocks(product_stock_at, self.product.id), [0, 50, 50, 58, 58])
+
+    def test_snapshot_command_rejects_today(self):
+        with self.assertRaises(CommandError):
+            call_command('stock_snapshot', date=datetime.date.today().strftime('%Y-%m-%d'), stdout=StringIO())
+        self.assertFalse(Msnapshot.objects.exists())
+        call_command('stock_snapshot', date='2019-01-11', kind='material', stdout=StringIO())
+        self.assertEqual(Msnapshot.objects.get(material=self.material).quantity, 7)
+
+    def test_ajax_validates_id(self):
+        url = '/inventory/stock/ajax/date/'
+        for item_id in ['', 'abc']:
+            self.assertEqual(self.client.get(url, {'id': item_id, 'date': '2019-01-11'}).json()['code'], 1)
+        response = self.client.get(url, {'kind': 'product', 'id': self.product.id, 'date': '2019-01-12'}).json()
+        self.assertEqual((response['code'], response['stock']), (0, 21))
+
+
+class StockReconcileTests(BomFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Material.objects.filter(id=self.material.id).update(stock=0)
+        post_material_stock('MCHECK', 1, [(self.material.id, 10)], self.user)
+        post_material_stock('MCHECK', 2, [(self.material.id, -3)], self.user)
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('stock_reconcile', '--kind', 'material', '--chunk-size', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_consistent_ledger(self):
+        self.assertIn(u'原料库存量不符 0 笔，库存异动不连续 0 笔', self.reconcile())
+
+    def test_drift_and_repair(self):
+        Material.objects.filter(id=self.material.id).update(stock=50)
+        output = self.reconcile()
+        self.assertIn(u'原料[{}-M1]库存量 50 与库存异动合计 7 不符'.format(self.material.id), output)
+        self.assertEqual(Material.objects.get(id=self.material.id).stock, 50)
+        self.assertIn(u'(已修正 1 笔)', self.reconcile('--repair'))
+        self.assertEqual(Material.objects.get(id=self.material.id).stock, 7)
+
+    def test_chain_break(self):
+        tran = Mtran.objects.get(source_id=2)
+        Mtran.objects.filter(id=tran.id).update(from_quantity=8)
+        output = self.reconcile('--skip-chain')
+        self.assertIn(u'库存异动不连续 0 笔', output)
+        output = self.reconcile()
+        self.assertIn(u'库存异动[{}]异动前数量 8 与上一笔异动后数量 10 不连续'.format(tran.id), output)
+        self.assertIn(u'异动后数量 7 不等于 8 + -3', output)
+        self.assertIn(u'库存异动不连续 2 笔', output)
+
+    def test_negative_total_not_repaired(self):
+        Mtran.objects.filter(source_id=1).update(tran_quantity=1)
+        output = self.reconcile('--repair', '--skip-chain')
+        self.assertIn(u'原料[{}]库存异动合计 -2 小于0，无法修正库存量'.format(self.material.id), output)
+        self.assertIn(u'原料库存量不符 1 笔(已修正 0 笔)', output)
+        self.assertEqual(Material.objects.get(id=self.material.id).stock, 7)
+
+
+class ProcessBomListTests(BomFixtureMixin, TestCase):
+    url = '/inventory/process/ajax/bom/list/'
+
+    def get(self, **headers):
+        return self.client.get(self.url, {'order_id': 0, 'product_id': self.product.id}, **headers)
+
+    def test_cached_payload_and_revalidation(self):
+        response = self.get()
+        self.assertEqual(response.json()['boms'], [{'material': {'id': self.material.id, 'title': 'M1'},
+                                                    'quantity': 3}])
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get().json()['boms'][0]['quantity'], 3)
+        self.assertFalse([q for q in queries.captured_queries if 'basic_bom' in q['sql']])
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.bom.quantity = 5
+        self.bom.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['boms'][0]['quantity'], 5)
+
+
+class GenerateProcessesTests(BomFixtureMixin, TestCase):
+    url = '/inventory/process/ajax/generate/'
+
+    def setUp(self):
+        super().setUp()
+        self.component = Product.objects.create(title='P2', size=self.product.size, image_sub='-', price=1, tax=0,
+                                                tax_price=1, currency_id='RMB')
+        Bom.objects.create(product=self.component, material=self.material, quantity=1)
+        Bom.objects.create(product=self.product, component=self.component, quantity=2)
+        customer = Customer.objects.create(title='C', period=self.period, status='A')
+        self.order = Order.objects.create(cat_id='1', pi_no='R201901001', customer=customer, etd='2019-01-31',
+                                          create_user=self.user)
+        OrderProduct.objects.create(order=self.order, product=self.product, quantity=10)
+        OrderProduct.objects.create(order=self.order, product=self.component, quantity=20)
+
+    def test_generate(self):
+        with self.assertNumQueries(11):
+            processes = generate_processes(self.order, self.user)
+        self.assertEqual([(p.product_id, p.quantity) for p in processes], [(self.product.id, 10),
+                                                                            (self.component.id, 20)])
+        self.assertEqual(list(ProcessDetail.objects.filter(process=processes[0]).values_list('num', 'quantity')),
+                         [('00001', 50)])
+        self.assertEqual(ProcessDetail.objects.get(process=processes[1]).quantity, 20)
+        with self.assertRaises(ValidationError):
+            generate_processes(self.order, self.user)
+
+    def test_duplicate_product_lines_merged(self):
+        OrderProduct.objects.create(order=self.order, product=self.product, quantity=5)
+        processes = generate_processes(self.order, self.user)
+        self.assertEqual([(p.product_id, p.quantity) for p in processes], [(self.product.id, 15),
+                                                                            (self.component.id, 20)])
+        self.assertEqual(Process.objects.count(), 2)
+        self.assertEqual(dict(ProcessDetail.objects.values_list('process__product_id', 'quantity')),
+                         {self.product.id: 75, self.component.id: 20})
+
+    def test_bad_order_id(self):
+        for order_id in ['', 'abc', '999']:
+            response = self.client.get(self.url, {'order_id': order_id}).json()
+            self.assertEqual(response['code'], 1)
+            self.assertEqual(response['msg'], u'订单[{}]不存在'.format(order_id))
+
+    def test_shortage_reported_for_whole_batch(self):
+        Process.objects.create(order=self.order, product=self.component, quantity=20, create_user=self.user)
+        ProcessDetail.objects.create(process=Process.objects.get(), material=self.material, quantity=60)
+        response = self.client.get(self.url, {'order_id': self.order.id})
+        self.assertEqual(response.json()['code'], 1)
+        self.assertEqual(response.json()['errors'], [u'原料[{}-M1]需求 50，可用量只有 40。'.format(self.material.id)])
+        self.assertEqual(Process.objects.count(), 1)
+
+
+class KeysetChangeListTests(BomFixtureMixin, TestCase):
+    url = '/admin/inventory/mtran/'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Mtran.objects.bulk_create([Mtran(material=self.material, source_form='MCHECK', source_id=i, tran_quantity=1,
+                                         create_user=self.user) for i in range(25)])
+
+    def test_cursor_pages_cover_every_row_once(self):
+        response = self.client.get(self.url, {'material__id__exact': self.material.id})
+        cl = response.context['cl']
+        self.assertEqual((cl.result_count, cl.previous_url), (25, None))
+        seen = [row.id for row in cl.result_list]
+        while cl.next_url:
+            with CaptureQueriesContext(connection) as queries:
+                cl = self.client.get(self.url + cl.next_url).context['cl']
+            self.assertFalse([q for q in queries.captured_queries if 'COUNT(' in q['sql']])
+            self.assertIn('material__id__exact', cl.next_url or cl.first_url)
+            seen.extend(row.id for row in cl.result_list)
+        self.assertEqual(seen, sorted(Mtran.objects.values_list('id', flat=True), reverse=True))
+
+        cl = self.client.get(self.url + cl.previous_url).context['cl']
+        self.assertEqual([row.id for row in cl.result_list], seen[10:20])
+        self.assertEqual(self.client.get(self.url, {'cursor': 'x'}).status_code, 302)
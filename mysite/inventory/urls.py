@@ -8,5 +8,9 @@ urlpatterns = [
     path('process/ajax/bom/list/', views.process_ajax_bom_list, name='process_ajax_bom_list'),
     path('process/ajax/status/', views.process_ajax_status, name='process_ajax_status'),
     path('process/ajax/claim/material/', views.process_ajax_claim_material, name='process_ajax_claim_material'),
+    path('process/ajax/generate/', views.process_ajax_generate, name='process_ajax_generate'),
     path('process/ajax/receipt/product/', views.process_ajax_receipt_product, name='process_ajax_receipt_product'),
+    path('stock/ajax/date/', views.stock_ajax_at_date, name='stock_ajax_at_date'),
+    path('mtran/export/', views.mtran_export, name='mtran_export'),
+    path('ptran/export/', views.ptran_export, name='ptran_export'),
 ]
@@ -1,6 +1,14 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
-from .models import Mtran, Ptran, Process, ProcessDetail
-from basic.models import Bom, Product
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from .bulk import generate_processes
+from .export import mtran_rows, ptran_rows
+from .models import Process, ProcessDetail
+from .stock import StockShortage, material_stock_at, post_material_stock, post_product_stock, product_stock_at
+from basic.export import export_csv
+from basic.bom import BomCycle, unit_material_payload
 from sale.models import Order, OrderProduct
 import datetime
 
@@ -34,33 +42,43 @@ def process_ajax_order_product_list(request):
     return JsonResponse(return_dict)
 
 
+"""
+制程单BOM表，BOM表展开结果依商品与BOM版本快取，订单数量每次查询
+回传ETag与Last-Modified，浏览器以If-None-Match/If-Modified-Since重新验证，内容未变时回传304
+"""
 def process_ajax_bom_list(request):
     return_dict = {}
     #判断使用者是否有权限检视制程单
     if request.user.has_perm('inventory.view_process'):
         order_id = request.GET.get('order_id')
-        order = Order.objects.get(id=order_id)
-        product_id = request.GET.get('product_id')
-        product = Product.objects.get(id=product_id)
-        boms = Bom.objects.filter(product=product)
+        product_id = int(request.GET.get('product_id'))
         return_dict['code'] = 0
         return_dict['msg'] = ''
         return_dict['boms'] = []
+        return_dict['quantity'] = OrderProduct.objects.filter(order_id=order_id, product_id=product_id)\
+            .order_by('id').values_list('quantity', flat=True).first() or 0
 
-        order_products = OrderProduct.objects.filter(order=order, product=product)
-        if order_products.count() > 0:
-            return_dict['quantity'] = order_products[0].quantity
-        else:
-            return_dict['quantity'] = 0
-
-        for b in boms.all():
-            material = b.material
-            quantity = b.quantity
-            material_info = {}
-            material_info['id'] = material.id
-            material_info['title'] = material.title
-            material_dict = {'material': material_info, 'quantity': quantity}
-            return_dict['boms'].append(material_dict)
+        #多阶BOM表展开为每单位商品的末阶原料用量，快取不存在时整个BOM表一个查询
+        try:
+            payload = unit_material_payload(product_id)
+        except BomCycle as e:
+            return_dict['code'] = 1
+            return_dict['msg'] = str(e)
+            return JsonResponse(return_dict)
+        etag = '"bom-{}-{}-{}"'.format(product_id, payload['version'], return_dict['quantity'])
+        response = get_conditional_response(request, etag=etag, last_modified=payload['built'])
+        if response is None:
+            for material_id, title, quantity in payload['materials']:
+                material_info = {}
+                material_info['id'] = material_id
+                material_info['title'] = title
+                material_dict = {'material': material_info, 'quantity': quantity}
+                return_dict['boms'].append(material_dict)
+            response = JsonResponse(return_dict)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(payload['built'])
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
     else:
         return_dict['code'] = 1
@@ -88,47 +106,33 @@ def process_ajax_claim_material(request):
     #判断使用者是否有权限检视制程单
     if request.user.has_perm('inventory.view_process'):
         process_id = request.GET.get('id')
-        process = Process.objects.get(id=process_id)
-        process_details = ProcessDetail.objects.filter(process=process)
-        if process_details.count() > 0:
-            stock_enough_bool = True
-            for process_detail in process_details:
-                quantity = process_detail.quantity
-                material = process_detail.material
-                if material.stock < quantity:
+        with transaction.atomic():
+            #锁定制程单，避免重复出库
+            process = Process.objects.select_for_update().get(id=process_id)
+            lines = list(ProcessDetail.objects.filter(process=process).values_list('material_id', 'quantity'))
+            if process.status != 'A':
+                return_dict['code'] = 1
+                return_dict['msg'] = u"该制程单原料已出库"
+            elif len(lines) > 0:
+                try:
+                    post_material_stock('PROCESS', process.id,
+                                        [(material_id, 0 - quantity) for material_id, quantity in lines],
+                                        request.user)
+                except StockShortage as e:
                     return_dict['code'] = 1
-                    return_dict['msg'] = '原料[{}-{}]库存量只有{}，不足领出量{}'.format(material.id, material.title, material.stock, quantity)
-                    stock_enough_bool = False
-
-            if stock_enough_bool:
-                for process_detail in process_details:
-                    quantity = process_detail.quantity
-                    material = process_detail.material
-
-                    mtran = Mtran()
-                    mtran.material = material
-                    mtran.source_form = 'PROCESS'
-                    mtran.source_id = process_id
-                    mtran.from_quantity = material.stock
-                    mtran.tran_quantity = 0 - quantity
-                    mtran.to_quantity = material.stock - quantity
-                    mtran.create_user = request.user
-                    mtran.save()
-
-                    material.stock = material.stock - quantity
-                    material.save()
-
-                process.status = 'C'
-                process.claimed = datetime.datetime.now()
-                process.claim_user = request.user
-                process.save()
+                    return_dict['msg'] = '原料[{}-{}]库存量只有{}，不足领出量{}'.format(e.item_id, e.title, e.stock, e.quantity)
+                else:
+                    process.status = 'C'
+                    process.claimed = datetime.datetime.now()
+                    process.claim_user = request.user
+                    process.save()
 
-                return_dict['code'] = 0
-                return_dict['msg'] = u"原料出库已确认完毕"
+                    return_dict['code'] = 0
+                    return_dict['msg'] = u"原料出库已确认完毕"
 
-        else:
-            return_dict['code'] = 1
-            return_dict['msg'] = u"该制程单无单身资料"
+            else:
+                return_dict['code'] = 1
+                return_dict['msg'] = u"该制程单无单身资料"
 
     else:
         return_dict['code'] = 1
@@ -136,38 +140,101 @@ def process_ajax_claim_material(request):
     return JsonResponse(return_dict)
 
 
+"""
+依订单一次产生所有商品的制程单，失败时回传所有错误(包含缺料)，不产生任何制程单
+"""
+def process_ajax_generate(request):
+    return_dict = {}
+    #判断使用者是否有权限新增制程单
+    if request.user.has_perm('inventory.add_process'):
+        order_id = request.GET.get('order_id') or ''
+        order = Order.objects.filter(id=order_id).first() if order_id.isdigit() else None
+        if order is None:
+            return_dict['code'] = 1
+            return_dict['msg'] = u'订单[{}]不存在'.format(order_id)
+            return JsonResponse(return_dict)
+        try:
+            processes = generate_processes(order, request.user)
+        except ValidationError as e:
+            return_dict['code'] = 1
+            return_dict['msg'] = u'无法产生制程单'
+            return_dict['errors'] = e.messages
+        else:
+            return_dict['code'] = 0
+            return_dict['msg'] = u'已产生{}张制程单'.format(len(processes))
+            return_dict['processes'] = [{'id': process.id, 'product_id': process.product_id,
+                                         'quantity': process.quantity} for process in processes]
+    else:
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限新增制程单"
+    return JsonResponse(return_dict)
+
+
 def process_ajax_receipt_product(request):
     return_dict = {}
     #判断使用者是否有权限检视制程单
     if request.user.has_perm('inventory.view_process'):
         process_id = request.GET.get('id')
-        process = Process.objects.get(id=process_id)
-        product = process.product
-        quantity = process.quantity
-
-        ptran = Ptran()
-        ptran.product = product
-        ptran.source_form = 'PROCESS'
-        ptran.source_id = process_id
-        ptran.from_quantity = product.stock
-        ptran.tran_quantity = quantity
-        ptran.to_quantity = product.stock + quantity
-        ptran.create_user = request.user
-        ptran.save()
-
-        product.stock = product.stock + quantity
-        product.save()
-
-        process.status = 'R'
-        process.receipted = datetime.datetime.now()
-        process.receipt_user = request.user
-        process.save()
+        with transaction.atomic():
+            #锁定制程单，避免重复入库
+            process = Process.objects.select_for_update().get(id=process_id)
+            if process.status != 'C':
+                return_dict['code'] = 1
+                return_dict['msg'] = u"该制程单原料尚未出库或商品已入库"
+            else:
+                post_product_stock('PROCESS', process.id, [(process.product_id, process.quantity)], request.user)
+
+                process.status = 'R'
+                process.receipted = datetime.datetime.now()
+                process.receipt_user = request.user
+                process.save()
 
-        return_dict['code'] = 0
-        return_dict['msg'] = u"商品入库已确认完毕"
+                return_dict['code'] = 0
+                return_dict['msg'] = u"商品入库已确认完毕"
 
     else:
         return_dict['code'] = 1
         return_dict['msg'] = u"您无权限浏览制程单"
     return JsonResponse(return_dict)
 
+
+def stock_ajax_at_date(request):
+    return_dict = {}
+    kind = request.GET.get('kind', 'material')
+    #判断使用者是否有权限检视库存异动
+    if kind == 'material' and request.user.has_perm('inventory.view_mtran'):
+        stock_at = material_stock_at
+    elif kind == 'product' and request.user.has_perm('inventory.view_ptran'):
+        stock_at = product_stock_at
+    else:
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限浏览库存异动"
+        return JsonResponse(return_dict)
+
+    item_id = request.GET.get('id') or ''
+    if not item_id.isdigit():
+        return_dict['code'] = 1
+        return_dict['msg'] = u'{}id格式错误'.format(u'原料' if kind == 'material' else u'商品')
+        return JsonResponse(return_dict)
+    item_id = int(item_id)
+    try:
+        day = datetime.datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return_dict['code'] = 1
+        return_dict['msg'] = u"日期格式错误，格式为YYYY-MM-DD"
+        return JsonResponse(return_dict)
+
+    return_dict['code'] = 0
+    return_dict['msg'] = ''
+    return_dict['id'] = item_id
+    return_dict['date'] = day.strftime('%Y-%m-%d')
+    return_dict['stock'] = stock_at(item_id, day)
+    return JsonResponse(return_dict)
+
+
+def mtran_export(request):
+    return export_csv(request, 'inventory.view_mtran', 'mtran', mtran_rows, filters=('item', 'source_form'))
+
+
+def ptran_export(request):
+    return export_csv(request, 'inventory.view_ptran', 'ptran', ptran_rows, filters=('item', 'source_form'))
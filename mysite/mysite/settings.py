@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'basic.metrics.QueryMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -54,6 +55,32 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# 每个视图或过账程序的查询次数上限，超过时记录警告，QUERY_BUDGET_STRICT为True时抛出例外
+# 视图以app_name:name为名称，过账程序以posting:单据为名称，统计可由/basic/metrics/检视
+QUERY_BUDGETS = {
+    'sale:order_ajax_product_list': 5,
+    'purchase:procurement_ajax_mrp': 10,
+    'inventory:stock_ajax_at_date': 5,
+    'finance:receivable_ajax_detail_list': 5,
+    'finance:due_ajax_detail_list': 5,
+    'finance:receivable_ajax_outstanding': 5,
+    'finance:due_ajax_outstanding': 5,
+    'posting:ship': 60,
+    'posting:arrive': 60,
+    'posting:receive': 30,
+    'posting:pay': 30,
+}
+QUERY_BUDGET_STRICT = False
+
+# 基本资料(币别、帐期、种类、Part、Size)快取的版本号存于共用快取，多进程部署时须改为memcached或redis等共用后端
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+# 进程内基本资料副本检查版本号的间隔(秒)
+MASTER_DATA_CHECK_INTERVAL = 1
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
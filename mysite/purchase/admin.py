@@ -1,10 +1,13 @@
 from django import forms
 from django.contrib import admin, messages
 from django.contrib.auth import get_permission_codename
-import datetime
+from django.db.models import DecimalField, F, IntegerField
 from .models import Arrive, ArriveDetail, Procurement, ProcurementMaterial
-from finance.models import Due, DueDetail
-from inventory.models import Mtran
+from .posting import post_arrive
+from .status import rebuild_procurement_lines
+from basic.autocomplete import AutocompleteSourcesMixin
+from basic.changelist import KeysetPaginationMixin, detail_sum, remaining_quantity
+from basic.numbering import NumberedInlineFormSet
 
 """
 采购单单身检查
@@ -13,7 +16,7 @@ from inventory.models import Mtran
 3.原料数量是否是否至少一笔大于0
 4.原料数量不得是负数
 """
-class ProcurementMaterialCheckInlineFormset(forms.models.BaseInlineFormSet):
+class ProcurementMaterialCheckInlineFormset(NumberedInlineFormSet):
     def clean(self):
         detail_count = 0
         detail_amount = 0
@@ -51,7 +54,9 @@ class ProcurementMaterialInline(admin.TabularInline):
 
 
 class ProcurementAdmin(admin.ModelAdmin):
-    list_display = ['id', 'is_correspond', 'order', 'supplier', 'is_active', 'status', 'etd', 'created', 'create_user']
+    list_display = ['id', 'is_correspond', 'order', 'supplier', 'is_active', 'status', 'total', 'open_quantity', 'etd',
+                    'created', 'create_user']
+    list_select_related = ['order', 'supplier', 'create_user']
     fields = ['is_correspond', 'order', 'supplier', 'etd']
     actions = ['make_actived']
     inlines = [ProcurementMaterialInline]
@@ -61,6 +66,21 @@ class ProcurementAdmin(admin.ModelAdmin):
     list_max_show_all = 100
     date_hierarchy = 'created'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            total=detail_sum(ProcurementMaterial, 'procurement', F('tax_subtotal') * F('currency__rate'), DecimalField(max_digits=16, decimal_places=4)),
+            open_quantity=detail_sum(ProcurementMaterial, 'procurement', remaining_quantity('quantity', 'arrived_quantity'), IntegerField()))
+
+    def total(self, obj):
+        return obj.total
+    total.short_description = u'含税总金额(本位币)'
+    total.admin_order_field = 'total'
+
+    def open_quantity(self, obj):
+        return obj.open_quantity
+    open_quantity.short_description = u'未到货数量'
+    open_quantity.admin_order_field = 'open_quantity'
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.create_user = request.user
@@ -89,7 +109,7 @@ admin.site.register(Procurement, ProcurementAdmin)
 3.原料数量至少一笔大于0
 4.原料数量不得为负数
 """
-class ArriveDetailCheckInlineFormset(forms.models.BaseInlineFormSet):
+class ArriveDetailCheckInlineFormset(NumberedInlineFormSet):
     def clean(self):
         detail_count = 0
         detail_amount = 0
@@ -126,9 +146,11 @@ class ArriveDetailInline(admin.TabularInline):
     extra = 0
 
 
-class ArriveAdmin(admin.ModelAdmin):
+class ArriveAdmin(AutocompleteSourcesMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ['id', 'procurement', 'supplier', 'is_active', 'is_delay', 'created', 'create_user']
+    list_select_related = ['procurement', 'supplier', 'create_user']
     fields = ['procurement']
+    autocomplete_sources = {'procurement': 'open_procurement'}
     actions = ['make_actived']
     inlines = [ArriveDetailInline]
     view_on_site = False
@@ -136,11 +158,6 @@ class ArriveAdmin(admin.ModelAdmin):
     list_max_show_all = 100
     date_hierarchy = 'created'
 
-    def formfield_for_foreignkey(self, db_field, request, **kwargs):
-        if db_field.name == 'procurement':
-            kwargs['queryset'] = Procurement.objects.filter(is_active=True).exclude(status='A')
-        return super(ArriveAdmin, self).formfield_for_foreignkey(db_field, request, **kwargs)
-
     def save_model(self, request, obj, form, change):
         if not change:
             obj.create_user = request.user
@@ -151,87 +168,18 @@ class ArriveAdmin(admin.ModelAdmin):
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
 
-        arrive = form.save(commit=False)
-
-        # 新增应付帐款单头
-        due = Due()
-        due.arrive = arrive
-        due.supplier = arrive.supplier
-        # 应付日期=到货日期 + 帐期
-        due.dued = arrive.created + datetime.timedelta(days=arrive.supplier.period.period)
-        due.create_user = arrive.create_user
-        due.save()
-
-        arrive_details = ArriveDetail.objects.filter(arrive=arrive)
-        for arrive_detail in arrive_details:
-            # 新增原料库存异动
-            material = arrive_detail.material
-            stock = material.stock
-            tran_quantity = arrive_detail.quantity
-
-            mtran = Mtran()
-            mtran.material = material
-            mtran.source_form = 'ARRIVE'
-            mtran.source_id = arrive.id
-            mtran.from_quantity = stock
-            mtran.tran_quantity = tran_quantity
-            mtran.to_quantity = stock + tran_quantity
-            mtran.create_user = request.user
-            mtran.save()
-
-            # 新增应付帐款单身
-            due_detail = DueDetail()
-            due_detail.due = due
-            due_detail.material = material
-            due_detail.amount = material.tax_price * tran_quantity
-            due_detail.currency = material.currency
-            due_detail.save()
-
-            # 增加商品库存量
-            material.stock = stock + tran_quantity
-            material.save()
-
-        procurement = form.cleaned_data.get('procurement')
-        # 修改到货单状态
-        arrive.is_active = True
-        today = datetime.datetime.now().date()
-        if today > procurement.etd:
-            procurement.is_delay = True
-        procurement.save()
-
-        # 决定对应采购单状态('A', '全部到货'),('P', '部分到货')，('O', '超额到货')如果有一个采购单单身数量没有全部出完的话，则状态为P
-        procurement_materials = ProcurementMaterial.objects.filter(procurement=procurement)
-        arrives = Arrive.objects.filter(procurement=procurement)
-        status = 'A'
-        for procurement_material in procurement_materials:
-            material = procurement_material.material
-            arrived_quantity = 0
-            for arrive in arrives.all():
-                arrive_details = ArriveDetail.objects.filter(material=material, arrive=arrive)
-                if arrive_details.all().count() > 0:
-                    for arrive_detail in arrive_details.all():
-                        arrived_quantity += arrive_detail.quantity
-
-            if arrived_quantity < procurement_material.quantity:
-                status = 'P'
-            else:
-                if arrived_quantity > procurement_material.quantity:
-                    # 如果有商品是部分到货P，就算是有超额到货也还是算成P
-                    if status is 'P':
-                        status = 'P'
-                    else:
-                        status = 'O'
-
-        procurement.status = status
-        procurement.save()
-
-        # 如果没有发生错误则修改应付帐款状态
-        due.is_active = True
-        due.save()
+        if not change:
+            post_arrive(form.instance, request.user)
+        else:
+            #修改到货单不再重复过账，只重算采购单单身的已到货数量
+            rebuild_procurement_lines([form.instance.procurement_id])
 
     def make_actived(self, request, queryset):
+        procurement_ids = list(queryset.values_list('procurement_id', flat=True).distinct())
         rows = queryset.update(is_active=False)
         if rows > 0:
+            #终止的到货单不再计入已到货数量
+            rebuild_procurement_lines(procurement_ids)
             self.message_user(request, u'已完成终止到货单动作')
     make_actived.allowed_permissions = ('active',)
     make_actived.short_description = u'终止到货单'
@@ -0,0 +1,54 @@
+from django.db import transaction
+from basic.bulk import BULK_BATCH_SIZE, check_lines, number_lines, prefetch_items
+from basic.models import Material
+from .models import Arrive, ArriveDetail, ProcurementMaterial
+from .posting import post_arrive
+from .status import refresh_procurement_status
+
+PRICE_FIELDS = ['id', 'title', 'status', 'price', 'tax', 'tax_price', 'currency_id']
+
+
+"""
+大量新增采购单单身：
+1.一次取得所有原料的价格，在内存中检查单身并计算金额
+2.以bulk_create写入，不逐笔查询原料与项次
+3.重算采购单状态
+"""
+def add_procurement_lines(procurement, lines):
+    materials = prefetch_items(Material, [line.item for line in lines], PRICE_FIELDS)
+    existing = ProcurementMaterial.objects.filter(procurement=procurement)
+    checked = check_lines(lines, materials, u'原料', active_only=True,
+                          existing_ids=existing.values_list('material_id', flat=True))
+
+    details = []
+    for line, material in checked:
+        detail = ProcurementMaterial(procurement=procurement, material_id=material.id, quantity=line.quantity,
+                                     description=line.description)
+        detail.set_price(material)
+        details.append(detail)
+
+    with transaction.atomic():
+        number_lines(details, existing.values_list('num', flat=True))
+        ProcurementMaterial.objects.bulk_create(details, batch_size=BULK_BATCH_SIZE)
+        refresh_procurement_status([procurement.id])
+    return details
+
+
+"""
+大量到货：
+1.一次取得所有原料，在内存中检查单身
+2.新增到货单单头，以bulk_create写入到货单单身
+3.到货单过账(post_arrive)
+"""
+def add_arrive_lines(procurement, lines, user):
+    materials = prefetch_items(Material, [line.item for line in lines], ['id', 'title'])
+    checked = check_lines(lines, materials, u'原料')
+
+    with transaction.atomic():
+        arrive = Arrive.objects.create(procurement=procurement, supplier_id=procurement.supplier_id, create_user=user)
+        details = [ArriveDetail(arrive=arrive, material_id=material.id, quantity=line.quantity,
+                                description=line.description) for line, material in checked]
+        number_lines(details, [])
+        ArriveDetail.objects.bulk_create(details, batch_size=BULK_BATCH_SIZE)
+        post_arrive(arrive, user)
+    return arrive
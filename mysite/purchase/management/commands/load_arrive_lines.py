@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from basic.bulk import read_lines
+from purchase.bulk import add_arrive_lines
+from purchase.models import Procurement
+
+
+class Command(BaseCommand):
+    help = u'由CSV档案大量到货，新增到货单并过账'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help=u'单身档案(CSV)，栏位为item,quantity,description')
+        parser.add_argument('--procurement', type=int, required=True, help=u'对应采购单id')
+        parser.add_argument('--user', required=True, help=u'建立人员帐号')
+
+    def handle(self, *args, **options):
+        procurement = Procurement.objects.filter(id=options['procurement'], is_active=True)\
+            .exclude(status='A').first()
+        if procurement is None:
+            raise CommandError(u'采购单[{}]不存在、已终止或已全部到货'.format(options['procurement']))
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(u'帐号[{}]不存在'.format(options['user']))
+
+        try:
+            arrive = add_arrive_lines(procurement, read_lines(options['path']), user)
+        except ValidationError as e:
+            raise CommandError('\n'.join(e.messages))
+        self.stdout.write(u'已新增到货单[{}]'.format(arrive.id))
@@ -0,0 +1,24 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from basic.bulk import read_lines
+from purchase.bulk import add_procurement_lines
+from purchase.models import Procurement
+
+
+class Command(BaseCommand):
+    help = u'由CSV档案大量新增采购单单身'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help=u'单身档案(CSV)，栏位为item,quantity,description')
+        parser.add_argument('--procurement', type=int, required=True, help=u'采购单id')
+
+    def handle(self, *args, **options):
+        procurement = Procurement.objects.filter(id=options['procurement'], is_active=True).first()
+        if procurement is None:
+            raise CommandError(u'采购单[{}]不存在或已终止'.format(options['procurement']))
+
+        try:
+            details = add_procurement_lines(procurement, read_lines(options['path']))
+        except ValidationError as e:
+            raise CommandError('\n'.join(e.messages))
+        self.stdout.write(u'采购单[{}]新增单身 {} 笔'.format(procurement.id, len(details)))
@@ -1,6 +1,7 @@
 from django.db import models
 from django.urls import reverse
 from basic.models import Currency, Material, Supplier
+from basic.numbering import format_num
 from sale.models import Order
 
 
@@ -41,13 +42,16 @@ class Procurement(models.Model):
     class Meta:
         verbose_name = '采购单'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['is_active', 'status']),
+        ]
         permissions = (
             ('active_procurement', '可中止采购单'),
         )
 
 
 class ProcurementMaterial(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     procurement = models.ForeignKey(Procurement, verbose_name=u'采购单单头', on_delete=models.CASCADE)
     material = models.ForeignKey(Material, verbose_name=u'原料', on_delete=models.DO_NOTHING,
                                  limit_choices_to={'status': 'A'},)
@@ -57,25 +61,27 @@ class ProcurementMaterial(models.Model):
     tax_price = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'含税金额')
     subtotal = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'小计未税金额')
     tax_subtotal = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'小计含税金额')
+    arrived_quantity = models.PositiveIntegerField(default=0, verbose_name=u'已到货数量')
     tax_pay = models.DecimalField(max_digits=16, decimal_places=4, blank=False, default=0, verbose_name=u'已付含税金额')
     currency = models.ForeignKey(Currency, verbose_name=u'币别', blank=False, on_delete=models.DO_NOTHING)
     description = models.CharField(max_length=256, verbose_name=u'描述', blank=True)
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             procurement_materials = ProcurementMaterial.objects.filter(procurement=self.procurement)
-            num = "{0:02d}".format(procurement_materials.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(procurement_materials.count() + 1)
 
-        material = Material.objects.get(title=self.material)
+        self.set_price(self.material)
+        super().save(*args, **kwargs)
+
+    def set_price(self, material):
         self.price = material.price
         self.tax = material.tax
-        self.currency = material.currency
+        self.currency_id = material.currency_id
         self.tax_price = material.tax_price
         self.subtotal = material.price * self.quantity
         self.tax_subtotal = material.tax_price * self.quantity
-        super().save(*args, **kwargs)
 
     def __str__(self):
         return '{}'.format(self.num)
@@ -83,6 +89,9 @@ class ProcurementMaterial(models.Model):
     class Meta:
         verbose_name = '采购单单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['procurement', 'material']),
+        ]
 
 
 class Arrive(models.Model):
@@ -104,13 +113,17 @@ class Arrive(models.Model):
     class Meta:
         verbose_name = '到货单'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['procurement', 'is_active']),
+            models.Index(fields=['created', 'id']),
+        ]
         permissions = (
             ('active_arrive', '可中止到货单'),
         )
 
 
 class ArriveDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     arrive = models.ForeignKey(Arrive, verbose_name=u'到货单单头', on_delete=models.CASCADE)
     material = models.ForeignKey(Material, verbose_name=u'到货原料', on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(blank=False, verbose_name=u'到货数量')
@@ -118,10 +131,9 @@ class ArriveDetail(models.Model):
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             arrive_detail = ArriveDetail.objects.filter(arrive=self.arrive)
-            num = "{0:02d}".format(arrive_detail.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(arrive_detail.count() + 1)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -130,4 +142,7 @@ class ArriveDetail(models.Model):
     class Meta:
         verbose_name = '到货单单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['arrive', 'material']),
+        ]
 
@@ -0,0 +1,80 @@
+from django.db.models import Sum
+from basic.bom import BomGraph
+from basic.models import Material, Product
+from sale.models import OrderProduct
+from .models import ProcurementMaterial
+
+OPEN_STATUS = ['N', 'P']
+
+
+def _sum_by(queryset, keys, field):
+    totals = {}
+    for row in queryset.values(*keys).annotate(total=Sum(field)).values_list(*keys, 'total'):
+        totals[row[0] if len(keys) == 1 else row[:-1]] = row[-1]
+    return totals
+
+
+"""
+物料需求计算(MRP)，以固定次数的查询读出所有数据(已出货/已到货数量读取单身维护的栏位)，在内存中以字典合计：
+1.商品净需求 = 所有有效且未全部出货订单的(订购数量 - 已出货数量)合计，再扣除商品库存，最少为0
+  每个订单单身最多扣到0，超额出货不抵其他订单
+2.以BomGraph展开多阶BOM表，商品净需求乘上每单位末阶原料用量后合计为原料毛需求，半成品库存不扣除
+3.原料净需求 = 毛需求 - 原料库存 - 在途采购量(有效且未全部到货采购单的采购数量 - 已到货数量)
+4.净需求大于0的原料依供货商分组，作为建议采购量
+"""
+def run_mrp():
+    order_lines = OrderProduct.objects.filter(order__is_active=True, order__status__in=OPEN_STATUS)
+
+    #商品净需求{商品id: 数量}
+    demand = {}
+    for product_id, quantity, shipped in order_lines.values_list('product_id', 'quantity', 'shipped_quantity'):
+        demand[product_id] = demand.get(product_id, 0) + max(quantity - shipped, 0)
+    for product_id, stock in Product.objects.filter(id__in=list(demand)).values_list('id', 'stock'):
+        demand[product_id] = max(demand[product_id] - stock, 0)
+
+    #原料毛需求{原料id: 数量}
+    gross = BomGraph.load().explode(demand)
+
+    #在途采购量{原料id: 数量}
+    open_lines = ProcurementMaterial.objects.filter(procurement__is_active=True, procurement__status__in=OPEN_STATUS,
+                                                    material_id__in=list(gross))
+    on_order = {}
+    for material_id, quantity, arrived in open_lines.values_list('material_id', 'quantity', 'arrived_quantity'):
+        on_order[material_id] = on_order.get(material_id, 0) + max(quantity - arrived, 0)
+
+    suppliers = {}
+    materials = Material.objects.filter(id__in=list(gross))\
+        .values_list('id', 'title', 'stock', 'supplier_id', 'supplier__title').order_by('supplier_id', 'id')
+    for material_id, title, stock, supplier_id, supplier_title in materials:
+        net = gross[material_id] - stock - on_order.get(material_id, 0)
+        if net > 0:
+            supplier = suppliers.setdefault(supplier_id, {'id': supplier_id, 'title': supplier_title, 'materials': []})
+            supplier['materials'].append({'id': material_id, 'title': title, 'gross': gross[material_id],
+                                          'stock': stock, 'on_order': on_order.get(material_id, 0), 'quantity': net})
+    return list(suppliers.values())
+
+
+"""
+单一订单对单一供货商的采购数量：
+采购数量 = 订单中的商品数量 * 多阶BOM表展开后该商品的末阶原料每单位用量
+  扣除 其他对应到该订单的采购单的相同原料的采购数量
+  再扣除 该原料库存
+"""
+def order_material_requirements(order, supplier):
+    ordered = _sum_by(OrderProduct.objects.filter(order=order), ['product_id'], 'quantity')
+    exploded = BomGraph.load().explode(ordered)
+    stocks = dict((m[0], m[1:]) for m in Material.objects.filter(id__in=list(exploded), supplier=supplier)
+                  .values_list('id', 'title', 'stock'))
+    requirements = dict((material_id, quantity) for material_id, quantity in exploded.items()
+                        if material_id in stocks)
+
+    procured = _sum_by(ProcurementMaterial.objects.filter(procurement__order=order, material_id__in=list(requirements)),
+                       ['material_id'], 'quantity')
+
+    materials = []
+    for material_id, quantity in requirements.items():
+        title, stock = stocks[material_id]
+        quantity -= (procured.get(material_id) or 0) + stock
+        if quantity > 0:
+            materials.append({'id': material_id, 'title': title, 'quantity': quantity})
+    return materials
@@ -0,0 +1,73 @@
+import datetime
+from django.db.models import IntegerField
+from basic import masterdata
+from basic.metrics import measure
+from basic.models import Period
+from basic.numbering import format_num
+from basic.status import add_to_lines
+from finance.models import Due, DueDetail
+from inventory.stock import post_material_stock
+from .models import ArriveDetail, ProcurementMaterial
+from .status import refresh_procurement_status
+
+
+"""
+到货单过账，到货单单头与单身存盘后呼叫：
+1.新增应付帐款单头与单身(DueDetail)
+2.新增原料库存异动(Mtran)并增加原料库存量(material.stock)
+3.检查到货日期是否有延迟(is_delay)
+4.累加采购单单身的已到货数量(arrived_quantity)，重算对应采购单状态
+"""
+@measure('posting:arrive')
+def post_arrive(arrive, user):
+    procurement = arrive.procurement
+
+    # 新增应付帐款单头
+    due = Due()
+    due.arrive = arrive
+    due.supplier = arrive.supplier
+    # 应付日期=到货日期 + 帐期
+    period = masterdata.get(Period, arrive.supplier.period_id)
+    due.dued = arrive.created + datetime.timedelta(days=period.period)
+    due.create_user = arrive.create_user
+    due.save()
+
+    # 新增应付帐款单身
+    arrive_details = ArriveDetail.objects.filter(arrive=arrive).select_related('material')
+    due_details = []
+    for i, arrive_detail in enumerate(arrive_details, 1):
+        material = arrive_detail.material
+        due_detail = DueDetail()
+        due_detail.num = format_num(i)
+        due_detail.due = due
+        due_detail.material = material
+        due_detail.amount = material.tax_price * arrive_detail.quantity
+        due_detail.currency_id = material.currency_id
+        due_details.append(due_detail)
+    DueDetail.objects.bulk_create(due_details, batch_size=500)
+
+    # 新增原料库存异动并增加原料库存量
+    post_material_stock('ARRIVE', arrive.id,
+                        [(d.material_id, d.quantity) for d in arrive_details], user)
+
+    # 修改到货单状态
+    arrive.is_active = True
+    today = datetime.datetime.now().date()
+    if today > procurement.etd:
+        arrive.is_delay = True
+    arrive.save()
+
+    # 累加采购单单身的已到货数量
+    arrived = {}
+    for arrive_detail in arrive_details:
+        arrived[arrive_detail.material_id] = arrived.get(arrive_detail.material_id, 0) + arrive_detail.quantity
+    add_to_lines(ProcurementMaterial.objects.filter(procurement=procurement), 'material_id', 'arrived_quantity',
+                 arrived, IntegerField())
+
+    # 决定对应采购单状态('A', '全部到货'),('P', '部分到货')，('O', '超额到货')如果有一个采购单单身数量没有全部出完的话，则状态为P
+    refresh_procurement_status([procurement.id])
+
+    # 如果没有发生错误则修改应付帐款状态
+    due.is_active = True
+    due.save()
+    return due
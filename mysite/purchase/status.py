@@ -0,0 +1,58 @@
+from django.db.models import DecimalField, F, IntegerField, Sum
+from basic.status import apply_statuses, in_chunks, set_lines
+from finance.models import PayDetail
+from .models import ArriveDetail, Procurement, ProcurementMaterial
+
+
+"""
+各采购单各原料的已到货数量(只计有效到货单)，回传{(采购单id, 原料id): 数量}
+重建采购单单身已到货数量(arrived_quantity)时使用
+"""
+def arrived_quantities(procurement_ids):
+    rows = ArriveDetail.objects.filter(arrive__procurement_id__in=procurement_ids, arrive__is_active=True)\
+        .values('arrive__procurement_id', 'material_id').annotate(total=Sum('quantity'))\
+        .values_list('arrive__procurement_id', 'material_id', 'total')
+    return dict(((procurement_id, material_id), total) for procurement_id, material_id, total in rows)
+
+
+"""
+各采购单各原料的已付含税金额(付款金额 + 折扣，只计有效付款单)，回传{(采购单id, 原料id): 金额}
+重建采购单单身已付含税金额(tax_pay)时使用
+"""
+def paid_tax_amounts(procurement_ids):
+    rows = PayDetail.objects.filter(pay__due__arrive__procurement_id__in=procurement_ids, pay__is_active=True)\
+        .values('pay__due__arrive__procurement_id', 'material_id').annotate(total=Sum(F('amount') + F('discount')))\
+        .values_list('pay__due__arrive__procurement_id', 'material_id', 'total')
+    return dict(((procurement_id, material_id), total) for procurement_id, material_id, total in rows)
+
+
+"""
+重算采购单状态('N', '尚未到货'),('A', '全部到货'),('P', '部分到货'),('O', '超额到货')
+已到货数量读取单身维护的栏位
+"""
+def refresh_procurement_status(procurement_ids):
+    statuses = {}
+    for ids in in_chunks(procurement_ids):
+        lines = ProcurementMaterial.objects.filter(procurement_id__in=ids)\
+            .values_list('procurement_id', 'quantity', 'arrived_quantity')
+        statuses.update(apply_statuses(Procurement, ids, lines))
+    return statuses
+
+
+"""
+由到货单与付款单重新合计采购单单身的已到货数量与已付含税金额，再重算采购单状态
+到货单终止或资料修正后使用
+"""
+def rebuild_procurement_lines(procurement_ids):
+    for ids in in_chunks(procurement_ids):
+        arrived = arrived_quantities(ids)
+        paid = paid_tax_amounts(ids)
+        arrived_values = {}
+        paid_values = {}
+        for line_id, procurement_id, material_id in ProcurementMaterial.objects.filter(procurement_id__in=ids)\
+                .values_list('id', 'procurement_id', 'material_id'):
+            arrived_values[line_id] = arrived.get((procurement_id, material_id)) or 0
+            paid_values[line_id] = paid.get((procurement_id, material_id)) or 0
+        set_lines(ProcurementMaterial, 'arrived_quantity', arrived_values, IntegerField())
+        set_lines(ProcurementMaterial, 'tax_pay', paid_values, DecimalField(max_digits=16, decimal_places=4))
+    return refresh_procurement_status(procurement_ids)
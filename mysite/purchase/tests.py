@@ -1,3 +1,139 @@
+import datetime
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.test import TestCase
+from basic.models import Bom, Category, Currency, Customer, Material, Period, Product, Size, Supplier
+from basic.testing import QueryPlanMixin
+from sale.models import Order, OrderProduct
+from basic.bulk import BulkLine
+from .bulk import add_arrive_lines, add_procurement_lines
+from .models import Arrive, ArriveDetail, Procurement, ProcurementMaterial
+from .mrp import order_material_requirements, run_mrp
+from .status import rebuild_procurement_lines
 
-# Create your tests here.
+
+class PurchaseQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_open_procurements(self):
+        self.assertUsesIndex(Procurement.objects.filter(is_active=True, status='N'))
+
+    def test_procurement_material_by_procurement_and_material(self):
+        self.assertUsesIndex(ProcurementMaterial.objects.filter(procurement_id=1, material_id=1))
+
+    def test_active_arrives_of_procurement(self):
+        self.assertUsesIndex(Arrive.objects.filter(procurement_id=1, is_active=True))
+
+    def test_arrive_detail_by_arrive_and_material(self):
+        self.assertUsesIndex(ArriveDetail.objects.filter(arrive_id=1, material_id=1))
+
+
+class PurchaseFixtureMixin:
+    def setUp(self):
+        self.user = User.objects.create_user('user')
+        rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        period = Period.objects.create(title=u'月结30天', period=30)
+        self.supplier = Supplier.objects.create(title='S', period=period, status='A')
+        other = Supplier.objects.create(title='T', period=period, status='A')
+        category = Category.objects.create(title='C', status='A')
+        size = Size.objects.create(title='Z', status='A')
+        defaults = {'image_sub': '-', 'price': 1, 'tax': 0, 'tax_price': 1, 'currency': rmb, 'status': 'A'}
+        self.m1 = Material.objects.create(title='M1', supplier=self.supplier, category=category, stock=5, **defaults)
+        self.m2 = Material.objects.create(title='M2', supplier=other, category=category, **defaults)
+        #P1 = 2 M1 + 3 P2，P2 = 1 M2 + 1 M1，P1每单位需要5 M1、3 M2
+        self.p1 = Product.objects.create(title='P1', size=size, stock=1, **defaults)
+        self.p2 = Product.objects.create(title='P2', size=size, stock=10, **defaults)
+        Bom.objects.create(product=self.p1, material=self.m1, quantity=2)
+        Bom.objects.create(product=self.p1, component=self.p2, quantity=3)
+        Bom.objects.create(product=self.p2, material=self.m2, quantity=1)
+        Bom.objects.create(product=self.p2, material=self.m1, quantity=1)
+        self.customer = Customer.objects.create(title='C', period=period, status='A')
+
+    def order(self, lines, **kwargs):
+        order = Order.objects.create(cat_id='1', pi_no='R{}'.format(Order.objects.count()), customer=self.customer,
+                                     etd=datetime.date(2019, 1, 31), create_user=self.user, **kwargs)
+        for product, quantity, shipped in lines:
+            line = OrderProduct(order=order, product=product, quantity=quantity, shipped_quantity=shipped)
+            line.set_price(product)
+            line.save()
+        return order
+
+    def procurement(self, lines, **kwargs):
+        procurement = Procurement.objects.create(is_correspond='0', supplier=self.supplier, create_user=self.user,
+                                                 etd=datetime.date(2019, 1, 31), **kwargs)
+        for material, quantity, arrived in lines:
+            line = ProcurementMaterial(procurement=procurement, material=material, quantity=quantity,
+                                       arrived_quantity=arrived)
+            line.set_price(material)
+            line.save()
+        return procurement
+
+
+class MrpTests(PurchaseFixtureMixin, TestCase):
+    def test_run_mrp_nets_stock_shipped_and_on_order(self):
+        self.order([(self.p1, 10, 3), (self.p2, 2, 0)])
+        #超额出货不抵其他订单的需求
+        self.order([(self.p1, 4, 6)], status='P')
+        self.order([(self.p1, 100, 0)], is_active=False)
+        self.order([(self.p1, 100, 100)], status='A')
+        self.procurement([(self.m1, 10, 4), (self.m2, 5, 8)])
+        self.procurement([(self.m2, 100, 0)], is_active=False)
+
+        #P1净需求 = 7 - 库存1 = 6，P2净需求 = 2 - 库存10 = 0(半成品库存不扣除P1展开的需求)
+        with self.assertNumQueries(5):
+            suppliers = run_mrp()
+        self.assertEqual(suppliers, [
+            {'id': self.supplier.id, 'title': 'S', 'materials': [
+                {'id': self.m1.id, 'title': 'M1', 'gross': 30, 'stock': 5, 'on_order': 6, 'quantity': 19}]},
+            {'id': self.m2.supplier_id, 'title': 'T', 'materials': [
+                {'id': self.m2.id, 'title': 'M2', 'gross': 18, 'stock': 0, 'on_order': 0, 'quantity': 18}]},
+        ])
+
+        Material.objects.filter(id=self.m1.id).update(stock=24)
+        self.assertEqual([supplier['title'] for supplier in run_mrp()], ['T'])
+
+    def test_order_material_requirements(self):
+        order = self.order([(self.p1, 10, 0), (self.p2, 2, 0)])
+        self.procurement([(self.m1, 20, 0)], order=order)
+        #M1 = 10 x 5 + 2 x 1 - 已采购20 - 库存5
+        self.assertEqual(order_material_requirements(order, self.supplier),
+                         [{'id': self.m1.id, 'title': 'M1', 'quantity': 27}])
+        self.assertEqual(order_material_requirements(order, self.m2.supplier),
+                         [{'id': self.m2.id, 'title': 'M2', 'quantity': 32}])
+
+
+class ProcurementStatusTests(PurchaseFixtureMixin, TestCase):
+    def test_arrive_transitions(self):
+        procurement = self.procurement([(self.m1, 10, 0), (self.m2, 5, 0)])
+
+        def arrive(*quantities):
+            return add_arrive_lines(procurement, [BulkLine(row, material.id, quantity) for row, (material, quantity)
+                                                  in enumerate(zip([self.m1, self.m2], quantities), 1)], self.user)
+
+        def state():
+            return (list(ProcurementMaterial.objects.filter(procurement=procurement).order_by('id')
+                         .values_list('arrived_quantity', flat=True)),
+                    Procurement.objects.get(id=procurement.id).status)
+
+        arrive(10, 0)
+        self.assertEqual(state(), ([10, 0], 'P'))
+        over = arrive(1, 5)
+        self.assertEqual(state(), ([11, 5], 'O'))
+        Arrive.objects.filter(id=over.id).update(is_active=False)
+        self.assertEqual(rebuild_procurement_lines([procurement.id]), {procurement.id: 'P'})
+        self.assertEqual(state(), ([10, 0], 'P'))
+
+
+class PurchaseBulkLoadTests(PurchaseFixtureMixin, TestCase):
+    def test_procurement_and_arrive_lines(self):
+        procurement = self.procurement([(self.m1, 10, 0)])
+        with self.assertRaises(ValidationError) as raised:
+            add_procurement_lines(procurement, [BulkLine(2, 'M1', 1), BulkLine(3, 'M2', -1), BulkLine(4, 'M9', 1)])
+        self.assertEqual(len(raised.exception.messages), 3)
+
+        details = add_procurement_lines(procurement, [BulkLine(2, 'M2', 4, u'补料')])
+        self.assertEqual([(detail.num, detail.quantity, detail.subtotal) for detail in details], [('00002', 4, 4)])
+
+        add_arrive_lines(procurement, [BulkLine(2, 'M1', 10), BulkLine(3, 'M2', 1)], self.user)
+        self.assertEqual(list(ProcurementMaterial.objects.filter(procurement=procurement).order_by('num')
+                              .values_list('arrived_quantity', flat=True)), [10, 1])
+        self.assertEqual(Procurement.objects.get(id=procurement.id).status, 'P')
+        self.assertEqual(Material.objects.get(id=self.m1.id).stock, 15)
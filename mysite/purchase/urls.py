@@ -8,4 +8,5 @@ urlpatterns = [
     path('procurement/ajax/supplier/list/', views.procurement_ajax_supplier_list, name='procurement_ajax_supplier_list'),
     path('procurement/ajax/material/list/', views.procurement_ajax_material_list, name='procurement_ajax_material_list'),
     path('procurement/ajax/list/', views.procurement_ajax_list, name='procurement_ajax_list'),
+    path('procurement/ajax/mrp/', views.procurement_ajax_mrp, name='procurement_ajax_mrp'),
 ]
@@ -1,7 +1,9 @@
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
-from .models import Arrive, ArriveDetail, Procurement, ProcurementMaterial
-from basic.models import Bom, Supplier
+from .models import Arrive, Procurement, ProcurementMaterial
+from basic.bom import BomGraph
+from basic.models import Material, Supplier
 from sale.models import Order, OrderProduct
+from .mrp import order_material_requirements, run_mrp
 
 
 def procurement_ajax_supplier_list(request):
@@ -13,22 +15,19 @@ def procurement_ajax_supplier_list(request):
         return_dict['code'] = 0
         return_dict['msg'] = ''
         return_dict['suppliers'] = []
-        order_products = OrderProduct.objects.filter(order=order)
-
-        other_procurements = Procurement.objects.filter(order=order)
-        if other_procurements.count() > 0:
-            return_dict['msg'] = u'此订单已有对应采购单，采购单单号如下：'
-            for p in other_procurements:
-                return_dict['msg'] += ' ' + str(p.id) + u'(供货商:{})'.format(p.supplier.title)
-
-        for p in order_products.all():
-            product = p.product
-            boms = Bom.objects.filter(product=product)
-            for b in boms.all():
-                material = b.material
-                supplier = material.supplier
-                if supplier.id not in return_dict['suppliers']:
-                    return_dict['suppliers'].append(supplier.id)
+        other_procurements = Procurement.objects.filter(order=order).select_related('supplier')
+        for p in other_procurements:
+            if return_dict['msg'] == '':
+                return_dict['msg'] = u'此订单已有对应采购单，采购单单号如下：'
+            return_dict['msg'] += ' ' + str(p.id) + u'(供货商:{})'.format(p.supplier.title)
+
+        #多阶BOM表展开后的末阶原料，依BOM表顺序列出供货商
+        product_ids = OrderProduct.objects.filter(order=order).values_list('product_id', flat=True)
+        material_ids = list(BomGraph.load().explode(dict.fromkeys(product_ids, 1)))
+        supplier_ids = dict(Material.objects.filter(id__in=material_ids).values_list('id', 'supplier_id'))
+        for material_id in material_ids:
+            if supplier_ids[material_id] not in return_dict['suppliers']:
+                return_dict['suppliers'].append(supplier_ids[material_id])
     else:
         return_dict['code'] = 1
         return_dict['msg'] = u"您无权限浏览采购单"
@@ -45,14 +44,6 @@ def procurement_ajax_material_list(request):
         supplier = Supplier.objects.get(id=supplier_id)
         return_dict['code'] = 0
         return_dict['materials'] = []
-        order_products = OrderProduct.objects.filter(order=order)
-        products = []
-        if order_products.count() > 0:
-            for order_product in order_products:
-                products.append(order_product.product)
-        other_procurements = Procurement.objects.filter(order=order)
-
-        boms = Bom.objects.filter(product__in=products)
         """
         有可能不同商品有相同的组成原料，如下：
         id  product_id  material_id quantity    status
@@ -60,35 +51,11 @@ def procurement_ajax_material_list(request):
         2   1           2           3           A
         3   2           1           5           A
         4   2           2           5           A
+        采购单中该原料采购数量 = 订单中的商品数量*BOM表中该商品的原料组成数量
+        扣除 其他对应到该订单的采购单的相同原料的采购数量
+        再扣除 该原料库存
         """
-        material_list = []
-        for b in boms.all():
-            material = b.material
-            if material.supplier == supplier:
-                if b.material not in material_list:
-                    material_list.append(material)
-
-        for material in material_list:
-            #采购单中该原料采购数量 = 订单中的商品数量*BOM表中该商品的原料组成数量
-            # 扣除 其他对应到该订单的采购单的相同原料的采购数量
-            # 再扣除 该原料库存
-            quantity = 0
-            for order_product in order_products.all():
-                bom = boms.filter(product=order_product.product, material=material)
-                if bom.count() > 0:
-                    quantity += order_product.quantity * bom[0].quantity
-
-            if other_procurements.count() != 0:
-                other_procurement_materials = ProcurementMaterial.objects.filter(procurement__in=other_procurements, material=material)
-                if other_procurement_materials.count() != 0:
-                    for m in other_procurement_materials.all():
-                        quantity -= m.quantity
-
-            quantity -= material.stock
-
-            if quantity > 0:
-                material_info = {'id': material.id, 'title': material.title, 'quantity': quantity}
-                return_dict['materials'].append(material_info)
+        return_dict['materials'] = order_material_requirements(order, supplier)
 
     else:
         return_dict['code'] = 1
@@ -96,38 +63,45 @@ def procurement_ajax_material_list(request):
     return JsonResponse(return_dict)
 
 
+"""
+采购单单身剩余到货数量，到货单选择对应采购单时使用
+剩余数量 = 采购数量 - 已到货数量(arrived_quantity)，直接读取采购单单身
+"""
 def procurement_ajax_list(request):
     return_dict = {}
     #判断使用者是否有权限检视采购单
     if request.user.has_perm('purchase.view_procurement'):
         procurement_id = request.GET.get('id')
-        procurement = Procurement.objects.get(id=procurement_id)
         return_dict['code'] = 0
         return_dict['msg'] = ''
         return_dict['materials'] = []
-        procurement_materials = ProcurementMaterial.objects.filter(procurement=procurement)
-
-        for m in procurement_materials.all():
-            material = m.material
-            quantity = m.quantity
 
-            # 如果该采购单有其他对应进货单，则需扣掉已进货的原料数量
-            arrives = Arrive.objects.filter(procurement=procurement, is_active=True)
-            if arrives.count() > 0:
-                return_dict['msg'] = u'此采购单已有对应到货单，到货单单号如下：'
-                for a in arrives.all():
-                    return_dict['msg'] += ' ' + str(a.id)
-                    arrive_material = ArriveDetail.objects.filter(arrive=a, material=material)
-                    if arrive_material.all().count() > 0:
-                        quantity -= arrive_material[0].quantity
-
-            material_info = {}
-            material_info['id'] = material.id
-            material_info['title'] = material.title
-            material_dict = {'material': material_info, 'quantity': quantity}
+        # 如果该采购单有其他对应进货单，列出到货单单号
+        arrive_ids = list(Arrive.objects.filter(procurement_id=procurement_id, is_active=True)
+                          .order_by('id').values_list('id', flat=True))
+        if arrive_ids:
+            return_dict['msg'] = u'此采购单已有对应到货单，到货单单号如下：' + ''.join(' ' + str(i) for i in arrive_ids)
+
+        procurement_materials = ProcurementMaterial.objects.filter(procurement_id=procurement_id).order_by('id')\
+            .values_list('material_id', 'material__title', 'quantity', 'arrived_quantity')
+        for material_id, title, quantity, arrived in procurement_materials:
+            material_info = {'id': material_id, 'title': title}
+            material_dict = {'material': material_info, 'quantity': quantity - arrived}
             return_dict['materials'].append(material_dict)
     else:
         return_dict['code'] = 1
         return_dict['msg'] = u"您无权限浏览采购单"
     return JsonResponse(return_dict)
 
+
+def procurement_ajax_mrp(request):
+    return_dict = {}
+    #判断使用者是否有权限检视采购单
+    if request.user.has_perm('purchase.view_procurement'):
+        return_dict['code'] = 0
+        return_dict['msg'] = ''
+        return_dict['suppliers'] = run_mrp()
+    else:
+        return_dict['code'] = 1
+        return_dict['msg'] = u"您无权限浏览采购单"
+    return JsonResponse(return_dict)
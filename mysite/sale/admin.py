@@ -1,11 +1,19 @@
 from django import forms
 from django.contrib import admin, messages
 from django.contrib.auth import get_permission_codename
+from django.core.exceptions import ValidationError
+from django.db.models import DecimalField, F, IntegerField
 
 import datetime
 from .models import Order, OrderProduct, Ship, ShipDetail
-from finance.models import Receivable, ReceivableDetail
-from inventory.models import Ptran
+from .posting import post_ship
+from .status import rebuild_order_lines
+from basic.autocomplete import AutocompleteSourcesMixin
+from basic.changelist import KeysetPaginationMixin, detail_sum, remaining_quantity
+from basic.numbering import NumberedInlineFormSet, allocate_numbers
+from basic.search import SearchIndexMixin
+from inventory.bulk import generate_processes
+from inventory.stock import StockShortageMixin
 
 
 """
@@ -14,7 +22,7 @@ from inventory.models import Ptran
 2.商品不可重复
 3.商品数量是否大于0
 """
-class OrderProductCheckInlineFormset(forms.models.BaseInlineFormSet):
+class OrderProductCheckInlineFormset(NumberedInlineFormSet):
     def clean(self):
         count = 0
         product_list = []
@@ -44,18 +52,42 @@ class OrderProductInline(admin.TabularInline):
     extra = 0
 
 
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'cat_id', 'pi_no', 'po_no', 'customer', 'is_urgency', 'status',
+def last_pi_num(pattern):
+    #接续流水号表建立前已使用的pi_no
+    pi_nos = Order.objects.filter(pi_no__startswith=pattern).values_list('pi_no', flat=True)
+    nums = [int(pi_no[len(pattern):]) for pi_no in pi_nos if pi_no[len(pattern):].isdigit()]
+    return max(nums) if nums else 0
+
+
+class OrderAdmin(SearchIndexMixin, admin.ModelAdmin):
+    list_display = ['id', 'cat_id', 'pi_no', 'po_no', 'customer', 'is_urgency', 'status', 'total', 'open_quantity',
                     'etd', 'created', 'create_user']
+    list_select_related = ['customer', 'create_user']
     fields = ['cat_id', 'po_no', 'customer', 'is_urgency', 'etd']
     list_filter = ['is_urgency', 'status']
-    actions = ['make_actived']
+    search_kind = 'order'
+    actions = ['make_actived', 'make_processes']
     inlines = [OrderProductInline]
     view_on_site = False
     list_per_page = 10
     list_max_show_all = 100
     date_hierarchy = 'created'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            total=detail_sum(OrderProduct, 'order', F('tax_subtotal') * F('currency__rate'), DecimalField(max_digits=16, decimal_places=4)),
+            open_quantity=detail_sum(OrderProduct, 'order', remaining_quantity('quantity', 'shipped_quantity'), IntegerField()))
+
+    def total(self, obj):
+        return obj.total
+    total.short_description = u'含税总金额(本位币)'
+    total.admin_order_field = 'total'
+
+    def open_quantity(self, obj):
+        return obj.open_quantity
+    open_quantity.short_description = u'未出货数量'
+    open_quantity.admin_order_field = 'open_quantity'
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.create_user = request.user
@@ -67,8 +99,8 @@ class OrderAdmin(admin.ModelAdmin):
             121:三码流水码
             """
             pattern = 'R' + datetime.datetime.now().strftime("%Y%m")
-            orders = Order.objects.filter(pi_no__startswith=pattern)
-            obj.pi_no = pattern + "{0:03d}".format(orders.count() + 1)
+            num = allocate_numbers('ORDER', pattern, seed=lambda: last_pi_num(pattern))[0]
+            obj.pi_no = pattern + "{0:03d}".format(num)
         super().save_model(request, obj, form, change)
 
     def make_actived(self, request, queryset):
@@ -83,6 +115,24 @@ class OrderAdmin(admin.ModelAdmin):
         codename = get_permission_codename('active', opts)
         return request.user.has_perm('%s.%s' % (opts.app_label, codename))
 
+    """
+    每张订单在一个交易中产生所有商品的制程单，缺料等错误一次列出，该订单不产生任何制程单
+    """
+    def make_processes(self, request, queryset):
+        for order in queryset.order_by('id'):
+            try:
+                processes = generate_processes(order, request.user)
+            except ValidationError as e:
+                self.message_user(request, u'订单[{}]无法产生制程单：{}'.format(order.pi_no, ' '.join(e.messages)),
+                                  messages.ERROR)
+            else:
+                self.message_user(request, u'订单[{}]已产生{}张制程单'.format(order.pi_no, len(processes)))
+    make_processes.allowed_permissions = ('process',)
+    make_processes.short_description = u'产生制程单'
+
+    def has_process_permission(self, request):
+        return request.user.has_perm('inventory.add_process')
+
 
 admin.site.register(Order, OrderAdmin)
 
@@ -95,7 +145,7 @@ admin.site.register(Order, OrderAdmin)
 4.出货数量不得是负数
 4.单身商品不得重复
 """
-class ShipDetailCheckInlineFormset(forms.models.BaseInlineFormSet):
+class ShipDetailCheckInlineFormset(NumberedInlineFormSet):
     def clean(self):
         detail_count = 0
         detail_amount = 0
@@ -148,9 +198,11 @@ class ShipDetailInline(admin.TabularInline):
   ii.如果出货数量>0时则新增一笔 应收帐款(Receivable)
  iii.检查订单数量是否满足，决定订单"状态"，('A', '全部出货'),('P', '部分出货')
 """
-class ShipAdmin(admin.ModelAdmin):
+class ShipAdmin(StockShortageMixin, AutocompleteSourcesMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ['id', 'order', 'customer', 'is_active', 'is_delay', 'created', 'create_user']
+    list_select_related = ['order', 'customer', 'create_user']
     fields = ['order']
+    autocomplete_sources = {'order': 'open_order'}
     actions = ['make_actived']
     inlines = [ShipDetailInline]
     view_on_site = False
@@ -158,11 +210,6 @@ class ShipAdmin(admin.ModelAdmin):
     list_max_show_all = 100
     date_hierarchy = 'created'
 
-    def formfield_for_foreignkey(self, db_field, request, **kwargs):
-        if db_field.name == 'order':
-            kwargs['queryset'] = Order.objects.filter(is_active=True).exclude(status='A')
-        return super(ShipAdmin, self).formfield_for_foreignkey(db_field, request, **kwargs)
-
     def save_model(self, request, obj, form, change):
         if not change:
             obj.create_user = request.user
@@ -173,87 +220,18 @@ class ShipAdmin(admin.ModelAdmin):
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
 
-        ship = form.save(commit=False)
-
-        #新增应收帐款单头
-        receivable = Receivable()
-        receivable.ship = ship
-        receivable.customer = ship.customer
-        #应收日期=出货日期 + 帐期
-        receivable.receivabled = datetime.datetime.now().date() + datetime.timedelta(days=ship.customer.period.period)
-        receivable.create_user = ship.create_user
-        receivable.save()
-
-        ship_details = ShipDetail.objects.filter(ship=ship)
-        for ship_detail in ship_details:
-            #新增商品库存异动
-            product = ship_detail.product
-            stock = product.stock
-            tran_quantity = ship_detail.quantity
-
-            ptran = Ptran()
-            ptran.product = product
-            ptran.source_form = 'SHIP'
-            ptran.source_id = ship.id
-            ptran.from_quantity = stock
-            ptran.tran_quantity = 0 - tran_quantity
-            ptran.to_quantity = stock - tran_quantity
-            ptran.create_user = request.user
-            ptran.save()
-
-            #新增应收帐款单身
-            receivable_detail = ReceivableDetail()
-            receivable_detail.receivable = receivable
-            receivable_detail.product = product
-            receivable_detail.amount = product.tax_price * tran_quantity
-            receivable_detail.currency = product.currency
-            receivable_detail.save()
-
-            #减少商品库存量
-            product.stock = stock - tran_quantity
-            product.save()
-
-        order = form.cleaned_data.get('order')
-        #修改出货单状态
-        ship.is_active = True
-        today = datetime.datetime.now().date()
-        if today > order.etd:
-            ship.is_delay = True
-        ship.save()
-
-        #决定对应订单状态('A', '全部出货'),('P', '部分出货')，('O', '超额出货')如果有一个订单单身数量没有全部出完的话，则状态为P
-        order_products = OrderProduct.objects.filter(order=order)
-        ships = Ship.objects.filter(order=order)
-        status = 'A'
-        for order_product in order_products:
-            product = order_product.product
-            shipped_quantity = 0
-            for ship in ships.all():
-                ship_details = ShipDetail.objects.filter(product=product, ship=ship)
-                if ship_details.all().count() > 0:
-                    for ship_detail in ship_details.all():
-                        shipped_quantity += ship_detail.quantity
-
-            if shipped_quantity < order_product.quantity:
-                status = 'P'
-            else:
-                if shipped_quantity > order_product.quantity:
-                    #如果有商品是部分出货P，就算是有超额出货也还是算成P
-                    if status is 'P':
-                        status = 'P'
-                    else:
-                        status = 'O'
-
-        order.status = status
-        order.save()
-
-        #如果没有发生错误则修改应收帐款状态
-        receivable.is_active = True
-        receivable.save()
+        if not change:
+            post_ship(form.instance, request.user)
+        else:
+            #修改出货单不再重复过账，只重算订单单身的已出货数量
+            rebuild_order_lines([form.instance.order_id])
 
     def make_actived(self, request, queryset):
+        order_ids = list(queryset.values_list('order_id', flat=True).distinct())
         rows = queryset.update(is_active=False)
         if rows > 0:
+            #终止的出货单不再计入已出货数量
+            rebuild_order_lines(order_ids)
             self.message_user(request, u'已完成终止出货单动作')
     make_actived.allowed_permissions = ('active',)
     make_actived.short_description = u'终止出货单'
@@ -0,0 +1,54 @@
+from django.db import transaction
+from basic.bulk import BULK_BATCH_SIZE, check_lines, number_lines, prefetch_items
+from basic.models import Product
+from .models import OrderProduct, Ship, ShipDetail
+from .posting import post_ship
+from .status import refresh_order_status
+
+PRICE_FIELDS = ['id', 'title', 'status', 'price', 'tax', 'tax_price', 'currency_id']
+
+
+"""
+大量新增订单单身：
+1.一次取得所有商品的价格，在内存中检查单身并计算金额
+2.以bulk_create写入，不逐笔查询商品与项次
+3.重算订单状态
+"""
+def add_order_lines(order, lines):
+    products = prefetch_items(Product, [line.item for line in lines], PRICE_FIELDS)
+    existing = OrderProduct.objects.filter(order=order)
+    checked = check_lines(lines, products, u'商品', active_only=True,
+                          existing_ids=existing.values_list('product_id', flat=True))
+
+    details = []
+    for line, product in checked:
+        detail = OrderProduct(order=order, product_id=product.id, quantity=line.quantity,
+                              description=line.description)
+        detail.set_price(product)
+        details.append(detail)
+
+    with transaction.atomic():
+        number_lines(details, existing.values_list('num', flat=True))
+        OrderProduct.objects.bulk_create(details, batch_size=BULK_BATCH_SIZE)
+        refresh_order_status([order.id])
+    return details
+
+
+"""
+大量出货：
+1.一次取得所有商品的库存量，在内存中检查单身与库存
+2.新增出货单单头，以bulk_create写入出货单单身
+3.出货单过账(post_ship)，过账时会锁定商品并再次检查库存
+"""
+def add_ship_lines(order, lines, user):
+    products = prefetch_items(Product, [line.item for line in lines], ['id', 'title', 'stock'])
+    checked = check_lines(lines, products, u'商品', check_stock=True)
+
+    with transaction.atomic():
+        ship = Ship.objects.create(order=order, customer_id=order.customer_id, create_user=user)
+        details = [ShipDetail(ship=ship, product_id=product.id, quantity=line.quantity,
+                              description=line.description) for line, product in checked]
+        number_lines(details, [])
+        ShipDetail.objects.bulk_create(details, batch_size=BULK_BATCH_SIZE)
+        post_ship(ship, user)
+    return ship
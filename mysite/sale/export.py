@@ -0,0 +1,55 @@
+from decimal import Decimal
+from basic import masterdata
+from basic.export import filter_date_range, iter_rows
+from basic.models import Currency
+from .models import OrderProduct
+
+ORDER_HEADER = [u'订单id', 'PI #', 'PO #', u'客户', u'是否有效', u'状态', u'预定出货日期', u'订购时间', u'建立人员',
+                u'单身项次', u'商品id', u'商品', u'订购数量', u'未税金额', u'含税金额', u'小计未税金额', u'小计含税金额',
+                u'币别', u'描述']
+
+
+"""
+导出订单与订单单身，每个单身一行，依(订单id, 单身id)排序
+订单单头、客户、商品、币别与建立人员以join取得，不逐笔查询
+item: 商品id
+"""
+def order_rows(start=None, end=None, item=None):
+    lines = filter_date_range(OrderProduct.objects.all(), 'order__created', start, end)
+    if item:
+        lines = lines.filter(product_id=item)
+    fields = ['order_id', 'order__pi_no', 'order__po_no', 'order__customer__title', 'order__is_active',
+              'order__status', 'order__etd', 'order__created', 'order__create_user__username',
+              'num', 'product_id', 'product__title', 'quantity', 'price', 'tax_price', 'subtotal', 'tax_subtotal',
+              'currency__title', 'description', 'id']
+    rows = (row[:-1] for row in iter_rows(lines, fields, keys=('order_id', 'id')))
+    return ORDER_HEADER, rows
+
+
+MARGIN_HEADER = [u'订单id', 'PI #', u'客户', u'订购时间', u'单身项次', u'商品id', u'商品', u'订购数量', u'小计含税金额',
+                 u'币别', u'汇率', u'本位币金额', u'标准原料成本', u'毛利', u'毛利率']
+
+
+"""
+订单单身毛利报表，每个单身一行，依(订单id, 单身id)排序
+标准原料成本读取商品标准成本表(ProductCost)，币别名称与汇率由基本资料快取取得
+本位币金额 = 小计含税金额 * 汇率，毛利 = 本位币金额 - 标准原料成本 * 订购数量
+item: 商品id
+"""
+def margin_rows(start=None, end=None, item=None):
+    lines = filter_date_range(OrderProduct.objects.filter(order__is_active=True), 'order__created', start, end)
+    if item:
+        lines = lines.filter(product_id=item)
+    fields = ['order_id', 'order__pi_no', 'order__customer__title', 'order__created', 'num', 'product_id',
+              'product__title', 'quantity', 'tax_subtotal', 'currency_id', 'product__cost__material_cost', 'id']
+
+    def rows():
+        for row in iter_rows(lines, fields, keys=('order_id', 'id')):
+            quantity, tax_subtotal, currency_id, unit_cost = row[7], row[8], row[9], row[10]
+            currency = masterdata.get(Currency, currency_id)
+            amount = (tax_subtotal * currency.rate).quantize(Decimal('0.0001'))
+            cost = (unit_cost or 0) * quantity
+            margin = amount - cost
+            margin_rate = (margin / amount * 100).quantize(Decimal('0.01')) if amount else None
+            yield row[:9] + (currency.title, currency.rate, amount, cost, margin, margin_rate)
+    return MARGIN_HEADER, rows()
@@ -0,0 +1,24 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from basic.bulk import read_lines
+from sale.bulk import add_order_lines
+from sale.models import Order
+
+
+class Command(BaseCommand):
+    help = u'由CSV档案大量新增订单单身'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help=u'单身档案(CSV)，栏位为item,quantity,description')
+        parser.add_argument('--order', type=int, required=True, help=u'订单id')
+
+    def handle(self, *args, **options):
+        order = Order.objects.filter(id=options['order'], is_active=True).first()
+        if order is None:
+            raise CommandError(u'订单[{}]不存在或已终止'.format(options['order']))
+
+        try:
+            details = add_order_lines(order, read_lines(options['path']))
+        except ValidationError as e:
+            raise CommandError('\n'.join(e.messages))
+        self.stdout.write(u'订单[{}]新增单身 {} 笔'.format(order.pi_no, len(details)))
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from basic.bulk import read_lines
+from inventory.stock import StockShortage
+from sale.bulk import add_ship_lines
+from sale.models import Order
+
+
+class Command(BaseCommand):
+    help = u'由CSV档案大量出货，新增出货单并过账'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help=u'单身档案(CSV)，栏位为item,quantity,description')
+        parser.add_argument('--order', type=int, required=True, help=u'对应订单id')
+        parser.add_argument('--user', required=True, help=u'建立人员帐号')
+
+    def handle(self, *args, **options):
+        order = Order.objects.filter(id=options['order'], is_active=True).exclude(status='A').first()
+        if order is None:
+            raise CommandError(u'订单[{}]不存在、已终止或已全部出货'.format(options['order']))
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(u'帐号[{}]不存在'.format(options['user']))
+
+        try:
+            ship = add_ship_lines(order, read_lines(options['path']), user)
+        except ValidationError as e:
+            raise CommandError('\n'.join(e.messages))
+        except StockShortage as e:
+            raise CommandError(str(e))
+        self.stdout.write(u'已新增出货单[{}]'.format(ship.id))
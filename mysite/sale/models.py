@@ -2,6 +2,7 @@ from django import forms
 from django.db import models
 from django.urls import reverse
 from basic.models import Currency, Customer, Product
+from basic.numbering import format_num
 
 CAT_CHOICES = [
     ('1', 'CAT1'),
@@ -40,13 +41,17 @@ class Order(models.Model):
     class Meta:
         verbose_name = '订单'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['is_active', 'status']),
+            models.Index(fields=['po_no']),
+        ]
         permissions = (
             ('active_order', '可中止订单'),
         )
 
 
 class OrderProduct(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     order = models.ForeignKey(Order, verbose_name=u'订单单头', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, verbose_name=u'商品', on_delete=models.DO_NOTHING,
                                 limit_choices_to={'status': 'A'},)
@@ -56,24 +61,27 @@ class OrderProduct(models.Model):
     tax_price = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'含税金额')
     subtotal = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'小计未税金额')
     tax_subtotal = models.DecimalField(max_digits=16, decimal_places=4, blank=False, verbose_name=u'小计含税金额')
+    shipped_quantity = models.PositiveIntegerField(default=0, verbose_name=u'已出货数量')
+    tax_receive = models.DecimalField(max_digits=16, decimal_places=4, blank=False, default=0, verbose_name=u'已收含税金额')
     currency = models.ForeignKey(Currency, verbose_name=u'币别', blank=False, on_delete=models.DO_NOTHING)
     description = models.CharField(max_length=256, verbose_name=u'描述', blank=True)
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             order_products = OrderProduct.objects.filter(order=self.order)
-            num = "{0:02d}".format(order_products.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(order_products.count() + 1)
 
-        product = Product.objects.get(title=self.product)
+        self.set_price(self.product)
+        super().save(*args, **kwargs)
+
+    def set_price(self, product):
         self.price = product.price
         self.tax = product.tax
-        self.currency = product.currency
+        self.currency_id = product.currency_id
         self.tax_price = product.tax_price
         self.subtotal = product.price * self.quantity
         self.tax_subtotal = product.tax_price * self.quantity
-        super().save(*args, **kwargs)
 
     def __str__(self):
         return '{}'.format(self.num)
@@ -81,6 +89,10 @@ class OrderProduct(models.Model):
     class Meta:
         verbose_name = '订单单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['order', 'product']),
+            models.Index(fields=['product', 'order']),
+        ]
 
 
 class Ship(models.Model):
@@ -101,13 +113,17 @@ class Ship(models.Model):
     class Meta:
         verbose_name = '出货单'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['order', 'is_active']),
+            models.Index(fields=['created', 'id']),
+        ]
         permissions = (
             ('active_ship', '可中止出货单'),
         )
 
 
 class ShipDetail(models.Model):
-    num = models.CharField(max_length=2, default='', verbose_name=u'单身项次')
+    num = models.CharField(max_length=5, default='', verbose_name=u'单身项次')
     ship = models.ForeignKey(Ship, verbose_name=u'出货单单头', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, verbose_name=u'出货商品', on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(blank=False, verbose_name=u'出货数量')
@@ -115,10 +131,9 @@ class ShipDetail(models.Model):
 
     def save(self, *args, **kwargs):
         if self.num == '':
-            #项次的格式是01,02...
+            #项次的格式是00001,00002...
             ship_detail = ShipDetail.objects.filter(ship=self.ship)
-            num = "{0:02d}".format(ship_detail.count() + 1)
-            self.num = "{0:02d}".format(int(num))
+            self.num = format_num(ship_detail.count() + 1)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -127,4 +142,7 @@ class ShipDetail(models.Model):
     class Meta:
         verbose_name = '出货单单身'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['ship', 'product']),
+        ]
 
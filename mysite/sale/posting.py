@@ -0,0 +1,72 @@
+import datetime
+from django.db.models import IntegerField
+from basic import masterdata
+from basic.metrics import measure
+from basic.models import Period
+from basic.numbering import format_num
+from basic.status import add_to_lines
+from finance.models import Receivable, ReceivableDetail
+from inventory.stock import post_product_stock
+from .models import OrderProduct, ShipDetail
+from .status import refresh_order_status
+
+
+"""
+出货单过账，出货单单头与单身存盘后呼叫：
+1.新增应收帐款单头与单身(ReceivableDetail)
+2.新增商品库存异动(Ptran)并减少商品库存量(product.stock)
+3.将出货单的状态修改为有效出货(is_active=True)，检查出货日期是否有延迟(is_delay)
+4.累加订单单身的已出货数量(shipped_quantity)，重算对应订单状态
+"""
+@measure('posting:ship')
+def post_ship(ship, user):
+    order = ship.order
+
+    #新增应收帐款单头
+    receivable = Receivable()
+    receivable.ship = ship
+    receivable.customer = ship.customer
+    #应收日期=出货日期 + 帐期
+    period = masterdata.get(Period, ship.customer.period_id)
+    receivable.receivabled = datetime.datetime.now().date() + datetime.timedelta(days=period.period)
+    receivable.create_user = ship.create_user
+    receivable.save()
+
+    #新增应收帐款单身
+    ship_details = ShipDetail.objects.filter(ship=ship).select_related('product')
+    receivable_details = []
+    for i, ship_detail in enumerate(ship_details, 1):
+        product = ship_detail.product
+        receivable_detail = ReceivableDetail()
+        receivable_detail.num = format_num(i)
+        receivable_detail.receivable = receivable
+        receivable_detail.product = product
+        receivable_detail.amount = product.tax_price * ship_detail.quantity
+        receivable_detail.currency_id = product.currency_id
+        receivable_details.append(receivable_detail)
+    ReceivableDetail.objects.bulk_create(receivable_details, batch_size=500)
+
+    #新增商品库存异动并减少商品库存量
+    post_product_stock('SHIP', ship.id,
+                       [(d.product_id, 0 - d.quantity) for d in ship_details], user)
+
+    #修改出货单状态
+    ship.is_active = True
+    today = datetime.datetime.now().date()
+    if today > order.etd:
+        ship.is_delay = True
+    ship.save()
+
+    #累加订单单身的已出货数量
+    shipped = {}
+    for ship_detail in ship_details:
+        shipped[ship_detail.product_id] = shipped.get(ship_detail.product_id, 0) + ship_detail.quantity
+    add_to_lines(OrderProduct.objects.filter(order=order), 'product_id', 'shipped_quantity', shipped, IntegerField())
+
+    #决定对应订单状态('A', '全部出货'),('P', '部分出货')，('O', '超额出货')如果有一个订单单身数量没有全部出完的话，则状态为P
+    refresh_order_status([order.id])
+
+    #如果没有发生错误则修改应收帐款状态
+    receivable.is_active = True
+    receivable.save()
+    return receivable
@@ -0,0 +1,66 @@
+from django.db.models import DecimalField, F, IntegerField, Sum
+from basic.status import apply_statuses, in_chunks, set_lines
+from finance.models import ReceiveDetail
+from .models import Order, OrderProduct, ShipDetail
+
+
+"""
+各订单各商品的已出货数量(只计有效出货单)，回传{(订单id, 商品id): 数量}
+重建订单单身已出货数量(shipped_quantity)时使用
+"""
+def shipped_quantities(order_ids):
+    rows = ShipDetail.objects.filter(ship__order_id__in=order_ids, ship__is_active=True)\
+        .values('ship__order_id', 'product_id').annotate(total=Sum('quantity'))\
+        .values_list('ship__order_id', 'product_id', 'total')
+    return dict(((order_id, product_id), total) for order_id, product_id, total in rows)
+
+
+"""
+各订单各商品的已收含税金额(收款金额 + 折扣，只计有效收款单)，回传{(订单id, 商品id): 金额}
+重建订单单身已收含税金额(tax_receive)时使用
+"""
+def received_tax_amounts(order_ids):
+    rows = ReceiveDetail.objects.filter(receive__receivable__ship__order_id__in=order_ids, receive__is_active=True)\
+        .values('receive__receivable__ship__order_id', 'product_id').annotate(total=Sum(F('amount') + F('discount')))\
+        .values_list('receive__receivable__ship__order_id', 'product_id', 'total')
+    return dict(((order_id, product_id), total) for order_id, product_id, total in rows)
+
+
+"""
+订单单身的剩余出货数量，直接读取单身的已出货数量(shipped_quantity)
+回传(订单id, 商品id, 商品名称, 订购数量, 已出货数量)
+"""
+def remaining_order_lines(order_ids):
+    return OrderProduct.objects.filter(order_id__in=order_ids).order_by('order_id', 'id')\
+        .values_list('order_id', 'product_id', 'product__title', 'quantity', 'shipped_quantity')
+
+
+"""
+重算订单状态('N', '尚未出货'),('A', '全部出货'),('P', '部分出货'),('O', '超额出货')
+每批订单只需一个单身查询，已出货数量读取单身维护的栏位
+"""
+def refresh_order_status(order_ids):
+    statuses = {}
+    for ids in in_chunks(order_ids):
+        lines = OrderProduct.objects.filter(order_id__in=ids).values_list('order_id', 'quantity', 'shipped_quantity')
+        statuses.update(apply_statuses(Order, ids, lines))
+    return statuses
+
+
+"""
+由出货单与收款单重新合计订单单身的已出货数量与已收含税金额，再重算订单状态
+出货单终止或资料修正后使用
+"""
+def rebuild_order_lines(order_ids):
+    for ids in in_chunks(order_ids):
+        shipped = shipped_quantities(ids)
+        received = received_tax_amounts(ids)
+        shipped_values = {}
+        received_values = {}
+        for line_id, order_id, product_id in OrderProduct.objects.filter(order_id__in=ids)\
+                .values_list('id', 'order_id', 'product_id'):
+            shipped_values[line_id] = shipped.get((order_id, product_id)) or 0
+            received_values[line_id] = received.get((order_id, product_id)) or 0
+        set_lines(OrderProduct, 'shipped_quantity', shipped_values, IntegerField())
+        set_lines(OrderProduct, 'tax_receive', received_values, DecimalField(max_digits=16, decimal_places=4))
+    return refresh_order_status(order_ids)
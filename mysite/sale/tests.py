@@ -1,3 +1,260 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+import csv
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.test import TestCase
+from django.urls import reverse
+from finance.models import Receivable
+from basic.bulk import BulkLine
+from basic.models import Currency, Customer, Period, Product, Size
+from basic.testing import QueryPlanMixin
+from .bulk import add_order_lines, add_ship_lines
+from inventory.models import Ptran
+from .models import Order, OrderProduct, Ship, ShipDetail
+from .status import rebuild_order_lines
 
-# Create your tests here.
+
+class SaleQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_open_orders(self):
+        self.assertUsesIndex(Order.objects.filter(is_active=True, status='N'))
+
+    def test_order_product_by_order_and_product(self):
+        self.assertUsesIndex(OrderProduct.objects.filter(order_id=1, product_id=1))
+
+    def test_order_product_by_product(self):
+        self.assertUsesIndex(OrderProduct.objects.filter(product_id__in=[1, 2]).values('order_id'))
+
+    def test_active_ships_of_order(self):
+        self.assertUsesIndex(Ship.objects.filter(order_id=1, is_active=True))
+
+    def test_ship_detail_by_ship_and_product(self):
+        self.assertUsesIndex(ShipDetail.objects.filter(ship_id=1, product_id=1))
+
+
+class OrderFixtureMixin:
+    def setUp(self):
+        self.user = User.objects.create_superuser('user', 'user@example.com', 'user')
+        self.rmb = Currency.objects.create(id='RMB', title=u'人民币', rate=1)
+        self.customer = Customer.objects.create(title='C', period=Period.objects.create(title='P', period=30),
+                                                status='A')
+        size = Size.objects.create(title='Z', status='A')
+        self.products = [Product.objects.create(title='P{}'.format(i), size=size, image_sub='-', price=2, tax=0,
+                                                tax_price=2, currency=self.rmb, stock=100, status='A')
+                         for i in range(1, 3)]
+        self.order = Order.objects.create(cat_id='1', pi_no='R201901001', customer=self.customer, etd=datetime.date(2019, 1, 31),
+                                          create_user=self.user)
+        add_order_lines(self.order, [BulkLine(row, product.id, 10) for row, product in enumerate(self.products, 1)])
+
+    def ship(self, *quantities):
+        return add_ship_lines(self.order, [BulkLine(row, product.id, quantity) for row, (product, quantity)
+                                           in enumerate(zip(self.products, quantities), 1)], self.user)
+
+    def shipped(self):
+        return list(OrderProduct.objects.filter(order=self.order).order_by('id')
+                    .values_list('shipped_quantity', flat=True))
+
+    def status(self):
+        return Order.objects.get(id=self.order.id).status
+
+
+class OrderStatusTests(OrderFixtureMixin, TestCase):
+    def test_ship_transitions(self):
+        self.assertEqual(self.status(), 'N')
+        self.ship(4, 0)
+        self.assertEqual((self.shipped(), self.status()), ([4, 0], 'P'))
+        self.ship(6, 10)
+        self.assertEqual((self.shipped(), self.status()), ([10, 10], 'A'))
+        over = self.ship(0, 1)
+        self.assertEqual((self.shipped(), self.status()), ([10, 11], 'O'))
+
+        #终止的出货单不计入已出货数量
+        Ship.objects.filter(id=over.id).update(is_active=False)
+        self.assertEqual(rebuild_order_lines([self.order.id]), {self.order.id: 'A'})
+        self.assertEqual(self.shipped(), [10, 10])
+        Ship.objects.update(is_active=False)
+        rebuild_order_lines([self.order.id])
+        self.assertEqual((self.shipped(), self.status()), ([0, 0], 'N'))
+
+    def test_resave_ship_in_admin(self):
+        ship = self.ship(4, 0)
+        self.client.force_login(self.user)
+        details = list(ShipDetail.objects.filter(ship=ship).order_by('id'))
+        data = {'order': self.order.id, 'shipdetail_set-TOTAL_FORMS': str(len(details)),
+                'shipdetail_set-INITIAL_FORMS': str(len(details)), 'shipdetail_set-MIN_NUM_FORMS': '0',
+                'shipdetail_set-MAX_NUM_FORMS': '1000'}
+        for i, detail in enumerate(details):
+            for key, value in [('id', detail.id), ('ship', ship.id), ('product', detail.product_id),
+                               ('quantity', detail.quantity), ('description', 'changed')]:
+                data['shipdetail_set-{}-{}'.format(i, key)] = value
+        response = self.client.post(reverse('admin:sale_ship_change', args=[ship.id]), data)
+        self.assertEqual(response.status_code, 302)
+
+        #修改出货单不再重复过账：已出货数量、库存与应收帐款都不变
+        self.assertEqual((self.shipped(), self.status()), ([4, 0], 'P'))
+        self.assertEqual(list(Product.objects.order_by('id').values_list('stock', flat=True)), [96, 100])
+        self.assertEqual(Ptran.objects.count(), 2)
+        self.assertEqual(Receivable.objects.filter(ship=ship).count(), 1)
+
+
+class BulkLoadTests(OrderFixtureMixin, TestCase):
+    def new_order(self):
+        return Order.objects.create(cat_id='1', pi_no='R201901002', customer=self.customer,
+                                    etd=datetime.date(2019, 1, 31), create_user=self.user)
+
+    def test_every_error_reported_with_row(self):
+        Product.objects.filter(id=self.products[1].id).update(status='W')
+        lines = [BulkLine(2, 'P1', 'x'), BulkLine(3, 'P9', 1), BulkLine(4, self.products[0].id, -1),
+                 BulkLine(5, 'P1', 1), BulkLine(6, 'P2', 1)]
+        with self.assertRaises(ValidationError) as raised:
+            add_order_lines(self.new_order(), lines)
+        self.assertEqual([message[:4] for message in raised.exception.messages],
+                         [u'第2行：', u'第3行：', u'第4行：', u'第5行：', u'第6行：'])
+        self.assertIn(u'已重复', raised.exception.messages[3])
+        self.assertIn(u'尚未核准', raised.exception.messages[4])
+
+        #不得与订单已有的单身重复，新单身接续已有的项次
+        with self.assertRaises(ValidationError):
+            add_order_lines(self.order, [BulkLine(2, 'P1', 1)])
+        product = Product.objects.create(title='P3', size=self.products[0].size, image_sub='-', price=2, tax=0,
+                                         tax_price=2, currency=self.rmb, status='A')
+        self.assertEqual([detail.num for detail in add_order_lines(self.order, [BulkLine(2, 'P3', 5)])], ['00003'])
+
+        with self.assertRaises(ValidationError):
+            self.ship(200, 0)
+        self.assertFalse(Ship.objects.exists())
+
+    def test_commands_read_csv(self):
+        path = os.path.join(tempfile.mkdtemp(), 'lines.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('item,quantity,description\nP1,3,first\n{},4,\n'.format(self.products[1].id))
+        order = self.new_order()
+        out = StringIO()
+        call_command('load_order_lines', path, order=order.id, stdout=out)
+        self.assertEqual(list(OrderProduct.objects.filter(order=order).order_by('num')
+                              .values_list('num', 'product__title', 'quantity', 'description', 'subtotal')),
+                         [('00001', 'P1', 3, 'first', 6), ('00002', 'P2', 4, '', 8)])
+        call_command('load_ship_lines', path, order=order.id, user='user', stdout=out)
+        self.assertEqual(Order.objects.get(id=order.id).status, 'A')
+        with self.assertRaises(CommandError):
+            call_command('load_order_lines', path, order=order.id, stdout=out)
+
+    def test_ten_thousand_lines(self):
+        size = self.products[0].size
+        Product.objects.bulk_create([Product(title='B{:05d}'.format(i), size=size, image_sub='-', price=2, tax=0,
+                                             tax_price=2, currency=self.rmb, stock=5, status='A')
+                                     for i in range(10000)])
+        order = self.new_order()
+        params = []
+
+        def count_params(execute, sql, query_params, many, context):
+            if not many:
+                params.append((sql.split(' ', 1)[0], len(query_params or ())))
+            return execute(sql, query_params, many, context)
+
+        lines = [BulkLine(row, 'B{:05d}'.format(i), 5) for row, i in enumerate(range(10000), 2)]
+        with connection.execute_wrapper(count_params):
+            add_order_lines(order, lines)
+            add_ship_lines(order, [BulkLine(line.row, line.item, 2) for line in lines], self.user)
+        #CASE UPDATE分批后参数不超过SQLite旧版的999个上限，其他查询不超过MySQL的65535个，查询次数与单身笔数无关
+        self.assertLessEqual(max(count for verb, count in params if verb == 'UPDATE'), 999)
+        self.assertLessEqual(max(count for verb, count in params), 65535)
+        self.assertLess(len(params), 300)
+
+        details = OrderProduct.objects.filter(order=order)
+        self.assertEqual(list(details.order_by('num').values_list('id', flat=True)),
+                         list(details.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(details.order_by('-num').values_list('num', flat=True)[0], '10000')
+        self.assertEqual(set(details.values_list('shipped_quantity', flat=True)), {2})
+        self.assertEqual(Order.objects.get(id=order.id).status, 'P')
+        self.assertEqual(set(Product.objects.filter(title__startswith='B').values_list('stock', flat=True)), {3})
+        self.assertEqual(Ptran.objects.filter(source_form='SHIP').count(), 10000)
+
+
+class ExportViewTests(OrderFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+
+    def test_order_export(self):
+        rows = self.export('sale:order_export', item=self.products[1].id)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][9:12], ['00002', str(self.products[1].id), 'P2'])
+        self.assertEqual(rows[1][17], u'人民币')
+        self.assertEqual(len(self.export('sale:order_export', date_to='2000-01-01')), 1)
+        self.assertEqual(len(self.export('sale:order_export')), 3)
+
+    def test_tran_export_filters(self):
+        self.ship(3, 4)
+        rows = self.export('inventory:ptran_export', item=self.products[0].id, source_form='SHIP')
+        self.assertEqual([row[6:9] for row in rows[1:]], [['100', '-3', '97']])
+        self.assertEqual(len(self.export('inventory:ptran_export', source_form='OTHER')), 1)
+
+    def test_bad_filters(self):
+        for name, params in [('sale:order_export', {'item': 'abc'}),
+                             ('inventory:mtran_export', {'item': '1.5'}),
+                             ('sale:order_margin_export', {'date_from': '2019/01/01'})]:
+            response = self.client.get(reverse(name), params)
+            self.assertEqual(response.status_code, 400, name)
+            self.assertEqual(response.json()['code'], 1)
+
+
+class OrderProductListViewTests(OrderFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        return self.client.get(reverse('sale:order_ajax_product_list'), params).json()
+
+    def remaining(self, products):
+        return [(product['product']['title'], product['quantity']) for product in products]
+
+    def test_single_order(self):
+        response = self.get(id=self.order.id)
+        self.assertEqual((response['code'], response['msg']), (0, ''))
+        self.assertEqual(self.remaining(response['products']), [('P1', 10), ('P2', 10)])
+
+        ship = self.ship(4, 10)
+        response = self.get(id=self.order.id)
+        self.assertEqual(self.remaining(response['products']), [('P1', 6), ('P2', 0)])
+        self.assertIn(str(ship.id), response['msg'])
+
+        #终止的出货单重算后不扣除剩余数量
+        Ship.objects.filter(id=ship.id).update(is_active=False)
+        rebuild_order_lines([self.order.id])
+        response = self.get(id=self.order.id)
+        self.assertEqual(self.remaining(response['products']), [('P1', 10), ('P2', 10)])
+        self.assertEqual(response['msg'], '')
+
+    def test_many_orders_in_fixed_queries(self):
+        other = Order.objects.create(cat_id='1', pi_no='R201901002', customer=self.customer,
+                                     etd=datetime.date(2019, 1, 31), create_user=self.user)
+        add_order_lines(other, [BulkLine(1, self.products[1].id, 7)])
+        ship = self.ship(3, 0)
+
+        self.get(id=self.order.id)
+        with CaptureQueriesContext(connection) as one:
+            self.get(ids=str(self.order.id))
+        with CaptureQueriesContext(connection) as both:
+            response = self.get(ids='{},x,{}'.format(other.id, self.order.id))
+        self.assertEqual(len(one), len(both))
+        self.assertEqual([(order['id'], order['ships'], self.remaining(order['products']))
+                          for order in response['orders']],
+                         [(other.id, [], [('P2', 7)]), (self.order.id, [ship.id], [('P1', 7), ('P2', 10)])])
+
+    def test_bad_id_and_permission(self):
+        self.assertEqual(self.get(id='abc')['code'], 1)
+        self.assertEqual(self.get()['code'], 1)
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.get(id=self.order.id)['code'], 1)
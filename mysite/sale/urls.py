@@ -6,4 +6,6 @@ app_name = 'sale'
 
 urlpatterns = [
     path('order/ajax/list/', views.order_ajax_product_list, name='order_ajax_product_list'),
+    path('order/export/', views.order_export, name='order_export'),
+    path('order/margin/export/', views.order_margin_export, name='order_margin_export'),
 ]
@@ -1,39 +1,61 @@
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
-from .models import Order, OrderProduct, Ship, ShipDetail
+from .export import margin_rows, order_rows
+from .models import Ship
+from .status import remaining_order_lines
+from basic.export import export_csv
 
 
+"""
+订单单身剩余出货数量，出货单选择对应订单时使用
+1.id为单一订单，回传products与msg(已有的对应出货单)
+2.ids为多个订单id(以逗号分隔)，回传orders，每个订单包含ships与products，供一次预载多个订单
+剩余数量 = 订购数量 - 有效出货单出货数量合计，以一个查询取得所有订单单身
+"""
 def order_ajax_product_list(request):
     return_dict = {}
     #判断用户是否有权限检视订单
     if request.user.has_perm('sale.view_order'):
-        order_id = request.GET.get('id')
-        order = Order.objects.get(id=order_id)
+        if request.GET.get('ids'):
+            order_ids = [order_id for order_id in request.GET.get('ids').split(',') if order_id.strip().isdigit()]
+        else:
+            order_ids = [request.GET.get('id')]
+        try:
+            order_ids = [int(order_id) for order_id in order_ids]
+        except (TypeError, ValueError):
+            return_dict['code'] = 1
+            return_dict['msg'] = u"订单id格式错误"
+            return JsonResponse(return_dict)
+
+        orders = dict((order_id, {'id': order_id, 'ships': [], 'products': []}) for order_id in order_ids)
+        for order_id, product_id, title, quantity, shipped in remaining_order_lines(order_ids):
+            product_info = {'id': product_id, 'title': title}
+            orders[order_id]['products'].append({'product': product_info, 'quantity': quantity - shipped})
+
+        ships = Ship.objects.filter(order_id__in=order_ids, is_active=True).order_by('id')
+        for order_id, ship_id in ships.values_list('order_id', 'id'):
+            orders[order_id]['ships'].append(ship_id)
+
         return_dict['code'] = 0
         return_dict['msg'] = ''
-        return_dict['products'] = []
-        order_products = OrderProduct.objects.filter(order=order)
-
-        for p in order_products.all():
-            product = p.product
-            quantity = p.quantity
-
-            # 如果该订单有其他对应出货单，则需扣掉已出货的商品数量
-            ships = Ship.objects.filter(order=order, is_active=True)
-            if ships.count() > 0:
-                return_dict['msg'] = u'此订单已有对应出货单，出货单单号如下：'
-                for s in ships.all():
-                    return_dict['msg'] += ' ' + str(s.id)
-                    ship_product = ShipDetail.objects.filter(ship=s, product=product)
-                    if ship_product.all().count() > 0:
-                        quantity -= ship_product[0].quantity
-
-            product_info = {}
-            product_info['id'] = product.id
-            product_info['title'] = product.title
-            product_dict = {'product': product_info, 'quantity': quantity}
-            return_dict['products'].append(product_dict)
+        if request.GET.get('ids'):
+            return_dict['orders'] = [orders[order_id] for order_id in order_ids]
+        else:
+            order = orders[order_ids[0]]
+            return_dict['products'] = order['products']
+            # 如果该订单有其他对应出货单，列出出货单单号
+            if order['ships']:
+                return_dict['msg'] = u'此订单已有对应出货单，出货单单号如下：' + ''.join(
+                    ' ' + str(ship_id) for ship_id in order['ships'])
     else:
         return_dict['code'] = 1
         return_dict['msg'] = u"您无权限浏览订单"
     return JsonResponse(return_dict)
 
+
+def order_export(request):
+    return export_csv(request, 'sale.view_order', 'order', order_rows)
+
+
+#毛利报表含成本资料，需有检视商品标准成本的权限
+def order_margin_export(request):
+    return export_csv(request, 'basic.view_productcost', 'order_margin', margin_rows)